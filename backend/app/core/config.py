@@ -10,7 +10,69 @@ class Settings(BaseSettings):
     db_schema_path: str = "app/schema.sql"
     db_init_mode: str = "create"  # create | recreate
 
-    max_concurrent_scans: int = 4
+    # Single-writer queue: writes are grouped into one transaction per flush window
+    db_write_queue_size: int = 1024
+    db_write_flush_ms: int = 20
+    db_write_batch_max: int = 256
+
+    # Max concurrently borrowed read cursors (get_read_connection)
+    db_read_pool_size: int = 4
+
+    # Traffic history retention: raw rows -> 5 minute buckets -> dropped; hourly buckets are kept forever
+    traffic_raw_retention_hours: int = 48
+    traffic_5m_retention_days: int = 30
+    traffic_compaction_interval_seconds: int = 3600
+
+    # AdGuard querylog paging: entries per request and max requests per sync run
+    adguard_querylog_page_size: int = 500
+    adguard_querylog_max_pages: int = 20
+
+    # Unchanged retained MQTT payloads are re-sent at most this often (and after reconnects)
+    mqtt_republish_interval_seconds: int = 3600
+    # Outgoing MQTT queue: max pending topics, messages sent per drain step, and an
+    # optional file the pending queue is saved to on shutdown ("" = memory only)
+    mqtt_queue_max: int = 5000
+    mqtt_publish_batch_size: int = 100
+    mqtt_queue_path: str = ""
+
+    # Queued scans run concurrently up to this many; interactive scans get one extra slot
+    max_concurrent_scans: int = 1
+
+    # Process-wide probe budget shared by all scans: sockets/pings in flight, new
+    # probes per second (0 = unlimited), and probes in flight per host
+    scan_max_inflight: int = 64
+    scan_max_pps: int = 200
+    scan_per_host_inflight: int = 8
+
+    # Discovery sweeps large targets in chunks of this prefix length (progress is reported per chunk)
+    discovery_chunk_prefix: int = 24
+
+    # Passive discovery sniffer (ARP/DHCP/mDNS/SSDP); iface "" = Scapy's default interface.
+    # Sightings are upserted every flush_seconds; an unchanged device at most every refresh_seconds.
+    passive_discovery_enabled: bool = False
+    passive_discovery_iface: str = ""
+    passive_discovery_flush_seconds: float = 5.0
+    passive_discovery_refresh_seconds: int = 300
+
+    # Presence monitor: follows the kernel neighbor table (netlink events + polling) and
+    # marks devices offline only after offline_after_seconds missing and unanswered
+    presence_monitor_enabled: bool = False
+    presence_poll_seconds: float = 10.0
+    presence_offline_after_seconds: int = 180
+    presence_touch_seconds: int = 60
+
+    # Hostname resolution during scans: PTR via reverse_dns_server ("" = /etc/resolv.conf),
+    # then mDNS/NetBIOS. Names are cached for ttl_seconds, failed lookups for negative_ttl_seconds.
+    reverse_dns_server: str = ""
+    reverse_dns_timeout: float = 2.0
+    hostname_cache_ttl_seconds: int = 86400
+    hostname_cache_negative_ttl_seconds: int = 3600
+
+    # Discovery reuses a device's known open ports instead of re-probing them until the
+    # list is older than port_cache_ttl_hours (0 = always probe) or the device changed IP;
+    # port_cache_sample_rate of the cached hosts are re-probed anyway on each scan
+    port_cache_ttl_hours: float = 6.0
+    port_cache_sample_rate: float = 0.05
     default_subnet: str = "192.168.1.0/24"
 
     class Config:
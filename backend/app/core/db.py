@@ -1,13 +1,23 @@
 import duckdb
 from pathlib import Path
 from app.core.config import get_settings
+import asyncio
+import concurrent.futures
+import json
 import logging
+import queue
 import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
 _shared_conn: duckdb.DuckDBPyConnection = None
 _db_lock = threading.RLock()
+_main_catalog: Optional[str] = None
+
+# Catalog name the DNS logs database is attached under (see app.core.dns_db)
+DNS_CATALOG = "dns"
 
 def get_db_lock():
     """Returns the global database lock for maintenance operations."""
@@ -19,7 +29,7 @@ def get_connection() -> duckdb.DuckDBPyConnection:
     This pattern is much more stable on Windows to prevent 'Database is locked' errors.
     The shared connection handles the file lock, and each call returns a thread-safe cursor.
     """
-    global _shared_conn
+    global _shared_conn, _main_catalog
     with _db_lock:
         if _shared_conn is None:
             settings = get_settings()
@@ -32,14 +42,133 @@ def get_connection() -> duckdb.DuckDBPyConnection:
             # Optimize DuckDB for concurrency
             _shared_conn.execute("SET threads TO 4")
             _shared_conn.execute("SET memory_limit = '512MB'")
+            _main_catalog = _shared_conn.execute("SELECT current_database()").fetchone()[0]
+
+            # The DNS logs database lives next to the main file and is attached to this
+            # instance, so both share one buffer pool and thread budget and can be joined in SQL.
+            dns_db_path = db_path.parent / "dns_logs.duckdb"
+            logger.info(f"Attaching DNS database at {dns_db_path}")
+            _shared_conn.execute(f"ATTACH IF NOT EXISTS '{dns_db_path}' AS {DNS_CATALOG}")
+            from app.core.dns_db import init_dns_schema
+            init_dns_schema(_shared_conn.cursor())
         
         # Return a cursor based on the master connection
         return _shared_conn.cursor()
 
+# --- Read cursor pool ---
+# SELECT-only work (routers, dashboards) borrows cursors from a small pool instead of
+# opening one per request. Each cursor runs in its own MVCC snapshot, so readers
+# never wait on the writer thread's open transaction.
+
+_read_pool: List[duckdb.DuckDBPyConnection] = []
+_read_pool_lock = threading.Lock()
+_read_generation = 0
+_read_slots: Optional[threading.BoundedSemaphore] = None
+
+class ReadConnection:
+    """Pooled read cursor. Behaves like a DuckDB cursor; close() returns it to the pool."""
+
+    def __init__(self, cursor: duckdb.DuckDBPyConnection, generation: int, reset: Optional[Callable] = None):
+        self._cursor = cursor
+        self._generation = generation
+        self._reset = reset
+
+    def __getattr__(self, name):
+        cursor = self.__dict__.get("_cursor")
+        if cursor is None:
+            raise duckdb.ConnectionException("Read connection already closed")
+        return getattr(cursor, name)
+
+    def close(self) -> None:
+        cursor = self.__dict__.get("_cursor")
+        if cursor is None:
+            return
+        self._cursor = None
+        _release_read_cursor(cursor, self._generation, self.__dict__.get("_reset"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+def _get_read_slots() -> threading.BoundedSemaphore:
+    global _read_slots
+    if _read_slots is None:
+        with _read_pool_lock:
+            if _read_slots is None:
+                _read_slots = threading.BoundedSemaphore(max(1, get_settings().db_read_pool_size))
+    return _read_slots
+
+def get_read_connection(reset: Optional[Callable[[duckdb.DuckDBPyConnection], None]] = None) -> ReadConnection:
+    """
+    Returns a pooled cursor for SELECT-only work.
+    Blocks while all db_read_pool_size cursors are in use. Always close() it.
+    reset, if given, runs on the cursor before it returns to the pool (e.g. to undo a USE).
+    """
+    _get_read_slots().acquire()
+    try:
+        with _read_pool_lock:
+            generation = _read_generation
+            cursor = _read_pool.pop() if _read_pool else None
+        if cursor is None:
+            cursor = get_connection()
+        return ReadConnection(cursor, generation, reset)
+    except Exception:
+        _read_slots.release()
+        raise
+
+def _release_read_cursor(cursor: duckdb.DuckDBPyConnection, generation: int, reset: Optional[Callable] = None) -> None:
+    try:
+        if reset is not None:
+            try:
+                reset(cursor)
+            except Exception as e:
+                # A cursor left in an unknown state must not be handed to the next reader
+                logger.warning(f"Dropping read cursor that could not be reset: {e}")
+                try:
+                    cursor.close()
+                except Exception:
+                    pass
+                return
+        with _read_pool_lock:
+            if generation == _read_generation:
+                _read_pool.append(cursor)
+                return
+        # Pool was reset (connection closed for backup/restore); drop the stale cursor
+        try:
+            cursor.close()
+        except Exception:
+            pass
+    finally:
+        _read_slots.release()
+
+def _reset_read_pool() -> None:
+    global _read_generation
+    with _read_pool_lock:
+        _read_generation += 1
+        stale = list(_read_pool)
+        _read_pool.clear()
+    for cursor in stale:
+        try:
+            cursor.close()
+        except Exception:
+            pass
+
+def get_main_catalog() -> str:
+    """Returns the catalog name of the main database (derived from the file name)."""
+    if _main_catalog is None:
+        get_connection().close()
+    return _main_catalog
+
 def close_shared_connection():
     """Closes the global shared connection. Useful for operations like restore or backup."""
     global _shared_conn
     with _db_lock:
+        _reset_read_pool()
         if _shared_conn:
             try:
                 _shared_conn.close()
@@ -58,6 +187,230 @@ def commit(conn=None) -> None:
         if _shared_conn:
             _shared_conn.commit()
 
+def json_batch(columns: Dict[str, str]) -> str:
+    """
+    Returns a SELECT producing one row per element of a columnar JSON document
+    ({"col": [...], ...}, types given by `columns`). Bind json.dumps(document) as its
+    single parameter. Binding Python lists element by element, or executemany, is far
+    slower for bulk writes than letting DuckDB parse one string.
+    """
+    shape = json.dumps({c: f"{t}[]" for c, t in columns.items()})
+    select = ", ".join(f"unnest(b.{c}) AS {c}" for c in columns)
+    return f"SELECT {select} FROM (SELECT from_json(?, '{shape}') AS b)"
+
+# --- Single-writer queue ---
+# All background and API writes are funnelled through one writer thread.
+# The writer drains the queue and runs everything it collected within one
+# flush window inside a single transaction (group commit).
+
+class _WriteOp:
+    __slots__ = ("fn", "args", "kwargs", "future", "transactional")
+
+    def __init__(self, fn, args, kwargs, transactional=True):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = concurrent.futures.Future()
+        self.transactional = transactional
+
+_write_queue: Optional[queue.Queue] = None
+_writer_thread: Optional[threading.Thread] = None
+_writer_start_lock = threading.Lock()
+_writer_local = threading.local()
+# Waits for queue space on behalf of submit_write_nowait callers; one thread keeps FIFO order
+_overflow_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+
+def _ensure_writer() -> queue.Queue:
+    global _write_queue, _writer_thread
+    if _writer_thread is not None and _writer_thread.is_alive():
+        return _write_queue
+    with _writer_start_lock:
+        if _writer_thread is None or not _writer_thread.is_alive():
+            settings = get_settings()
+            if _write_queue is None:
+                _write_queue = queue.Queue(maxsize=settings.db_write_queue_size)
+            _writer_thread = threading.Thread(target=_writer_loop, name="duckdb-writer", daemon=True)
+            _writer_thread.start()
+            logger.info("Database writer thread started.")
+    return _write_queue
+
+def _is_writer_thread() -> bool:
+    return threading.current_thread() is _writer_thread
+
+def _run_op(conn, op: _WriteOp):
+    return op.fn(conn, *op.args, **op.kwargs)
+
+def commit_checked(conn) -> None:
+    """
+    Commits, raising if the transaction was aborted. After a failed statement DuckDB
+    aborts the transaction and commit() silently discards it, so an op that caught
+    its own DB error would otherwise lose every write grouped with it.
+    """
+    conn.execute("SELECT 1")
+    conn.commit()
+
+def _flush_group(group: List[_WriteOp]) -> None:
+    """Runs a group of ops in one transaction. On failure, replays them one by one."""
+    if not group:
+        return
+    conn = get_connection()
+    _writer_local.conn = conn
+    try:
+        results = []
+        try:
+            conn.begin()
+            for op in group:
+                results.append(_run_op(conn, op))
+            commit_checked(conn)
+        except Exception as e:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            if len(group) == 1:
+                group[0].future.set_exception(e)
+                return
+            # Isolate the failing op so the rest of the batch still lands
+            logger.warning(f"Grouped write of {len(group)} ops failed ({e}); retrying individually.")
+            for op in group:
+                try:
+                    conn.begin()
+                    result = _run_op(conn, op)
+                    commit_checked(conn)
+                    op.future.set_result(result)
+                except Exception as op_err:
+                    try:
+                        conn.rollback()
+                    except Exception:
+                        pass
+                    op.future.set_exception(op_err)
+            return
+
+        for op, result in zip(group, results):
+            op.future.set_result(result)
+    finally:
+        _writer_local.conn = None
+        conn.close()
+
+def _run_exclusive(op: _WriteOp) -> None:
+    """Runs an op outside of any grouped transaction (e.g. backup/restore)."""
+    try:
+        op.future.set_result(op.fn(*op.args, **op.kwargs))
+    except Exception as e:
+        op.future.set_exception(e)
+
+def _writer_loop() -> None:
+    settings = get_settings()
+    flush_window = settings.db_write_flush_ms / 1000.0
+    batch_max = settings.db_write_batch_max
+    q = _write_queue
+
+    while True:
+        batch = [q.get()]
+        deadline = time.monotonic() + flush_window
+        while len(batch) < batch_max:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(q.get(timeout=remaining) if remaining > 0 else q.get_nowait())
+            except queue.Empty:
+                break
+
+        group: List[_WriteOp] = []
+        for op in batch:
+            if op.future.cancelled():
+                continue
+            if op.transactional:
+                group.append(op)
+                continue
+            try:
+                _flush_group(group)
+            except Exception as e:
+                logger.error(f"Database writer flush failed: {e}")
+                for g in group:
+                    if not g.future.done():
+                        g.future.set_exception(e)
+            group = []
+            _run_exclusive(op)
+        try:
+            _flush_group(group)
+        except Exception as e:
+            logger.error(f"Database writer flush failed: {e}")
+            for g in group:
+                if not g.future.done():
+                    g.future.set_exception(e)
+
+def _enqueue(op: _WriteOp) -> concurrent.futures.Future:
+    q = _ensure_writer()
+    q.put(op)
+    return op.future
+
+def submit_write(fn: Callable[..., Any], *args, **kwargs) -> concurrent.futures.Future:
+    """
+    Queues fn(conn, *args, **kwargs) for the writer thread and returns a Future.
+    fn runs inside a shared transaction and must not commit on its own.
+    Blocks if the write queue is full.
+    """
+    return _enqueue(_WriteOp(fn, args, kwargs))
+
+def _log_write_failure(fn: Callable[..., Any], future: concurrent.futures.Future) -> None:
+    if not future.cancelled() and future.exception():
+        logger.error(f"Queued write {getattr(fn, '__name__', fn)} failed: {future.exception()}")
+
+def submit_write_nowait(fn: Callable[..., Any], *args, **kwargs) -> concurrent.futures.Future:
+    """
+    Fire-and-forget variant of submit_write that never blocks the caller, for the event
+    loop and library callback threads. When the queue is full the op waits for room on
+    a helper thread instead. Failures are logged, since nobody awaits the Future.
+    """
+    global _overflow_executor
+    op = _WriteOp(fn, args, kwargs)
+    op.future.add_done_callback(lambda f: _log_write_failure(fn, f))
+    q = _ensure_writer()
+    try:
+        q.put_nowait(op)
+    except queue.Full:
+        with _writer_start_lock:
+            if _overflow_executor is None:
+                _overflow_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="duckdb-overflow")
+        _overflow_executor.submit(q.put, op)
+    return op.future
+
+def run_write(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Blocking variant of submit_write for code already running in a worker thread.
+    Called from the writer thread itself (nested writes), fn runs inline.
+    """
+    if _is_writer_thread():
+        conn = getattr(_writer_local, "conn", None)
+        if conn is not None:
+            return fn(conn, *args, **kwargs)
+        conn = get_connection()
+        try:
+            return fn(conn, *args, **kwargs)
+        finally:
+            conn.close()
+    return submit_write(fn, *args, **kwargs).result()
+
+async def write_async(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """Awaitable variant of submit_write for use on the event loop."""
+    op = _WriteOp(fn, args, kwargs)
+    q = _ensure_writer()
+    try:
+        q.put_nowait(op)
+    except queue.Full:
+        # Apply backpressure without stalling the event loop
+        await asyncio.to_thread(q.put, op)
+    return await asyncio.wrap_future(op.future)
+
+def run_exclusive(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Runs fn(*args, **kwargs) on the writer thread between batches, with no other
+    writes in flight. Used for maintenance like backup and restore.
+    """
+    if _is_writer_thread():
+        return fn(*args, **kwargs)
+    return _enqueue(_WriteOp(fn, args, kwargs, transactional=False)).result()
+
 def init_db() -> None:
     settings = get_settings()
     print(f"Initializing database at {settings.db_path}...")
@@ -74,13 +427,10 @@ def init_db() -> None:
                 DROP TABLE IF EXISTS scans;
                 DROP TABLE IF EXISTS config;
                 DROP TABLE IF EXISTS classification_rules;
+                DROP TABLE IF EXISTS schema_version;
             """)
 
-        print(f"Loading schema from {settings.db_schema_path}...")
-        schema_sql = Path(settings.db_schema_path).read_text(encoding="utf-8")
-        conn.execute(schema_sql)
-        
-        # Migrations
+        # Migrations (no-op when the database is already at the latest version)
         migrate_db(conn)
         
         # Seeding
@@ -94,45 +444,32 @@ def init_db() -> None:
     finally:
         conn.close()
 
-def migrate_db(conn: duckdb.DuckDBPyConnection) -> None:
-    """Adds missing columns to existing tables."""
-    # Check if vendor/icon exist in devices
+# --- Versioned migrations ---
+# Each migration runs once and is recorded in schema_version. Append new entries
+# to MIGRATIONS with the next number; never renumber or edit shipped ones.
+
+def _migrate_001_device_columns(conn: duckdb.DuckDBPyConnection) -> None:
+    """Adds columns introduced after the first release to 'devices'."""
     cols = conn.execute("PRAGMA table_info('devices')").fetchall()
-    col_names = [c[1] for c in cols]
+    col_names = {c[1] for c in cols}
     
-    if 'vendor' not in col_names:
-        print("Migration: Adding 'vendor' column to 'devices'")
-        conn.execute("ALTER TABLE devices ADD COLUMN vendor TEXT")
-    
-    if 'icon' not in col_names:
-        print("Migration: Adding 'icon' column to 'devices'")
-        conn.execute("ALTER TABLE devices ADD COLUMN icon TEXT")
-
-    if 'open_ports' not in col_names:
-        print("Migration: Adding 'open_ports' column to 'devices'")
-        conn.execute("ALTER TABLE devices ADD COLUMN open_ports TEXT")
-
-    if 'status' not in col_names:
-        print("Migration: Adding 'status' column to 'devices'")
-        conn.execute("ALTER TABLE devices ADD COLUMN status TEXT DEFAULT 'unknown'")
-
-    if 'ip_type' not in col_names:
-        print("Migration: Adding 'ip_type' column to 'devices'")
-        conn.execute("ALTER TABLE devices ADD COLUMN ip_type TEXT")
-
-    if 'is_trusted' not in col_names:
-        print("Migration: Adding 'is_trusted' column to 'devices'")
-        conn.execute("ALTER TABLE devices ADD COLUMN is_trusted BOOLEAN DEFAULT FALSE")
-
-    if 'parent_id' not in col_names:
-        print("Migration: Adding 'parent_id' column to 'devices'")
-        conn.execute("ALTER TABLE devices ADD COLUMN parent_id TEXT")
-
-    if 'dns_stats' not in col_names:
-        print("Migration: Adding 'dns_stats' column to 'devices'")
-        conn.execute("ALTER TABLE devices ADD COLUMN dns_stats JSON")
+    new_columns = [
+        ("vendor", "TEXT"),
+        ("icon", "TEXT"),
+        ("open_ports", "TEXT"),
+        ("status", "TEXT DEFAULT 'unknown'"),
+        ("ip_type", "TEXT"),
+        ("is_trusted", "BOOLEAN DEFAULT FALSE"),
+        ("parent_id", "TEXT"),
+        ("dns_stats", "JSON"),
+    ]
+    for name, col_type in new_columns:
+        if name not in col_names:
+            print(f"Migration: Adding '{name}' column to 'devices'")
+            conn.execute(f"ALTER TABLE devices ADD COLUMN {name} {col_type}")
 
-    # Ensure device_status_history table exists
+def _migrate_002_history_tables(conn: duckdb.DuckDBPyConnection) -> None:
+    """Ensures the status and traffic history tables exist."""
     conn.execute("""
         CREATE TABLE IF NOT EXISTS device_status_history (
             id TEXT PRIMARY KEY,
@@ -141,8 +478,6 @@ def migrate_db(conn: duckdb.DuckDBPyConnection) -> None:
             changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     """)
-
-    # Ensure device_traffic_history table exists
     conn.execute("""
         CREATE TABLE IF NOT EXISTS device_traffic_history (
             id          TEXT PRIMARY KEY,
@@ -155,81 +490,75 @@ def migrate_db(conn: duckdb.DuckDBPyConnection) -> None:
         )
     """)
 
-    # Migration for device_ports UNIQUE constraint
-    # DuckDB doesn't allow adding UNIQUE to existing tables.
-    # We check if it exists by looking at indexes or trying a dummy insert (or just check table_info if supported)
-    # Safer: check if we've already run this migration using a config key or checking schema
-    # PRAGMA table_info doesn't show UNIQUE easily, but we can check the table definition
+def _migrate_003_device_ports_unique(conn: duckdb.DuckDBPyConnection) -> None:
+    """Rebuilds 'device_ports' with UNIQUE(device_id, port, protocol)."""
+    # DuckDB doesn't allow adding UNIQUE to existing tables, so check the table definition
     master = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'device_ports'").fetchone()
-    if master and "UNIQUE" not in master[0]:
-        print("Migration: Adding UNIQUE constraint to 'device_ports'")
-        # Ensure we start fresh
-        conn.execute("DROP TABLE IF EXISTS device_ports_new")
-        conn.execute("""
-            CREATE TABLE device_ports_new (
-                device_id  TEXT NOT NULL,
-                port       INTEGER NOT NULL,
-                protocol   TEXT NOT NULL,
-                service    TEXT,
-                banner     TEXT,
-                last_seen  TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(device_id, port, protocol)
-            );
-        """)
-        # De-duplicate: Keep the most recent last_seen and any service/banner
-        conn.execute("""
-            INSERT INTO device_ports_new (device_id, port, protocol, service, banner, last_seen)
-            SELECT device_id, port, protocol, arg_max(service, last_seen), arg_max(banner, last_seen), MAX(last_seen)
-            FROM device_ports
-            GROUP BY device_id, port, protocol
-        """)
-        conn.execute("DROP TABLE device_ports")
-        conn.execute("ALTER TABLE device_ports_new RENAME TO device_ports")
-    
-    # 3. Normalize protocol to lowercase and deduplicate
-    try:
-        current_data = conn.execute("SELECT device_id, port, protocol FROM device_ports").fetchall()
-        has_uppercase = any(d[2] != d[2].lower() for d in current_data)
-        
-        if has_uppercase:
-            print("Migration: Normalizing protocols to lowercase and deduplicating...")
-            # We'll use a temporary table to deduplicate
-            conn.execute("CREATE TABLE device_ports_dedup (device_id TEXT, port INTEGER, protocol TEXT, service TEXT, banner TEXT, last_seen TIMESTAMP, UNIQUE(device_id, port, protocol))")
-            
-            # Insert with REPLACE to keep the latest service name/time for the lowercase version
-            conn.execute("""
-                INSERT OR REPLACE INTO device_ports_dedup (device_id, port, protocol, service, banner, last_seen)
-                SELECT device_id, port, LOWER(protocol), service, banner, last_seen
-                FROM device_ports
-                ORDER BY last_seen ASC
-            """)
-            
-            conn.execute("DROP TABLE device_ports")
-            conn.execute("ALTER TABLE device_ports_dedup RENAME TO device_ports")
-            print("Migration: Protocols normalized successfully.")
-    except Exception as e:
-        print(f"Migration error (normalization): {e}")
+    if not master or "UNIQUE" in master[0]:
+        return
 
-    # 4. Indexes for Performance (Idempotent)
-    # DuckDB CREATE INDEX IF NOT EXISTS is supported in newer versions, checking explicitly or using try/except block is safer if unsure of version match
-    try:
-        print("Migration: Checking/Creating indexes...")
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_history_device_id ON device_status_history(device_id)")
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_history_changed_at ON device_status_history(changed_at)")
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_traffic_device_id ON device_traffic_history(device_id)")
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_traffic_timestamp ON device_traffic_history(timestamp)")
-        
-        # Scan Results Indexes (for Fidelity / History)
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_scan_results_scan_id ON scan_results(scan_id)")
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_scan_results_mac ON scan_results(mac)")
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_scan_results_ip ON scan_results(ip)")
+    print("Migration: Adding UNIQUE constraint to 'device_ports'")
+    # Ensure we start fresh
+    conn.execute("DROP TABLE IF EXISTS device_ports_new")
+    conn.execute("""
+        CREATE TABLE device_ports_new (
+            device_id  TEXT NOT NULL,
+            port       INTEGER NOT NULL,
+            protocol   TEXT NOT NULL,
+            service    TEXT,
+            banner     TEXT,
+            last_seen  TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(device_id, port, protocol)
+        );
+    """)
+    # De-duplicate: Keep the most recent last_seen and any service/banner
+    conn.execute("""
+        INSERT INTO device_ports_new (device_id, port, protocol, service, banner, last_seen)
+        SELECT device_id, port, protocol, arg_max(service, last_seen), arg_max(banner, last_seen), MAX(last_seen)
+        FROM device_ports
+        GROUP BY device_id, port, protocol
+    """)
+    conn.execute("DROP TABLE device_ports")
+    conn.execute("ALTER TABLE device_ports_new RENAME TO device_ports")
 
-        # Also index devices table for faster lookups if not primary key (id is PK, so indexed)
-        # conn.execute("CREATE INDEX IF NOT EXISTS idx_devices_mac ON devices(mac)") # mac is part of logic but often via ID.
-    except Exception as e:
-        print(f"Migration error (indexes): {e}")
+def _migrate_004_lowercase_protocols(conn: duckdb.DuckDBPyConnection) -> None:
+    """Normalizes 'device_ports.protocol' to lowercase and deduplicates."""
+    has_uppercase = conn.execute(
+        "SELECT 1 FROM device_ports WHERE protocol != LOWER(protocol) LIMIT 1"
+    ).fetchone()
+    if not has_uppercase:
+        return
 
-    # 5. Ensure classification_rules table exists (added redundantly to schema.sql)
+    print("Migration: Normalizing protocols to lowercase and deduplicating...")
+    conn.execute("DROP TABLE IF EXISTS device_ports_dedup")
+    conn.execute("CREATE TABLE device_ports_dedup (device_id TEXT NOT NULL, port INTEGER NOT NULL, protocol TEXT NOT NULL, service TEXT, banner TEXT, last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP, UNIQUE(device_id, port, protocol))")
+    
+    # Keep the latest service name/time for the lowercase version
+    conn.execute("""
+        INSERT INTO device_ports_dedup (device_id, port, protocol, service, banner, last_seen)
+        SELECT device_id, port, LOWER(protocol), arg_max(service, last_seen), arg_max(banner, last_seen), MAX(last_seen)
+        FROM device_ports
+        GROUP BY device_id, port, LOWER(protocol)
+    """)
+    
+    conn.execute("DROP TABLE device_ports")
+    conn.execute("ALTER TABLE device_ports_dedup RENAME TO device_ports")
+    print("Migration: Protocols normalized successfully.")
+
+def _migrate_005_indexes(conn: duckdb.DuckDBPyConnection) -> None:
+    """Creates lookup indexes for history and scan results."""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_history_device_id ON device_status_history(device_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_history_changed_at ON device_status_history(changed_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_traffic_device_id ON device_traffic_history(device_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_traffic_timestamp ON device_traffic_history(timestamp)")
+    
+    # Scan Results Indexes (for Fidelity / History)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_scan_results_scan_id ON scan_results(scan_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_scan_results_mac ON scan_results(mac)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_scan_results_ip ON scan_results(ip)")
+
+def _migrate_006_classification_rules(conn: duckdb.DuckDBPyConnection) -> None:
+    """Ensures the 'classification_rules' table exists."""
     conn.execute("""
         CREATE TABLE IF NOT EXISTS classification_rules (
             id               TEXT PRIMARY KEY,
@@ -245,7 +574,197 @@ def migrate_db(conn: duckdb.DuckDBPyConnection) -> None:
         )
     """)
 
-    commit()
+def _migrate_007_traffic_rollup_tiers(conn: duckdb.DuckDBPyConnection) -> None:
+    """Adds 5 minute / hourly traffic tiers and the device_traffic_all view over all tiers."""
+    for table in ("device_traffic_5m", "device_traffic_1h"):
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                device_id   TEXT NOT NULL,
+                bucket      TIMESTAMP NOT NULL,
+                rx_bytes    BIGINT NOT NULL DEFAULT 0,
+                tx_bytes    BIGINT NOT NULL DEFAULT 0,
+                down_rate   BIGINT DEFAULT 0,
+                up_rate     BIGINT DEFAULT 0,
+                samples     INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (device_id, bucket)
+            )
+        """)
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_bucket ON {table}(bucket)")
+    # Rollup buckets are labelled with their start time, so they slot into the
+    # same timestamp-range queries as raw rows.
+    conn.execute("""
+        CREATE OR REPLACE VIEW device_traffic_all AS
+            SELECT device_id, timestamp, rx_bytes, tx_bytes, down_rate, up_rate FROM device_traffic_history
+            UNION ALL
+            SELECT device_id, bucket, rx_bytes, tx_bytes, down_rate, up_rate FROM device_traffic_5m
+            UNION ALL
+            SELECT device_id, bucket, rx_bytes, tx_bytes, down_rate, up_rate FROM device_traffic_1h
+    """)
+
+def _migrate_008_traffic_hourly_rollup(conn: duckdb.DuckDBPyConnection) -> None:
+    """
+    Makes device_traffic_1h the hourly traffic rollup read by analytics: it gains last_seen
+    and from now on covers every hour (folded in on ingest), so it is backfilled here.
+    """
+    cols = {c[1] for c in conn.execute("PRAGMA table_info('device_traffic_1h')").fetchall()}
+    if "last_seen" not in cols:
+        conn.execute("ALTER TABLE device_traffic_1h ADD COLUMN last_seen TIMESTAMP")
+    # Hours still held by the finer tiers; each raw row lives in exactly one tier, so add
+    conn.execute("""
+        INSERT INTO device_traffic_1h (device_id, bucket, rx_bytes, tx_bytes, down_rate, up_rate, samples, last_seen)
+        SELECT device_id, date_trunc('hour', ts), arg_max(rx_bytes, ts), arg_max(tx_bytes, ts),
+               SUM(down_rate), SUM(up_rate), SUM(samples), MAX(ts)
+        FROM (
+            SELECT device_id, timestamp AS ts, rx_bytes, tx_bytes, down_rate, up_rate, 1 AS samples FROM device_traffic_history
+            UNION ALL
+            SELECT device_id, bucket, rx_bytes, tx_bytes, down_rate, up_rate, samples FROM device_traffic_5m
+        )
+        GROUP BY ALL
+        ON CONFLICT (device_id, bucket) DO UPDATE SET
+            rx_bytes = EXCLUDED.rx_bytes,
+            tx_bytes = EXCLUDED.tx_bytes,
+            down_rate = device_traffic_1h.down_rate + EXCLUDED.down_rate,
+            up_rate = device_traffic_1h.up_rate + EXCLUDED.up_rate,
+            samples = device_traffic_1h.samples + EXCLUDED.samples,
+            last_seen = EXCLUDED.last_seen
+    """)
+    # Hours retention folded before this migration have no sample time
+    conn.execute("UPDATE device_traffic_1h SET last_seen = bucket WHERE last_seen IS NULL")
+    # device_traffic_1h now overlaps the finer tiers. Expired 5 minute buckets are dropped
+    # at an hour boundary (app.services.retention), so the hours before the oldest finer
+    # row are exactly the ones only device_traffic_1h still has.
+    conn.execute("""
+        CREATE OR REPLACE VIEW device_traffic_all AS
+            SELECT device_id, timestamp, rx_bytes, tx_bytes, down_rate, up_rate FROM device_traffic_history
+            UNION ALL
+            SELECT device_id, bucket, rx_bytes, tx_bytes, down_rate, up_rate FROM device_traffic_5m
+            UNION ALL
+            SELECT device_id, bucket, rx_bytes, tx_bytes, down_rate, up_rate FROM device_traffic_1h
+            WHERE bucket < (
+                SELECT COALESCE(date_trunc('hour', MIN(ts)), 'infinity'::TIMESTAMP) FROM (
+                    SELECT MIN(timestamp) AS ts FROM device_traffic_history
+                    UNION ALL
+                    SELECT MIN(bucket) FROM device_traffic_5m
+                )
+            )
+    """)
+
+def _migrate_009_scan_priority(conn: duckdb.DuckDBPyConnection) -> None:
+    """Adds 'priority' to scans so interactive scans are picked before periodic ones."""
+    cols = {c[1] for c in conn.execute("PRAGMA table_info('scans')").fetchall()}
+    if "priority" not in cols:
+        conn.execute("ALTER TABLE scans ADD COLUMN priority INTEGER DEFAULT 0")
+
+def _migrate_010_scan_profiles(conn: duckdb.DuckDBPyConnection) -> None:
+    """Adds the scan profile (quick/standard/full) to scans and scan_schedules."""
+    for table in ("scans", "scan_schedules"):
+        cols = {c[1] for c in conn.execute(f"PRAGMA table_info('{table}')").fetchall()}
+        if "profile" not in cols:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN profile TEXT DEFAULT 'standard'")
+
+def _migrate_011_scan_progress(conn: duckdb.DuckDBPyConnection) -> None:
+    """Adds 'progress' (JSON: phase, done, total) to scans."""
+    cols = {c[1] for c in conn.execute("PRAGMA table_info('scans')").fetchall()}
+    if "progress" not in cols:
+        conn.execute("ALTER TABLE scans ADD COLUMN progress TEXT")
+
+def _migrate_012_hostname_cache(conn: duckdb.DuckDBPyConnection) -> None:
+    """Creates hostname_cache: resolved (or unresolvable) hostnames per IP with an expiry."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS hostname_cache (
+            ip          TEXT PRIMARY KEY,
+            hostname    TEXT,
+            source      TEXT,
+            expires_at  TIMESTAMP NOT NULL
+        )
+    """)
+
+def _migrate_013_port_cache(conn: duckdb.DuckDBPyConnection) -> None:
+    """Adds when (and at which IP) a device's open ports were last fully verified."""
+    cols = {c[1] for c in conn.execute("PRAGMA table_info('devices')").fetchall()}
+    if "ports_verified_at" not in cols:
+        conn.execute("ALTER TABLE devices ADD COLUMN ports_verified_at TIMESTAMP")
+    if "ports_verified_ip" not in cols:
+        conn.execute("ALTER TABLE devices ADD COLUMN ports_verified_ip TEXT")
+
+def _migrate_014_service_overrides(conn: duckdb.DuckDBPyConnection) -> None:
+    """Creates service_overrides: user-defined service names for TCP ports."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS service_overrides (
+            port        INTEGER PRIMARY KEY,
+            service     TEXT NOT NULL,
+            updated_at  TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+def _migrate_015_integrations(conn: duckdb.DuckDBPyConnection) -> None:
+    """Creates integrations (per-integration JSON config), previously created lazily by its routers."""
+    conn.execute("CREATE TABLE IF NOT EXISTS integrations (name TEXT PRIMARY KEY, config TEXT)")
+
+MIGRATIONS: List[Tuple[int, str, Callable[[duckdb.DuckDBPyConnection], None]]] = [
+    (1, "device_columns", _migrate_001_device_columns),
+    (2, "history_tables", _migrate_002_history_tables),
+    (3, "device_ports_unique", _migrate_003_device_ports_unique),
+    (4, "lowercase_protocols", _migrate_004_lowercase_protocols),
+    (5, "indexes", _migrate_005_indexes),
+    (6, "classification_rules", _migrate_006_classification_rules),
+    (7, "traffic_rollup_tiers", _migrate_007_traffic_rollup_tiers),
+    (8, "traffic_hourly_rollup", _migrate_008_traffic_hourly_rollup),
+    (9, "scan_priority", _migrate_009_scan_priority),
+    (10, "scan_profiles", _migrate_010_scan_profiles),
+    (11, "scan_progress", _migrate_011_scan_progress),
+    (12, "hostname_cache", _migrate_012_hostname_cache),
+    (13, "port_cache", _migrate_013_port_cache),
+    (14, "service_overrides", _migrate_014_service_overrides),
+    (15, "integrations", _migrate_015_integrations),
+]
+
+LATEST_SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(conn: duckdb.DuckDBPyConnection) -> int:
+    """Returns the applied schema version, or 0 for a fresh or pre-versioning database."""
+    exists = conn.execute(
+        "SELECT 1 FROM information_schema.tables WHERE table_name = 'schema_version'"
+    ).fetchone()
+    if not exists:
+        return 0
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+def migrate_db(conn: duckdb.DuckDBPyConnection) -> None:
+    """Applies pending migrations. A database already at LATEST_SCHEMA_VERSION does no work."""
+    current = get_schema_version(conn)
+    if current >= LATEST_SCHEMA_VERSION:
+        return
+
+    settings = get_settings()
+    print(f"Migration: schema version {current} -> {LATEST_SCHEMA_VERSION}")
+
+    # Base schema creates any missing tables; migrations then reshape older ones
+    print(f"Loading schema from {settings.db_schema_path}...")
+    schema_sql = Path(settings.db_schema_path).read_text(encoding="utf-8")
+    conn.execute(schema_sql)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version     INTEGER PRIMARY KEY,
+            name        TEXT NOT NULL,
+            applied_at  TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    for version, name, migration in MIGRATIONS:
+        if version <= current:
+            continue
+        print(f"Migration {version:03d}: {name}")
+        conn.begin()
+        try:
+            migration(conn)
+            conn.execute("INSERT INTO schema_version (version, name) VALUES (?, ?)", [version, name])
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"Migration {version:03d} ({name}) failed: {e}")
+            raise
 
 def seed_classification_rules(conn: duckdb.DuckDBPyConnection) -> None:
     """Seeds the classification_rules table from initial_rules.json if empty."""
@@ -1,44 +1,72 @@
 import duckdb
-from pathlib import Path
-from app.core.config import get_settings
+from app.core.db import DNS_CATALOG, ReadConnection, commit_checked, get_connection, get_db_lock, get_main_catalog, get_read_connection, run_exclusive
+from typing import Any, Callable
 import logging
-import threading
 
 logger = logging.getLogger(__name__)
 
-_shared_conn: duckdb.DuckDBPyConnection = None
-_db_lock = threading.RLock()
-
 def get_dns_db_lock():
-    """Returns the global database lock for DNS DB operations."""
-    return _db_lock
+    """Returns the global database lock for DNS DB operations (shared with the main DB)."""
+    return get_db_lock()
+
+def _scope(cursor: duckdb.DuckDBPyConnection) -> duckdb.DuckDBPyConnection:
+    # Unqualified names resolve in the DNS catalog first, then in the main database,
+    # so DNS queries can JOIN devices directly.
+    cursor.execute(f"USE {DNS_CATALOG}")
+    cursor.execute(f"SET search_path = '{DNS_CATALOG}.main,{get_main_catalog()}.main'")
+    return cursor
+
+def _unscope(cursor: duckdb.DuckDBPyConnection) -> None:
+    cursor.execute(f"USE {get_main_catalog()}")
+    cursor.execute("RESET search_path")
 
 def get_dns_connection() -> duckdb.DuckDBPyConnection:
     """
-    Returns a cursor from a shared DuckDB connection for the DNS logs database.
-    Target DB: backend/data/dns_logs.duckdb
+    Returns a cursor on the shared DuckDB instance scoped to the DNS logs database.
+    Target DB: backend/data/dns_logs.duckdb, attached by app.core.db as the 'dns' catalog.
     """
-    global _shared_conn
-    with _db_lock:
-        if _shared_conn is None:
-            settings = get_settings()
-            # Construct path relative to the main DB path or explicit setting
-            # We assume it lives next to the main DB
-            main_db_path = Path(settings.db_path)
-            dns_db_path = main_db_path.parent / "dns_logs.duckdb"
-            dns_db_path.parent.mkdir(parents=True, exist_ok=True)
-            
-            logger.info(f"Opening DNS database at {dns_db_path}")
-            _shared_conn = duckdb.connect(str(dns_db_path))
-            
-            # Optimization for high volume inserts
-            _shared_conn.execute("SET threads TO 4")
-            # Maybe lower memory limit if main DB is heavy
-            _shared_conn.execute("SET memory_limit = '256MB'") 
-            
-            _init_schema(_shared_conn)
-        
-        return _shared_conn.cursor()
+    return _scope(get_connection())
+
+def get_dns_read_connection() -> ReadConnection:
+    """
+    Pooled read cursor (get_read_connection) scoped like get_dns_connection.
+    The scope is undone when it is closed, before the cursor goes back to the pool.
+    """
+    conn = get_read_connection(reset=_unscope)
+    try:
+        _scope(conn)
+    except Exception:
+        conn.close()
+        raise
+    return conn
+
+def run_dns_write(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Runs fn(conn, *args, **kwargs) on a DNS-scoped cursor in its own transaction.
+    Goes through the writer thread (run_exclusive) so it never overlaps grouped writes;
+    the writer's shared cursor is not used because the scope would leak into other ops.
+    """
+    def op():
+        conn = get_dns_connection()
+        try:
+            conn.begin()
+            try:
+                result = fn(conn, *args, **kwargs)
+                commit_checked(conn)
+            except Exception:
+                conn.rollback()
+                raise
+            return result
+        finally:
+            conn.close()
+    return run_exclusive(op)
+
+def init_dns_schema(cursor: duckdb.DuckDBPyConnection):
+    """Creates/migrates the DNS tables. Called by app.core.db right after attaching."""
+    try:
+        _init_schema(_scope(cursor))
+    finally:
+        cursor.close()
 
 def _init_schema(conn: duckdb.DuckDBPyConnection):
     """Initializes the DNS database schema."""
@@ -111,23 +139,38 @@ def _init_schema(conn: duckdb.DuckDBPyConnection):
         except Exception as e:
             logger.warning(f"Query type migration check failed: {e}")
 
+        # Hourly rollups read by the analytics endpoints (see app/services/rollups.py)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS dns_hourly (
+                hour        TIMESTAMP NOT NULL,
+                device_id   TEXT NOT NULL DEFAULT '',   -- '' when the client was not mapped
+                client_ip   TEXT NOT NULL DEFAULT '',
+                domain_id   INTEGER NOT NULL,
+                queries     BIGINT NOT NULL DEFAULT 0,
+                blocked     BIGINT NOT NULL DEFAULT 0,
+                response_ms BIGINT NOT NULL DEFAULT 0,
+                PRIMARY KEY (hour, device_id, client_ip, domain_id)
+            );
+
+            CREATE TABLE IF NOT EXISTS dns_query_types_hourly (
+                hour        TIMESTAMP NOT NULL,
+                query_type  TEXT NOT NULL,
+                queries     BIGINT NOT NULL DEFAULT 0,
+                PRIMARY KEY (hour, query_type)
+            );
+        """)
+
+        # Backfill the rollups once for databases created before they existed
+        try:
+            has_rollup = conn.execute("SELECT 1 FROM dns_hourly LIMIT 1").fetchone()
+            has_logs = conn.execute("SELECT 1 FROM dns_logs LIMIT 1").fetchone()
+            if has_logs and not has_rollup:
+                logger.info("Backfilling DNS hourly rollups from dns_logs")
+                from app.services.rollups import fold_dns_logs
+                fold_dns_logs(conn)
+        except Exception as e:
+            logger.warning(f"DNS rollup backfill failed: {e}")
+
     except Exception as e:
         logger.error(f"Failed to initialize DNS DB schema: {e}")
         raise e
-
-def close_dns_connection():
-    global _shared_conn
-    with _db_lock:
-        if _shared_conn:
-            try:
-                _shared_conn.close()
-                logger.info("DNS database connection closed.")
-            except Exception as e:
-                logger.error(f"Error closing DNS connection: {e}")
-            _shared_conn = None
-
-def commit_dns():
-    global _shared_conn
-    with _db_lock:
-        if _shared_conn:
-            _shared_conn.commit()
@@ -7,7 +7,11 @@ from app.routers.config import router as config_router
 from app.routers.scans import router as scans_router
 from app.routers.devices import router as devices_router
 from app.routers.schedules import router as schedules_router
-from app.services.worker import scheduler_loop, scan_runner_loop
+from app.services.worker import scheduler_loop, scan_runner_loop, retention_loop
+from app.services.mqtt import init_mqtt, mqtt_publisher_loop, save_mqtt_queue
+from app.services.sniffer import passive_discovery_loop
+from app.services.presence import presence_monitor_loop
+from app.services.port_services import load_service_registry
 from app.routers.ssh import router as ssh_router
 from app.routers.events import router as events_router
 from app.routers.mqtt import router as mqtt_router
@@ -56,12 +60,22 @@ def cleanup_stale_scans():
 async def on_startup():
     await asyncio.to_thread(cleanup_stale_scans)
     await asyncio.to_thread(init_db)
+    await asyncio.to_thread(load_service_registry)
+    await init_mqtt()
     
     # OUI downloader was permanently removed due to high CPU usage on Raspberry Pi.
     # Vendor identification now relies on hardcoded COMMON_OUIS and on-demand API enrichment.
     
     asyncio.create_task(scheduler_loop())
     asyncio.create_task(scan_runner_loop())
+    asyncio.create_task(retention_loop())
+    asyncio.create_task(mqtt_publisher_loop())
+    asyncio.create_task(passive_discovery_loop())
+    asyncio.create_task(presence_monitor_loop())
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await asyncio.to_thread(save_mqtt_queue)
     
 app.include_router(config_router, prefix="/api/v1/config", tags=["config"])
 app.include_router(scans_router, prefix="/api/v1/scans", tags=["scans"])
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List
 from datetime import datetime
 
@@ -30,3 +30,9 @@ class ClassificationRule(ClassificationRuleBase):
 
     class Config:
         from_attributes = True
+
+class ServiceOverrideUpdate(BaseModel):
+    service: str = Field(min_length=1)
+
+class ServiceOverride(ServiceOverrideUpdate):
+    port: int
@@ -1,17 +1,22 @@
 from pydantic import BaseModel, Field
-from typing import Any, Optional
+from typing import Any, Literal, Optional
 from datetime import datetime
 
+ScanProfile = Literal["quick", "standard", "full"]
+
 class ScanCreate(BaseModel):
     target: str
     scan_type: str = Field(..., examples=["arp", "ping", "tcp-syn"])
     options: dict[str, Any] | None = None
+    profile: ScanProfile = "standard"
 
 class ScanRead(BaseModel):
     id: str
     target: str
     scan_type: str
     options: dict[str, Any] | None = None
+    profile: str = "standard"
+    progress: dict[str, Any] | None = None
     status: str
     created_at: datetime
     started_at: Optional[datetime] = None
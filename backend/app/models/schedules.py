@@ -1,6 +1,7 @@
 from pydantic import BaseModel
 from typing import Optional
 from datetime import datetime
+from app.models.scans import ScanProfile
 
 class ScheduleCreate(BaseModel):
     name: str
@@ -8,6 +9,7 @@ class ScheduleCreate(BaseModel):
     target: str
     interval_seconds: int
     enabled: bool = True
+    profile: ScanProfile = "standard"
 
 class ScheduleRead(BaseModel):
     id: str
@@ -16,5 +18,6 @@ class ScheduleRead(BaseModel):
     target: str
     interval_seconds: int
     enabled: bool
+    profile: str = "standard"
     last_run_at: Optional[datetime] = None
     next_run_at: Optional[datetime] = None
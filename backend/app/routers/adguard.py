@@ -2,7 +2,8 @@ from fastapi import APIRouter, HTTPException, BackgroundTasks
 from pydantic import BaseModel
 from typing import Optional
 from app.services.adguard import AdguardClient
-from app.core.db import get_connection, commit
+from app.core.db import get_read_connection, run_write
+from app.services.worker import wake_scheduler
 import json
 import logging
 
@@ -18,7 +19,7 @@ class AdguardConfig(BaseModel):
 
 @router.get("/config")
 def get_config():
-    conn = get_connection()
+    conn = get_read_connection()
     try:
         row = conn.execute("SELECT config FROM integrations WHERE name = 'adguard'").fetchone()
         if not row:
@@ -36,11 +37,7 @@ def get_config():
 
 @router.post("/config")
 def save_config(config: AdguardConfig):
-    conn = get_connection()
     try:
-        # Check if table exists
-        conn.execute("CREATE TABLE IF NOT EXISTS integrations (name TEXT PRIMARY KEY, config JSON)")
-        
         # Store
         data = config.dict()
         # Verify immediately
@@ -54,17 +51,17 @@ def save_config(config: AdguardConfig):
             data["verified"] = False
             data["error"] = str(e)
             
-        conn.execute(
-            "INSERT OR REPLACE INTO integrations (name, config) VALUES (?, ?)",
-            ['adguard', json.dumps(data)]
-        )
-        commit(conn)
+        def save(conn):
+            conn.execute(
+                "INSERT OR REPLACE INTO integrations (name, config) VALUES (?, ?)",
+                ['adguard', json.dumps(data)]
+            )
+        run_write(save)
+        wake_scheduler()
         return {"status": "saved", "verified": data["verified"]}
     except Exception as e:
         logger.error(f"Failed to save Adguard config: {e}")
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 @router.post("/verify")
 def verify_connection(config: AdguardConfig):
@@ -77,7 +74,7 @@ def verify_connection(config: AdguardConfig):
 
 @router.post("/sync")
 def trigger_sync(background_tasks: BackgroundTasks):
-    conn = get_connection()
+    conn = get_read_connection()
     try:
         row = conn.execute("SELECT config FROM integrations WHERE name = 'adguard'").fetchone()
         if not row:
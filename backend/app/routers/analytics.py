@@ -1,7 +1,8 @@
 from fastapi import APIRouter, HTTPException, Query
-from typing import List, Dict, Any, Optional
-from app.core.db import get_connection
-from app.core.dns_db import get_dns_connection
+from typing import List, Dict, Any, Optional, Tuple
+from app.core.db import get_read_connection
+from app.core.dns_db import get_dns_read_connection
+from app.services.rollups import traffic_source, dns_source, dns_query_type_source
 from datetime import datetime, timedelta
 import logging
 
@@ -15,23 +16,23 @@ def get_traffic_analytics(range: str = "24h"):
     Returns time-series traffic data aggregated by time buckets.
     range: 24h, yesterday, 7d, 30d, 3m, mtd, last_month, ytd, 1y, all
     """
-    conn = get_connection()
+    conn = get_read_connection()
     try:
         now = datetime.now()
         start_time, end_time, bucket_size, trunc_arg = get_date_range(range, now)
+        source, params = traffic_source(start_time, end_time)
 
         sql = f"""
             SELECT 
                 date_trunc('{trunc_arg}', timestamp) as bucket,
                 SUM(down_rate) as download,
                 SUM(up_rate) as upload
-            FROM device_traffic_history
-            WHERE timestamp >= ? AND timestamp <= ?
+            FROM ({source})
             GROUP BY bucket
             ORDER BY bucket ASC
         """
         
-        rows = conn.execute(sql, [start_time, end_time]).fetchall()
+        rows = conn.execute(sql, params).fetchall()
         
         # Format response
         series = []
@@ -43,14 +44,13 @@ def get_traffic_analytics(range: str = "24h"):
             })
             
         # Calculate totals for the period
-        totals_row = conn.execute("""
+        totals_row = conn.execute(f"""
             SELECT 
                 SUM(down_rate), 
                 SUM(up_rate),
                 COUNT(DISTINCT device_id)
-            FROM device_traffic_history
-            WHERE timestamp >= ? AND timestamp <= ?
-        """, [start_time, end_time]).fetchone()
+            FROM ({source})
+        """, params).fetchone()
         
         return {
             "series": series,
@@ -68,25 +68,25 @@ def get_top_devices(range: str = "24h", limit: int = 5):
     """
     Returns top consumers by total usage in the time window.
     """
-    conn = get_connection()
+    conn = get_read_connection()
     try:
         start_time, end_time, _, _ = get_date_range(range)
+        source, params = traffic_source(start_time, end_time)
         
-        sql = """
+        sql = f"""
             SELECT 
                 d.id, d.name, d.display_name, d.ip, d.icon, d.vendor,
                 SUM(h.down_rate) as total_down,
                 SUM(h.up_rate) as total_up,
                 (SUM(h.down_rate) + SUM(h.up_rate)) as total_usage
-            FROM device_traffic_history h
+            FROM ({source}) h
             JOIN devices d ON h.device_id = d.id
-            WHERE h.timestamp >= ? AND h.timestamp <= ?
             GROUP BY d.id, d.name, d.display_name, d.ip, d.icon, d.vendor
             ORDER BY total_usage DESC
             LIMIT ?
         """
         
-        rows = conn.execute(sql, [start_time, end_time, limit]).fetchall()
+        rows = conn.execute(sql, params + [limit]).fetchall()
         
         items = []
         for r in rows:
@@ -110,22 +110,22 @@ def get_usage_details(range: str = "24h", page: int = 1, limit: int = 10):
     """
     Returns paginated device usage details.
     """
-    conn = get_connection()
+    conn = get_read_connection()
     try:
         start_time, end_time, _, _ = get_date_range(range)
+        source, params = traffic_source(start_time, end_time)
 
         offset = (page - 1) * limit
 
         # Base Query
-        base_query = """
-            FROM device_traffic_history h
+        base_query = f"""
+            FROM ({source}) h
             JOIN devices d ON h.device_id = d.id
-            WHERE h.timestamp >= ? AND h.timestamp <= ?
         """
 
         # Total Count
         count_sql = f"SELECT COUNT(DISTINCT d.id) {base_query}"
-        total_items = conn.execute(count_sql, [start_time, end_time]).fetchone()[0]
+        total_items = conn.execute(count_sql, params).fetchone()[0]
         total_pages = (total_items + limit - 1) // limit
 
         # Paginated Data
@@ -135,14 +135,14 @@ def get_usage_details(range: str = "24h", page: int = 1, limit: int = 10):
                 SUM(h.down_rate) as total_down,
                 SUM(h.up_rate) as total_up,
                 (SUM(h.down_rate) + SUM(h.up_rate)) as total_usage,
-                MAX(h.timestamp) as last_seen
+                MAX(h.last_seen) as last_seen
             {base_query}
             GROUP BY d.id, d.name, d.display_name, d.ip, d.icon, d.vendor, d.mac
             ORDER BY total_usage DESC
             LIMIT ? OFFSET ?
         """
         
-        rows = conn.execute(data_sql, [start_time, end_time, limit, offset]).fetchall()
+        rows = conn.execute(data_sql, params + [limit, offset]).fetchall()
         
         items = []
         for r in rows:
@@ -173,7 +173,7 @@ def get_device_distribution():
     """
     Returns breakdown of devices by Vendor and Type.
     """
-    conn = get_connection()
+    conn = get_read_connection()
     try:
         # Vendor Distribution (Top 5 + Others)
         vendor_rows = conn.execute("""
@@ -218,24 +218,25 @@ def get_category_usage(range: str = "24h"):
     """
     Returns total traffic volume aggregated by device type.
     """
-    conn = get_connection()
+    conn = get_read_connection()
     try:
         start_time, end_time, _, _ = get_date_range(range)
+        source, params = traffic_source(start_time, end_time)
         
-        sql = """
+        sql = f"""
             SELECT 
                 d.device_type,
                 SUM(h.down_rate) as total_down,
                 SUM(h.up_rate) as total_up,
                 (SUM(h.down_rate) + SUM(h.up_rate)) as total_usage
-            FROM device_traffic_history h
+            FROM ({source}) h
             JOIN devices d ON h.device_id = d.id
-            WHERE h.timestamp >= ? AND h.timestamp <= ? AND d.device_type IS NOT NULL AND d.device_type != ''
+            WHERE d.device_type IS NOT NULL AND d.device_type != ''
             GROUP BY d.device_type
             ORDER BY total_usage DESC
         """
         
-        rows = conn.execute(sql, [start_time, end_time]).fetchall()
+        rows = conn.execute(sql, params).fetchall()
         
         items = []
         for r in rows:
@@ -256,13 +257,14 @@ def get_traffic_heatmap(time_range: str = Query("24h", alias="range")):
     Returns aggregated traffic volume by Day of Week and Hour of Day,
     including top 3 devices contributing to each bucket.
     """
-    conn = get_connection()
+    conn = get_read_connection()
     try:
         start_time, end_time, _, _ = get_date_range(time_range)
+        source, params = traffic_source(start_time, end_time)
         
         # Optimized Fetch: Group by Dow, Hour, AND Device
         # This lets us calculate totals AND find top contributors in one pass
-        sql = """
+        sql = f"""
             SELECT 
                 extract('isodow' from h.timestamp) as dow,
                 extract('hour' from h.timestamp) as h,
@@ -270,13 +272,12 @@ def get_traffic_heatmap(time_range: str = Query("24h", alias="range")):
                 d.name,
                 d.display_name,
                 SUM(h.down_rate + h.up_rate) as total
-            FROM device_traffic_history h
+            FROM ({source}) h
             LEFT JOIN devices d ON h.device_id = d.id
-            WHERE h.timestamp >= ? AND h.timestamp <= ?
             GROUP BY extract('isodow' from h.timestamp), extract('hour' from h.timestamp), h.device_id, d.name, d.display_name
         """
         
-        rows = conn.execute(sql, [start_time, end_time]).fetchall()
+        rows = conn.execute(sql, params).fetchall()
         
         # Python Aggregation
         # matrix[d][h] = { total: 0, devices: [] }
@@ -333,22 +334,20 @@ def get_dns_global_stats(range: str = "24h"):
     """
     Returns KPIs: Total Queries, Blocked, Block %, Avg Response Time
     """
-    conn = get_dns_connection()
-    # Note: get_dns_connection returns a cursor on a shared connection.
-    # We do NOT close it.
+    conn = get_dns_read_connection()
     
     start_time, end_time, _, _ = get_date_range(range)
+    source, params = dns_source(start_time, end_time)
     
     try:
         # Total & Blocked
-        row = conn.execute("""
+        row = conn.execute(f"""
             SELECT 
-                COUNT(*), 
-                COUNT(CASE WHEN is_blocked = TRUE THEN 1 END),
-                AVG(response_time)
-            FROM dns_logs
-            WHERE timestamp >= ? AND timestamp <= ?
-        """, [start_time, end_time]).fetchone()
+                SUM(queries), 
+                SUM(blocked),
+                SUM(response_ms) / NULLIF(SUM(queries), 0)
+            FROM ({source})
+        """, params).fetchone()
         
         total = row[0] or 0
         blocked = row[1] or 0
@@ -365,26 +364,28 @@ def get_dns_global_stats(range: str = "24h"):
     except Exception as e:
         logger.error(f"DNS Stats Error: {e}")
         return {"total_queries": 0, "blocked_queries": 0, "block_percentage": 0, "avg_response_time": 0}
+    finally:
+        conn.close()
 
 @router.get("/dns/traffic")
 def get_dns_traffic_chart(range: str = "24h"):
     """
     Time series of Queries vs Blocked
     """
-    conn = get_dns_connection()
+    conn = get_dns_read_connection()
     start_time, end_time, _, trunc = get_date_range(range)
+    source, params = dns_source(start_time, end_time)
     
     try:
         rows = conn.execute(f"""
             SELECT 
                 date_trunc('{trunc}', timestamp) as bucket,
-                COUNT(*) as total,
-                COUNT(CASE WHEN is_blocked = TRUE THEN 1 END) as blocked
-            FROM dns_logs
-            WHERE timestamp >= ? AND timestamp <= ?
+                SUM(queries) as total,
+                SUM(blocked) as blocked
+            FROM ({source})
             GROUP BY bucket
             ORDER BY bucket ASC
-        """, [start_time, end_time]).fetchall()
+        """, params).fetchall()
         
         series = []
         for r in rows:
@@ -398,115 +399,98 @@ def get_dns_traffic_chart(range: str = "24h"):
     except Exception as e:
         logger.error(f"DNS Chart Error: {e}")
         return []
+    finally:
+        conn.close()
 
 @router.get("/dns/top-domains")
 def get_dns_top_domains(range: str = "24h", limit: int = 10, offset: int = 0, type: str = "all"):
     """
     Top queried domains. type: 'all', 'blocked', 'allowed'
     """
-    conn = get_dns_connection()
+    conn = get_dns_read_connection()
     start_time, end_time, _, _ = get_date_range(range)
+    source, params = dns_source(start_time, end_time)
     
-    where_clause = "WHERE l.timestamp >= ? AND l.timestamp <= ?"
+    # Rollup rows carry counts, so blocked/allowed become sums instead of row filters
+    count_expr = "l.queries"
     if type == "blocked":
-        where_clause += " AND l.is_blocked = TRUE"
+        count_expr = "l.blocked"
     elif type == "allowed":
-        where_clause += " AND l.is_blocked = FALSE"
+        count_expr = "l.queries - l.blocked"
         
     try:
         rows = conn.execute(f"""
-            SELECT 
-                d.domain,
-                d.category,
-                COUNT(*) as count,
-                MODE(l.device_id) as top_device_id
-            FROM dns_logs l
-            JOIN dns_domains d ON l.domain_id = d.id
-            {where_clause}
-            GROUP BY d.domain, d.category
-            ORDER BY count DESC
-            LIMIT ? OFFSET ?
-        """, [start_time, end_time, limit, offset]).fetchall()
-        
-        # Resolve names for top devices
-        conn_main = get_connection()
-        device_ids = list(set(r[3] for r in rows if r[3]))
-        device_map = {}
-        if device_ids:
-            # Simple list query
-            dev_rows = conn_main.execute(f"SELECT id, name, display_name, icon, device_type FROM devices WHERE id IN ({','.join(['?']*len(device_ids))})", device_ids).fetchall()
-            for dr in dev_rows:
-                device_map[dr[0]] = {
-                    "name": dr[2] or dr[1],
-                    "icon": dr[3],
-                    "type": dr[4]
-                }
+            WITH per_device AS (
+                SELECT l.domain_id, l.device_id, SUM({count_expr}) as count
+                FROM ({source}) l
+                GROUP BY l.domain_id, l.device_id
+            ),
+            top AS (
+                SELECT 
+                    d.domain,
+                    d.category,
+                    SUM(p.count) as count,
+                    arg_max(p.device_id, p.count) FILTER (WHERE p.device_id IS NOT NULL) as top_device_id
+                FROM per_device p
+                JOIN dns_domains d ON p.domain_id = d.id
+                GROUP BY d.domain, d.category
+                HAVING SUM(p.count) > 0
+                ORDER BY count DESC
+                LIMIT ? OFFSET ?
+            )
+            SELECT t.domain, t.category, t.count, t.top_device_id,
+                   COALESCE(dev.display_name, dev.name), dev.icon, dev.device_type
+            FROM top t
+            LEFT JOIN devices dev ON dev.id = t.top_device_id
+            ORDER BY t.count DESC
+        """, params + [limit, offset]).fetchall()
 
         return [{
             "domain": r[0], 
             "category": r[1], 
             "count": r[2],
             "top_client_id": r[3],
-            "top_client_name": device_map.get(r[3], {}).get("name", "Unknown Device"),
-            "top_client_icon": device_map.get(r[3], {}).get("icon"),
-            "top_client_type": device_map.get(r[3], {}).get("type")
+            "top_client_name": r[4] or "Unknown Device",
+            "top_client_icon": r[5],
+            "top_client_type": r[6]
         } for r in rows]
     except Exception as e:
         logger.error(f"DNS Top Domains Error: {e}")
         return []
+    finally:
+        conn.close()
 
 @router.get("/dns/top-clients")
 def get_dns_top_clients(range: str = "24h", limit: int = 10, offset: int = 0):
     """
     Top clients by query volume.
     """
-    # map device_id to names using Main DB is best, but we are in shared connection mode.
-    # Option: Return device_ids and let frontend resolve names from store?
-    # Or fetch device mapping from main DB here? 
-    # Let's fetch map from main DB.
-    
-    conn_dns = get_dns_connection()
-    conn_main = get_connection()
+    # Device names come from the main database, joined in SQL (DNS DB is attached)
+    conn_dns = get_dns_read_connection()
     start_time, end_time, _, _ = get_date_range(range)
+    source, params = dns_source(start_time, end_time)
     
     try:
-        # Get stats
-        rows = conn_dns.execute("""
-            SELECT device_id, client_ip, COUNT(*) as count
-            FROM dns_logs
-            WHERE timestamp >= ? AND timestamp <= ?
-            GROUP BY device_id, client_ip
-            ORDER BY count DESC
-            LIMIT ? OFFSET ?
-        """, [start_time, end_time, limit, offset]).fetchall()
-        
-        # Resolve names
-        results = []
-        device_cache = {}
+        rows = conn_dns.execute(f"""
+            WITH clients AS (
+                SELECT device_id, client_ip, SUM(queries) as count
+                FROM ({source})
+                GROUP BY device_id, client_ip
+                ORDER BY count DESC
+                LIMIT ? OFFSET ?
+            )
+            SELECT c.device_id, COALESCE(d.display_name, d.name, c.client_ip), c.count
+            FROM clients c
+            LEFT JOIN devices d ON d.id = c.device_id
+            ORDER BY c.count DESC
+        """, params + [limit, offset]).fetchall()
         
-        for r in rows:
-            dev_id = r[0]
-            ip = r[1]
-            count = r[2]
-            name = ip 
-            
-            if dev_id:
-                if dev_id not in device_cache:
-                    d_row = conn_main.execute("SELECT name, display_name FROM devices WHERE id = ?", [dev_id]).fetchone()
-                    if d_row:
-                        device_cache[dev_id] = d_row[1] or d_row[0]
-                
-                if dev_id in device_cache:
-                    name = device_cache[dev_id]
-            
-            results.append({"name": name, "count": count, "device_id": dev_id})
-            
-        return results
+        return [{"name": r[1], "count": r[2], "device_id": r[0]} for r in rows]
     except Exception as e:
         logger.error(f"DNS Top Clients Error: {e}")
         return []
     finally:
-        conn_main.close()
+        conn_dns.close()
 
 def get_date_range(range_str: str, now: Optional[datetime] = None):
     if not now:
@@ -568,37 +552,43 @@ def get_date_range(range_str: str, now: Optional[datetime] = None):
 
     return start, end, bucket, trunc
 
-@router.get("/dns/stats/{device_id}")
-def get_device_dns_stats(device_id: str, range: str = "24h"):
+def _device_filter(conn, device_id: str) -> Tuple[str, list]:
     """
-    Returns KPIs for a specific device.
+    WHERE clause for a device's DNS rows: by device_id, or by its IP for rows synced
+    before the client was mapped. devices resolves through the DNS cursor's search path.
     """
-    logger.debug(f"Fetching DNS stats for device: {device_id} (range: {range})")
-    conn = get_dns_connection()
-    start_time, end_time, _, _ = get_date_range(range)
-    
-    # Get the device IP for fallback matching (incase device_id was NULL during sync)
-    conn_main = get_connection()
-    dev_row = conn_main.execute("SELECT ip FROM devices WHERE id = ?", [device_id]).fetchone()
+    dev_row = conn.execute("SELECT ip FROM devices WHERE id = ?", [device_id]).fetchone()
     device_ip = dev_row[0] if dev_row else None
-    
+
     where_clause = "(device_id = ?"
     params = [device_id]
     if device_ip:
         where_clause += " OR client_ip = ?"
         params.append(device_ip)
     where_clause += ")"
+    return where_clause, params
+
+@router.get("/dns/stats/{device_id}")
+def get_device_dns_stats(device_id: str, range: str = "24h"):
+    """
+    Returns KPIs for a specific device.
+    """
+    logger.debug(f"Fetching DNS stats for device: {device_id} (range: {range})")
+    conn = get_dns_read_connection()
+    start_time, end_time, _, _ = get_date_range(range)
 
     try:
+        where_clause, params = _device_filter(conn, device_id)
         # 1. Total & Blocked
+        source, source_params = dns_source(start_time, end_time)
         res = conn.execute(f"""
             SELECT 
-                COUNT(*) as total,
-                COUNT(CASE WHEN is_blocked = TRUE THEN 1 END) as blocked,
-                AVG(response_time) as avg_latency
-            FROM dns_logs
-            WHERE {where_clause} AND timestamp >= ? AND timestamp <= ?
-        """, params + [start_time, end_time]).fetchone()
+                SUM(queries) as total,
+                SUM(blocked) as blocked,
+                SUM(response_ms) / NULLIF(SUM(queries), 0) as avg_latency
+            FROM ({source})
+            WHERE {where_clause}
+        """, source_params + params).fetchone()
         
         total = res[0] or 0
         blocked = res[1] or 0
@@ -620,26 +610,16 @@ def get_device_dns_stats(device_id: str, range: str = "24h"):
         }
     finally:
         conn.close()
-        conn_main.close()
 
 @router.get("/dns/logs/{device_id}/count")
 def get_device_dns_logs_count(device_id: str):
     """
     Returns total count of DNS logs for a specific device.
     """
-    conn = get_dns_connection()
-    conn_main = get_connection()
-    dev_row = conn_main.execute("SELECT ip FROM devices WHERE id = ?", [device_id]).fetchone()
-    device_ip = dev_row[0] if dev_row else None
-
-    where_clause = "(device_id = ?"
-    params = [device_id]
-    if device_ip:
-        where_clause += " OR client_ip = ?"
-        params.append(device_ip)
-    where_clause += ")"
+    conn = get_dns_read_connection()
 
     try:
+        where_clause, params = _device_filter(conn, device_id)
         res = conn.execute(f"SELECT COUNT(*) FROM dns_logs WHERE {where_clause}", params).fetchone()
         return {"total": res[0] or 0}
     except Exception as e:
@@ -647,7 +627,6 @@ def get_device_dns_logs_count(device_id: str):
         return {"total": 0}
     finally:
         conn.close()
-        conn_main.close()
 
 @router.get("/dns/logs/{device_id}")
 def get_device_dns_logs(device_id: str, limit: int = 50, offset: int = 0):
@@ -655,20 +634,10 @@ def get_device_dns_logs(device_id: str, limit: int = 50, offset: int = 0):
     Returns recent DNS queries for a specific device.
     """
     logger.debug(f"Fetching DNS logs for device: {device_id} (limit: {limit})")
-    conn = get_dns_connection()
-    # Fallback IP matching
-    conn_main = get_connection()
-    dev_row = conn_main.execute("SELECT ip FROM devices WHERE id = ?", [device_id]).fetchone()
-    device_ip = dev_row[0] if dev_row else None
-
-    where_clause = "(device_id = ?"
-    params = [device_id]
-    if device_ip:
-        where_clause += " OR client_ip = ?"
-        params.append(device_ip)
-    where_clause += ")"
+    conn = get_dns_read_connection()
 
     try:
+        where_clause, params = _device_filter(conn, device_id)
         # Get logs joined with domains
         rows = conn.execute(f"""
             SELECT 
@@ -698,23 +667,23 @@ def get_device_dns_logs(device_id: str, limit: int = 50, offset: int = 0):
         return []
     finally:
         conn.close()
-        conn_main.close()
 
 @router.get("/dns/query-types")
 def get_dns_query_types(range: str = "24h"):
     """
     Returns breakdown of DNS queries by type (A, AAAA, PTR, etc.)
     """
-    conn = get_dns_connection()
+    conn = get_dns_read_connection()
     start_time, end_time, _, _ = get_date_range(range)
+    source, params = dns_query_type_source(start_time, end_time)
     try:
-        rows = conn.execute("""
-            SELECT query_type, COUNT(*) as count
-            FROM dns_logs
-            WHERE timestamp >= ? AND timestamp <= ? AND query_type IS NOT NULL
+        rows = conn.execute(f"""
+            SELECT query_type, SUM(queries) as count
+            FROM ({source})
+            WHERE query_type IS NOT NULL
             GROUP BY query_type
             ORDER BY count DESC
-        """, [start_time, end_time]).fetchall()
+        """, params).fetchall()
         
         return [{"label": r[0], "value": r[1]} for r in rows]
     except Exception as e:
@@ -728,85 +697,84 @@ def get_dns_risky_devices(range: str = "24h", limit: int = 5):
     """
     Returns devices with the highest DNS block rates.
     """
-    conn_dns = get_dns_connection()
-    conn_main = get_connection()
+    conn_dns = get_dns_read_connection()
     start_time, end_time, _, _ = get_date_range(range)
+    source, params = dns_source(start_time, end_time)
     try:
         # Get devices with at least 10 queries to avoid noise
-        rows = conn_dns.execute("""
+        rows = conn_dns.execute(f"""
             SELECT 
-                device_id,
-                COUNT(*) as total,
-                COUNT(CASE WHEN is_blocked = TRUE THEN 1 END) as blocked
-            FROM dns_logs
-            WHERE timestamp >= ? AND timestamp <= ? AND device_id IS NOT NULL
-            GROUP BY device_id
-            HAVING total >= 10
-            ORDER BY (CAST(blocked AS FLOAT) / total) DESC
+                l.device_id,
+                COALESCE(d.display_name, d.name),
+                d.icon,
+                d.ip,
+                SUM(l.queries) as total,
+                SUM(l.blocked) as blocked
+            FROM ({source}) l
+            JOIN devices d ON d.id = l.device_id
+            GROUP BY l.device_id, d.display_name, d.name, d.icon, d.ip
+            HAVING SUM(l.queries) >= 10
+            ORDER BY (CAST(SUM(l.blocked) AS FLOAT) / SUM(l.queries)) DESC
             LIMIT ?
-        """, [start_time, end_time, limit]).fetchall()
+        """, params + [limit]).fetchall()
         
-        results = []
-        for r in rows:
-            dev_id, total, blocked = r
-            # Resolve name
-            d_row = conn_main.execute("SELECT name, display_name, icon, ip FROM devices WHERE id = ?", [dev_id]).fetchone()
-            if d_row:
-                results.append({
-                    "id": dev_id,
-                    "name": d_row[1] or d_row[0],
-                    "icon": d_row[2],
-                    "ip": d_row[3],
-                    "total": total,
-                    "blocked": blocked,
-                    "block_rate": round((blocked / total * 100), 1) if total > 0 else 0
-                })
-        return results
+        return [{
+            "id": r[0],
+            "name": r[1],
+            "icon": r[2],
+            "ip": r[3],
+            "total": r[4],
+            "blocked": r[5],
+            "block_rate": round((r[5] / r[4] * 100), 1) if r[4] > 0 else 0
+        } for r in rows]
     except Exception as e:
         logger.error(f"DNS Risky Devices Error: {e}")
         return []
     finally:
         conn_dns.close()
-        conn_main.close()
 
 @router.get("/summary")
 def get_analytics_summary():
     """
     Consolidated summary for the Dashboard (24h default)
     """
-    conn_main = get_connection()
-    conn_dns = get_dns_connection()
+    # One cursor covers both databases: the DNS DB is attached to the main instance
+    conn = get_dns_read_connection()
     
     now = datetime.now()
     start_24h = now - timedelta(hours=24)
     
     try:
         # 1. Traffic Totals
-        traffic_row = conn_main.execute("""
+        source, params = traffic_source(start_24h, now)
+        traffic_row = conn.execute(f"""
             SELECT SUM(down_rate), SUM(up_rate)
-            FROM device_traffic_history
-            WHERE timestamp >= ?
-        """, [start_24h]).fetchone()
+            FROM ({source})
+        """, params).fetchone()
         
         # 2. DNS Totals
-        dns_row = conn_dns.execute("""
-            SELECT 
-                COUNT(*), 
-                COUNT(CASE WHEN is_blocked = TRUE THEN 1 END),
-                MODE(device_id)
-            FROM dns_logs
-            WHERE timestamp >= ?
-        """, [start_24h]).fetchone()
+        source, params = dns_source(start_24h, now)
+        dns_row = conn.execute(f"""
+            WITH per_device AS (
+                SELECT device_id, SUM(queries) as queries, SUM(blocked) as blocked
+                FROM ({source})
+                GROUP BY device_id
+            ),
+            totals AS (
+                SELECT 
+                    SUM(queries) as queries, 
+                    SUM(blocked) as blocked,
+                    arg_max(device_id, queries) FILTER (WHERE device_id IS NOT NULL) as top_device_id
+                FROM per_device
+            )
+            SELECT t.queries, t.blocked, COALESCE(d.display_name, d.name)
+            FROM totals t
+            LEFT JOIN devices d ON d.id = t.top_device_id
+        """, params).fetchone()
         
         total_queries = dns_row[0] or 0
         blocked_queries = dns_row[1] or 0
-        top_client_id = dns_row[2]
-        
-        top_client_name = "None"
-        if top_client_id:
-            c_row = conn_main.execute("SELECT name, display_name FROM devices WHERE id = ?", [top_client_id]).fetchone()
-            if c_row:
-                top_client_name = c_row[1] or c_row[0]
+        top_client_name = dns_row[2] or "None"
 
         return {
             "traffic": {
@@ -824,5 +792,4 @@ def get_analytics_summary():
         logger.error(f"Summary Error: {e}")
         return {}
     finally:
-        conn_dns.close()
-        conn_main.close()
+        conn.close()
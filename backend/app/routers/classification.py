@@ -1,6 +1,7 @@
 from fastapi import APIRouter, HTTPException
-from app.core.db import get_connection
-from app.models.classification import ClassificationRule, ClassificationRuleCreate, ClassificationRuleUpdate
+from app.core.db import get_read_connection, write_async
+from app.models.classification import ClassificationRule, ClassificationRuleCreate, ClassificationRuleUpdate, ServiceOverride, ServiceOverrideUpdate
+from app.services.port_services import load_service_registry
 import asyncio
 import json
 import uuid
@@ -11,7 +12,7 @@ router = APIRouter()
 @router.get("/", response_model=List[ClassificationRule])
 async def list_rules():
     def query():
-        conn = get_connection()
+        conn = get_read_connection()
         try:
             rows = conn.execute("SELECT id, name, pattern_hostname, pattern_vendor, ports, device_type, icon, priority, is_builtin, updated_at FROM classification_rules ORDER BY priority ASC, name ASC").fetchall()
             return [
@@ -34,25 +35,20 @@ async def list_rules():
 
 @router.post("/", response_model=ClassificationRule)
 async def create_rule(rule: ClassificationRuleCreate):
-    def insert():
-        conn = get_connection()
-        try:
-            rule_id = str(uuid.uuid4())
-            conn.execute(
-                """
-                INSERT INTO classification_rules (id, name, pattern_hostname, pattern_vendor, ports, device_type, icon, priority, is_builtin)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                [rule_id, rule.name, rule.pattern_hostname, rule.pattern_vendor, json.dumps(rule.ports), rule.device_type, rule.icon, rule.priority, False]
-            )
-            from app.core.db import commit
-            commit()
-            row = conn.execute("SELECT id, name, pattern_hostname, pattern_vendor, ports, device_type, icon, priority, is_builtin, updated_at FROM classification_rules WHERE id = ?", [rule_id]).fetchone()
-            return row
-        finally:
-            conn.close()
+    def insert(conn):
+        rule_id = str(uuid.uuid4())
+        return conn.execute(
+            """
+            INSERT INTO classification_rules (id, name, pattern_hostname, pattern_vendor, ports, device_type, icon, priority, is_builtin)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            RETURNING id, name, pattern_hostname, pattern_vendor, ports, device_type, icon, priority, is_builtin, updated_at
+            """,
+            [rule_id, rule.name, rule.pattern_hostname, rule.pattern_vendor, json.dumps(rule.ports), rule.device_type, rule.icon, rule.priority, False]
+        ).fetchone()
             
-    row = await asyncio.to_thread(insert)
+    row = await write_async(insert)
+    # Rule names label their ports in the service registry
+    await asyncio.to_thread(load_service_registry)
     return ClassificationRule(
         id=row[0], name=row[1], pattern_hostname=row[2], pattern_vendor=row[3],
         ports=json.loads(row[4] or "[]"), device_type=row[5], icon=row[6],
@@ -61,37 +57,29 @@ async def create_rule(rule: ClassificationRuleCreate):
 
 @router.put("/{rule_id}", response_model=ClassificationRule)
 async def update_rule(rule_id: str, payload: ClassificationRuleUpdate):
-    def update():
-        conn = get_connection()
-        try:
-            # Check if exists and not builtin
-            existing = conn.execute("SELECT is_builtin FROM classification_rules WHERE id = ?", [rule_id]).fetchone()
-            if not existing:
-                raise HTTPException(status_code=404, detail="Rule not found")
-            
-            updates = []
-            params = []
-            for k, v in payload.dict(exclude_unset=True).items():
-                if k == "ports":
-                    updates.append("ports = ?")
-                    params.append(json.dumps(v))
-                else:
-                    updates.append(f"{k} = ?")
-                    params.append(v)
-            
-            if updates:
-                updates.append("updated_at = now()")
-                params.append(rule_id)
-                conn.execute(f"UPDATE classification_rules SET {', '.join(updates)} WHERE id = ?", params)
-                from app.core.db import commit
-                commit()
-            
-            row = conn.execute("SELECT id, name, pattern_hostname, pattern_vendor, ports, device_type, icon, priority, is_builtin, updated_at FROM classification_rules WHERE id = ?", [rule_id]).fetchone()
-            return row
-        finally:
-            conn.close()
+    def update(conn):
+        # Returns None for a missing rule; raising inside a queued op would roll back its whole group
+        updates = []
+        params = []
+        for k, v in payload.dict(exclude_unset=True).items():
+            if k == "ports":
+                updates.append("ports = ?")
+                params.append(json.dumps(v))
+            else:
+                updates.append(f"{k} = ?")
+                params.append(v)
+        
+        if updates:
+            updates.append("updated_at = now()")
+            params.append(rule_id)
+            conn.execute(f"UPDATE classification_rules SET {', '.join(updates)} WHERE id = ?", params)
+        
+        return conn.execute("SELECT id, name, pattern_hostname, pattern_vendor, ports, device_type, icon, priority, is_builtin, updated_at FROM classification_rules WHERE id = ?", [rule_id]).fetchone()
             
-    row = await asyncio.to_thread(update)
+    row = await write_async(update)
+    if not row:
+        raise HTTPException(status_code=404, detail="Rule not found")
+    await asyncio.to_thread(load_service_registry)
     return ClassificationRule(
         id=row[0], name=row[1], pattern_hostname=row[2], pattern_vendor=row[3],
         ports=json.loads(row[4] or "[]"), device_type=row[5], icon=row[6],
@@ -100,20 +88,49 @@ async def update_rule(rule_id: str, payload: ClassificationRuleUpdate):
 
 @router.delete("/{rule_id}")
 async def delete_rule(rule_id: str):
-    def delete():
-        conn = get_connection()
-        try:
-            # Check if builtin
-            existing = conn.execute("SELECT is_builtin FROM classification_rules WHERE id = ?", [rule_id]).fetchone()
-            if not existing:
-                raise HTTPException(status_code=404, detail="Rule not found")
-            if existing[0]:
-                raise HTTPException(status_code=403, detail="Cannot delete built-in rules")
-            
+    def delete(conn):
+        # Check if builtin; the caller turns the result into 404/403
+        existing = conn.execute("SELECT is_builtin FROM classification_rules WHERE id = ?", [rule_id]).fetchone()
+        if existing and not existing[0]:
             conn.execute("DELETE FROM classification_rules WHERE id = ?", [rule_id])
-            from app.core.db import commit
-            commit()
+        return existing
+    existing = await write_async(delete)
+    if not existing:
+        raise HTTPException(status_code=404, detail="Rule not found")
+    if existing[0]:
+        raise HTTPException(status_code=403, detail="Cannot delete built-in rules")
+    await asyncio.to_thread(load_service_registry)
+    return {"status": "success"}
+
+@router.get("/services", response_model=List[ServiceOverride])
+async def list_service_overrides():
+    def query():
+        conn = get_read_connection()
+        try:
+            rows = conn.execute("SELECT port, service FROM service_overrides ORDER BY port").fetchall()
+            return [ServiceOverride(port=r[0], service=r[1]) for r in rows]
         finally:
             conn.close()
-    await asyncio.to_thread(delete)
+    return await asyncio.to_thread(query)
+
+@router.put("/services/{port}", response_model=ServiceOverride)
+async def set_service_override(port: int, payload: ServiceOverrideUpdate):
+    if not 0 < port < 65536:
+        raise HTTPException(status_code=422, detail="Port must be between 1 and 65535")
+    def upsert(conn):
+        conn.execute(
+            "INSERT OR REPLACE INTO service_overrides (port, service, updated_at) VALUES (?, ?, now())",
+            [port, payload.service]
+        )
+    await write_async(upsert)
+    await asyncio.to_thread(load_service_registry)
+    return ServiceOverride(port=port, service=payload.service)
+
+@router.delete("/services/{port}")
+async def delete_service_override(port: int):
+    def delete(conn):
+        return conn.execute("DELETE FROM service_overrides WHERE port = ? RETURNING port", [port]).fetchone()
+    if not await write_async(delete):
+        raise HTTPException(status_code=404, detail="Service override not found")
+    await asyncio.to_thread(load_service_registry)
     return {"status": "success"}
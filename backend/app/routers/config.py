@@ -1,10 +1,11 @@
 from fastapi import APIRouter
-from app.core.db import get_connection
+from app.core.db import get_read_connection, write_async
 from app.models.config import ConfigItem, ConfigUpdate
 import asyncio
 import json
 from typing import Any
 from app.services.mqtt import MQTTManager
+from app.services.worker import wake_scheduler
 import logging
 
 logger = logging.getLogger(__name__)
@@ -13,7 +14,7 @@ router = APIRouter()
 @router.get("/", response_model=list[ConfigItem])
 async def list_config():
     def query():
-        conn = get_connection()
+        conn = get_read_connection()
         try:
             rows = conn.execute("SELECT key, value FROM config").fetchall()
             return [ConfigItem(key=r[0], value=r[1] or "") for r in rows]
@@ -24,7 +25,7 @@ async def list_config():
 @router.get("/{key}", response_model=ConfigItem)
 async def get_config_item(key: str):
     def query():
-        conn = get_connection()
+        conn = get_read_connection()
         try:
             row = conn.execute("SELECT key, value FROM config WHERE key = ?", [key]).fetchone()
             if not row:
@@ -36,54 +37,48 @@ async def get_config_item(key: str):
 
 @router.put("/{key}", response_model=ConfigItem)
 async def upsert_config_item(key: str, payload: ConfigUpdate):
-    def update():
-        conn = get_connection()
-        try:
-            conn.execute(
-                """
-                INSERT OR REPLACE INTO config (key, value, updated_at)
-                VALUES (?, ?, now())
-                """,
-                [key, payload.value],
-            )
-            conn.commit()
-            logger.info(f"Updated config {key} to {payload.value}")
-        finally:
-            conn.close()
-    await asyncio.to_thread(update)
+    def update(conn):
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO config (key, value, updated_at)
+            VALUES (?, ?, now())
+            """,
+            [key, payload.value],
+        )
+        logger.info(f"Updated config {key} to {payload.value}")
+    await write_async(update)
+    wake_scheduler()
+    if key.startswith("mqtt_"):
+        await asyncio.to_thread(lambda: MQTTManager.get_instance().reload_config())
     return ConfigItem(key=key, value=payload.value)
 
 @router.post("/", response_model=list[ConfigItem])
 async def bulk_update_config(payload: dict[str, Any]):
-    def update():
-        conn = get_connection()
+    def update(conn):
         results = []
         mqtt_changed = False
-        try:
-            for key, value in payload.items():
-                if key.startswith("mqtt_"):
-                    mqtt_changed = True
-                    
-                if not isinstance(value, str):
-                    val_str = json.dumps(value)
-                else:
-                    val_str = value
-                    
-                conn.execute(
-                    """
-                    INSERT OR REPLACE INTO config (key, value, updated_at)
-                    VALUES (?, ?, now())
-                    """,
-                    [key, val_str],
-                )
-                results.append(ConfigItem(key=key, value=val_str))
-            conn.commit()
-            logger.info(f"Bulk updated {len(payload)} config items")
-            return results, mqtt_changed
-        finally:
-            conn.close()
+        for key, value in payload.items():
+            if key.startswith("mqtt_"):
+                mqtt_changed = True
+                
+            if not isinstance(value, str):
+                val_str = json.dumps(value)
+            else:
+                val_str = value
+                
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO config (key, value, updated_at)
+                VALUES (?, ?, now())
+                """,
+                [key, val_str],
+            )
+            results.append(ConfigItem(key=key, value=val_str))
+        logger.info(f"Bulk updated {len(payload)} config items")
+        return results, mqtt_changed
             
-    results, mqtt_changed = await asyncio.to_thread(update)
+    results, mqtt_changed = await write_async(update)
+    wake_scheduler()
     
     if mqtt_changed:
         logger.info("MQTT settings changed, validating connection...")
@@ -91,7 +86,9 @@ async def bulk_update_config(payload: dict[str, Any]):
         # We await it so the response to UI isn't sent until we know the status,
         # ensuring the subsequent fetchMqttStatus call gets the new value.
         def validate():
-            MQTTManager.get_instance().test_connection()
+            manager = MQTTManager.get_instance()
+            manager.reload_config()
+            manager.test_connection()
             
         await asyncio.to_thread(validate)
         
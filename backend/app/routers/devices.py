@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Query, HTTPException
 from typing import List, Annotated, Optional, Dict, Any
-from app.core.db import get_connection
+from app.core.db import get_read_connection, write_async
 from app.models.devices import DeviceRead, DeviceUpdate, PaginatedDevicesResponse
 from app.services.devices import update_device_fields
 import json, asyncio, math
@@ -17,7 +17,7 @@ async def _internal_list_devices(
     limit: int = 20
 ):
     def query():
-        conn = get_connection()
+        conn = get_read_connection()
         try:
             # First, get total count for pagination
             count_sql = "SELECT COUNT(*) FROM devices"
@@ -172,7 +172,7 @@ async def list_devices(
 @router.get("/{device_id}", response_model=DeviceRead)
 async def get_device(device_id: str):
     def query():
-        conn = get_connection()
+        conn = get_read_connection()
         try:
             row = conn.execute(
                 """
@@ -240,48 +240,39 @@ async def export_devices():
 
 @router.post("/import/json")
 async def import_devices(devices_data: List[DeviceRead]):
-    def sync_import():
-        conn = get_connection()
-        try:
-            count = 0
-            for d in devices_data:
-                # Store as string in DB
-                attrs_raw = json.dumps(d.attributes) if d.attributes else "{}"
-                conn.execute(
-                    """
-                    INSERT OR REPLACE INTO devices 
-                    (id, ip, mac, name, display_name, device_type, first_seen, last_seen, vendor, icon, status, ip_type, open_ports, attributes, is_trusted)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """,
-                    [
-                        d.id, d.ip, d.mac, d.name, d.display_name, d.device_type,
-                        d.first_seen, d.last_seen, d.vendor, d.icon, d.status, d.ip_type, json.dumps(d.open_ports), attrs_raw, d.is_trusted
-                    ]
-                )
-                count += 1
-            from app.core.db import commit
-            commit()
-            return count
-        finally:
-            conn.close()
-    count = await asyncio.to_thread(sync_import)
+    def sync_import(conn):
+        count = 0
+        for d in devices_data:
+            # Store as string in DB
+            attrs_raw = json.dumps(d.attributes) if d.attributes else "{}"
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO devices 
+                (id, ip, mac, name, display_name, device_type, first_seen, last_seen, vendor, icon, status, ip_type, open_ports, attributes, is_trusted)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    d.id, d.ip, d.mac, d.name, d.display_name, d.device_type,
+                    d.first_seen, d.last_seen, d.vendor, d.icon, d.status, d.ip_type, json.dumps(d.open_ports), attrs_raw, d.is_trusted
+                ]
+            )
+            count += 1
+        return count
+    count = await write_async(sync_import)
     return {"status": "success", "imported": count}
 
 @router.delete("/{device_id}")
 async def delete_device(device_id: str):
-    def sync_delete():
-        conn = get_connection()
-        try:
-            row = conn.execute("SELECT id FROM devices WHERE id = ?", [device_id]).fetchone()
-            if not row: raise HTTPException(status_code=404, detail="Device not found")
-            conn.execute("DELETE FROM device_ports WHERE device_id = ?", [device_id])
-            conn.execute("DELETE FROM device_status_history WHERE device_id = ?", [device_id])
-            conn.execute("DELETE FROM devices WHERE id = ?", [device_id])
-            from app.core.db import commit
-            commit()
-        finally:
-            conn.close()
-    try:
-        await asyncio.to_thread(sync_delete)
-        return {"status": "success", "message": f"Device {device_id} deleted"}
-    except HTTPException as e: raise e
+    def sync_delete(conn):
+        # Raising inside a queued op would roll back every write grouped with it,
+        # so report a missing device by return value instead
+        row = conn.execute("SELECT id FROM devices WHERE id = ?", [device_id]).fetchone()
+        if not row:
+            return False
+        conn.execute("DELETE FROM device_ports WHERE device_id = ?", [device_id])
+        conn.execute("DELETE FROM device_status_history WHERE device_id = ?", [device_id])
+        conn.execute("DELETE FROM devices WHERE id = ?", [device_id])
+        return True
+    if not await write_async(sync_delete):
+        raise HTTPException(status_code=404, detail="Device not found")
+    return {"status": "success", "message": f"Device {device_id} deleted"}
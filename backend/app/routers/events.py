@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Query
 from typing import List, Annotated
-from app.core.db import get_connection
+from app.core.db import get_read_connection
 from app.models.events import DeviceEvent, EventStats
 from datetime import datetime, timedelta, timezone
 import asyncio
@@ -15,7 +15,7 @@ async def list_events(
     search: Annotated[str | None, Query()] = None
 ):
     def query():
-        conn = get_connection()
+        conn = get_read_connection()
         try:
             sql = """
                 SELECT h.id, h.device_id, h.status, h.changed_at,
@@ -55,7 +55,7 @@ async def list_events(
 @router.get("/stats", response_model=List[EventStats])
 async def get_event_stats(hours: int = 168):
     def query():
-        conn = get_connection()
+        conn = get_read_connection()
         try:
             sql = """
                 SELECT changed_at as ts, 
@@ -77,7 +77,7 @@ async def get_event_stats(hours: int = 168):
 @router.get("/device/{device_id}", response_model=List[DeviceEvent])
 async def get_device_history(device_id: str, limit: int = 50, offset: int = 0):
     def query():
-        conn = get_connection()
+        conn = get_read_connection()
         try:
             rows = conn.execute(
                 """
@@ -105,7 +105,7 @@ async def get_device_history(device_id: str, limit: int = 50, offset: int = 0):
 @router.get("/count")
 async def get_events_count(status: str | None = None, search: str | None = None):
     def query():
-        conn = get_connection()
+        conn = get_read_connection()
         try:
             sql = "SELECT count(*) FROM device_status_history h JOIN devices d ON h.device_id = d.id"
             clauses = []
@@ -128,7 +128,7 @@ async def get_events_count(status: str | None = None, search: str | None = None)
 @router.get("/device/{device_id}/count")
 async def get_device_events_count(device_id: str):
     def query():
-        conn = get_connection()
+        conn = get_read_connection()
         try:
             count = conn.execute("SELECT count(*) FROM device_status_history WHERE device_id = ?", [device_id]).fetchone()[0]
             return {"total": count}
@@ -139,7 +139,7 @@ async def get_device_events_count(device_id: str):
 @router.get("/device/{device_id}/fidelity")
 async def get_device_fidelity_history(device_id: str, hours: int = 24):
     def query():
-        conn = get_connection()
+        conn = get_read_connection()
         try:
             # 1. Get device details
             device_row = conn.execute("SELECT mac, ip FROM devices WHERE id = ?", [device_id]).fetchone()
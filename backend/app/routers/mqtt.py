@@ -1,3 +1,4 @@
+import asyncio
 from fastapi import APIRouter, HTTPException
 from paho.mqtt import client as mqtt
 from typing import Optional
@@ -33,7 +34,7 @@ async def test_mqtt_connection(payload: MQTTTestRequest):
         "password": payload.password
     }
     
-    success, message = manager.test_connection(test_config)
+    success, message = await asyncio.to_thread(manager.test_connection, test_config)
     
     return {
         "success": success,
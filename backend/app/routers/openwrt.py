@@ -2,7 +2,8 @@ from fastapi import APIRouter, HTTPException, BackgroundTasks
 from pydantic import BaseModel
 from typing import Optional
 from app.services.openwrt import OpenWRTClient
-from app.core.db import get_connection
+from app.core.db import get_read_connection, run_write
+from app.services.worker import wake_scheduler
 import json
 import logging
 
@@ -25,9 +26,8 @@ class VerifyRequest(BaseModel):
 
 @router.get("/config")
 def get_config():
-    conn = get_connection()
+    conn = get_read_connection()
     try:
-        conn.execute("CREATE TABLE IF NOT EXISTS integrations (name TEXT PRIMARY KEY, config TEXT)")
         row = conn.execute("SELECT config FROM integrations WHERE name = 'openwrt'").fetchone()
         
         # Also fetch verified status from config table
@@ -47,39 +47,42 @@ def get_config():
     finally:
         conn.close()
 
+def _set_verified(conn, verified: bool):
+    conn.execute("INSERT OR REPLACE INTO config (key, value) VALUES ('openwrt_verified', ?)", ["true" if verified else "false"])
+
 @router.post("/config")
 def save_config(config: OpenWRTConfig):
-    conn = get_connection()
+    conn = get_read_connection()
     try:
-        conn.execute("CREATE TABLE IF NOT EXISTS integrations (name TEXT PRIMARY KEY, config TEXT)")
-        
         row = conn.execute("SELECT config FROM integrations WHERE name = 'openwrt'").fetchone()
-        existing = json.loads(row[0]) if row else {}
-        
-        new_conf = config.dict()
-        if config.password is None or config.password == "*****":
-             new_conf["password"] = existing.get("password")
-        
-        # Auto-verify on save
-        verified = False
-        if new_conf.get("url") and new_conf.get("enabled", True):
-            try:
-                client = OpenWRTClient(new_conf["url"], new_conf["username"], new_conf["password"])
-                client.login()
-                verified = True
-            except:
-                verified = False
+    finally:
+        conn.close()
+    existing = json.loads(row[0]) if row else {}
+    
+    new_conf = config.dict()
+    if config.password is None or config.password == "*****":
+         new_conf["password"] = existing.get("password")
+    
+    # Auto-verify on save
+    verified = False
+    if new_conf.get("url") and new_conf.get("enabled", True):
+        try:
+            client = OpenWRTClient(new_conf["url"], new_conf["username"], new_conf["password"])
+            client.login()
+            verified = True
+        except:
+            verified = False
 
+    def save(conn):
         # Save main config
         conn.execute("INSERT OR REPLACE INTO integrations (name, config) VALUES ('openwrt', ?)", [json.dumps(new_conf)])
         
         # Save verified status to config table
-        conn.execute("INSERT OR REPLACE INTO config (key, value) VALUES ('openwrt_verified', ?)", ["true" if verified else "false"])
-        
-        conn.commit()
-        return {"status": "saved", "verified": verified}
-    finally:
-        conn.close()
+        _set_verified(conn, verified)
+    
+    run_write(save)
+    wake_scheduler()
+    return {"status": "saved", "verified": verified}
 
 @router.post("/verify")
 def verify_connection(creds: VerifyRequest):
@@ -88,27 +91,17 @@ def verify_connection(creds: VerifyRequest):
         client.login()
         
         # Update verified status in config table
-        conn = get_connection()
-        try:
-            conn.execute("INSERT OR REPLACE INTO config (key, value) VALUES ('openwrt_verified', 'true')")
-            conn.commit()
-        finally:
-             conn.close()
+        run_write(_set_verified, True)
 
         return {"status": "success", "message": "Connected successfully", "verified": True}
     except Exception as e:
         # On failure, also update DB to false
-        conn = get_connection()
-        try:
-            conn.execute("INSERT OR REPLACE INTO config (key, value) VALUES ('openwrt_verified', 'false')")
-            conn.commit()
-        finally:
-            conn.close()
+        run_write(_set_verified, False)
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.post("/sync")
 async def trigger_sync(background_tasks: BackgroundTasks):
-    conn = get_connection()
+    conn = get_read_connection()
     try:
         row = conn.execute("SELECT config FROM integrations WHERE name = 'openwrt'").fetchone()
         if not row:
@@ -1,17 +1,30 @@
 from fastapi import APIRouter, HTTPException
-from app.core.db import get_connection
-from app.models.scans import ScanCreate, ScanRead, ScanResultRead, PaginatedScansResponse
+from fastapi.responses import StreamingResponse
+from app.core.db import get_read_connection, write_async
+from app.models.scans import ScanCreate, ScanProfile, ScanRead, ScanResultRead, PaginatedScansResponse
 from datetime import datetime, timezone
 import json, uuid, asyncio
 from typing import List
-from app.services.scans import scan_device
+from app.services.scans import get_live_progress
+from app.services.worker import SCAN_PRIORITY_INTERACTIVE, enqueue_scan, wake_scan_runner, wake_scheduler
 
 router = APIRouter()
 
+# Progress stream: poll interval, and how often an idle stream sends a keepalive
+# comment so proxies (nginx proxy_read_timeout) do not drop it
+EVENTS_POLL_SECONDS = 0.5
+EVENTS_KEEPALIVE_SECONDS = 15
+
+def _parse_progress(raw):
+    if not raw:
+        return None
+    try: return json.loads(raw)
+    except: return None
+
 @router.get("/gist")
 async def get_scan_gist():
     def query():
-        conn = get_connection()
+        conn = get_read_connection()
         try:
             total_count = conn.execute("SELECT COUNT(*) FROM scans").fetchone()[0]
             done_count = conn.execute("SELECT COUNT(*) FROM scans WHERE status = 'done'").fetchone()[0]
@@ -41,9 +54,9 @@ async def get_scan_gist():
     return await asyncio.to_thread(query)
 
 @router.post("/discovery")
-async def trigger_discovery():
+async def trigger_discovery(profile: ScanProfile = "standard"):
     def get_discovery_target():
-        conn = get_connection()
+        conn = get_read_connection()
         try:
             row = conn.execute("SELECT value FROM config WHERE key = 'scan_subnets'").fetchone()
             target = None
@@ -68,7 +81,7 @@ async def trigger_discovery():
 
     target = await asyncio.to_thread(get_discovery_target)
     from app.services.worker import enqueue_scan
-    scan_id = await enqueue_scan(target, "arp")
+    scan_id = await enqueue_scan(target, "arp", priority=SCAN_PRIORITY_INTERACTIVE, profile=profile)
     
     if not scan_id:
         return {"status": "already_active", "message": "A scan is already in progress for this target.", "target": target}
@@ -76,25 +89,21 @@ async def trigger_discovery():
 
 @router.post("/", response_model=ScanRead)
 async def create_scan(payload: ScanCreate):
-    def sync_create():
-        conn = get_connection()
-        try:
-            scan_id = str(uuid.uuid4())
-            now = datetime.now(timezone.utc)
-            options_json = json.dumps(payload.options) if payload.options else None
-            conn.execute(
-                "INSERT INTO scans (id, target, scan_type, options, status, created_at) VALUES (?, ?, ?, ?, 'queued', ?)",
-                [scan_id, payload.target, payload.scan_type, options_json, now],
-            )
-            conn.commit()
-            return scan_id, now
-        finally:
-            conn.close()
+    def sync_create(conn):
+        scan_id = str(uuid.uuid4())
+        now = datetime.now(timezone.utc)
+        options_json = json.dumps(payload.options) if payload.options else None
+        conn.execute(
+            "INSERT INTO scans (id, target, scan_type, options, status, created_at, priority, profile) VALUES (?, ?, ?, ?, 'queued', ?, ?, ?)",
+            [scan_id, payload.target, payload.scan_type, options_json, now, SCAN_PRIORITY_INTERACTIVE, payload.profile],
+        )
+        return scan_id, now
             
-    scan_id, now = await asyncio.to_thread(sync_create)
+    scan_id, now = await write_async(sync_create)
+    wake_scan_runner()
     return ScanRead(
         id=scan_id, target=payload.target, scan_type=payload.scan_type,
-        options=payload.options, status="queued", created_at=now,
+        options=payload.options, profile=payload.profile, status="queued", created_at=now,
         started_at=None, finished_at=None, error_message=None
     )
 
@@ -102,13 +111,13 @@ async def create_scan(payload: ScanCreate):
 async def list_scans(page: int = 1, limit: int = 20):
     def query():
         offset = (page - 1) * limit
-        conn = get_connection()
+        conn = get_read_connection()
         try:
             total = conn.execute("SELECT COUNT(*) FROM scans").fetchone()[0]
             rows = conn.execute(
                 """
                 SELECT id, target, scan_type, options, status,
-                       created_at, started_at, finished_at, error_message
+                       created_at, started_at, finished_at, error_message, profile, progress
                 FROM scans 
                 ORDER BY created_at DESC
                 LIMIT ? OFFSET ?
@@ -129,8 +138,8 @@ async def list_scans(page: int = 1, limit: int = 20):
                 except: opts = {"raw": str(r[3])}
 
             items.append(ScanRead(
-                id=r[0], target=str(r[1]), scan_type=str(r[2]), options=opts, status=str(r[4]),
-                created_at=r[5], started_at=r[6], finished_at=r[7], error_message=r[8]
+                id=r[0], target=str(r[1]), scan_type=str(r[2]), options=opts, profile=r[9] or "standard",
+                progress=_parse_progress(r[10]), status=str(r[4]), created_at=r[5], started_at=r[6], finished_at=r[7], error_message=r[8]
             ))
         except: continue
             
@@ -142,7 +151,7 @@ async def list_scans(page: int = 1, limit: int = 20):
 @router.get("/{scan_id}/results", response_model=List[ScanResultRead])
 async def get_scan_results(scan_id: str):
     def query():
-        conn = get_connection()
+        conn = get_read_connection()
         try:
             rows = conn.execute(
                 """
@@ -167,13 +176,52 @@ async def get_scan_results(scan_id: str):
             conn.close()
     return await asyncio.to_thread(query)
 
+@router.get("/{scan_id}/events")
+async def stream_scan_events(scan_id: str):
+    """Server-sent events with the scan's status and progress, until it finishes."""
+    def query():
+        conn = get_read_connection()
+        try:
+            return conn.execute("SELECT status, progress, error_message FROM scans WHERE id = ?", [scan_id]).fetchone()
+        finally:
+            conn.close()
+
+    row = await asyncio.to_thread(query)
+    if not row:
+        raise HTTPException(status_code=404, detail="Scan not found")
+
+    async def events():
+        nonlocal row
+        last, last_sent = None, asyncio.get_running_loop().time()
+        while row:
+            status, progress, error_message = row
+            # Deep scans running here report every port; others the last flushed progress
+            live = get_live_progress(scan_id) if status == "running" else None
+            data = json.dumps({"status": status, "progress": live or _parse_progress(progress), "error_message": error_message})
+            now = asyncio.get_running_loop().time()
+            if data != last:
+                yield f"data: {data}\n\n"
+                last, last_sent = data, now
+            elif now - last_sent >= EVENTS_KEEPALIVE_SECONDS:
+                yield ": keepalive\n\n"
+                last_sent = now
+            if status not in ("queued", "running"):
+                return
+            await asyncio.sleep(EVENTS_POLL_SECONDS)
+            row = await asyncio.to_thread(query)
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @router.get("/{scan_id}", response_model=ScanRead)
 async def get_scan(scan_id: str):
     def query():
-        conn = get_connection()
+        conn = get_read_connection()
         try:
             row = conn.execute(
-                "SELECT id, target, scan_type, options, status, created_at, started_at, finished_at, error_message FROM scans WHERE id = ?",
+                "SELECT id, target, scan_type, options, status, created_at, started_at, finished_at, error_message, profile, progress FROM scans WHERE id = ?",
                 [scan_id]
             ).fetchone()
             return row
@@ -189,14 +237,14 @@ async def get_scan(scan_id: str):
         except: opts = {"raw": str(row[3])}
 
     return ScanRead(
-        id=row[0], target=str(row[1]), scan_type=str(row[2]), options=opts, status=str(row[4]),
-        created_at=row[5], started_at=row[6], finished_at=row[7], error_message=row[8]
+        id=row[0], target=str(row[1]), scan_type=str(row[2]), options=opts, profile=row[9] or "standard",
+        progress=_parse_progress(row[10]), status=str(row[4]), created_at=row[5], started_at=row[6], finished_at=row[7], error_message=row[8]
     )
 
 @router.post("/device/{device_id}")
-async def trigger_device_scan(device_id: str):
+async def trigger_device_scan(device_id: str, profile: ScanProfile = "full"):
     def get_details():
-        conn = get_connection()
+        conn = get_read_connection()
         try:
             row = conn.execute("SELECT ip FROM devices WHERE id = ?", [device_id]).fetchone()
             return row[0] if row else None
@@ -206,60 +254,62 @@ async def trigger_device_scan(device_id: str):
     ip = await asyncio.to_thread(get_details)
     if not ip:
         raise HTTPException(status_code=404, detail="Device not found")
-    
-    # Run deep scan
-    ports = await scan_device(device_id, ip)
-    return {"status": "done", "ports": ports}
+
+    # Runs as a queued job; follow it via GET /{scan_id}/events
+    scan_id = await enqueue_scan(
+        ip, "deep", priority=SCAN_PRIORITY_INTERACTIVE, profile=profile, options={"device_id": device_id}
+    )
+    if not scan_id:
+        def get_active():
+            conn = get_read_connection()
+            try:
+                row = conn.execute(
+                    "SELECT id FROM scans WHERE status IN ('queued', 'running') AND target = ? AND scan_type = 'deep'", [ip]
+                ).fetchone()
+                return row[0] if row else None
+            finally:
+                conn.close()
+        return {"status": "already_active", "scan_id": await asyncio.to_thread(get_active), "target": ip}
+    return {"status": "enqueued", "scan_id": scan_id, "target": ip}
 
 @router.delete("/queue")
 async def clear_scan_queue():
-    def sync_cancel_all():
-        conn = get_connection()
-        try:
-            conn.execute(
-                "UPDATE scans SET status = 'interrupted', finished_at = ?, error_message = 'Batch canceled' WHERE status = 'queued'",
-                [datetime.now(timezone.utc)]
-            )
-            conn.commit()
-        finally:
-            conn.close()
-    await asyncio.to_thread(sync_cancel_all)
+    def sync_cancel_all(conn):
+        conn.execute(
+            "UPDATE scans SET status = 'interrupted', finished_at = ?, error_message = 'Batch canceled' WHERE status = 'queued'",
+            [datetime.now(timezone.utc)]
+        )
+    await write_async(sync_cancel_all)
+    # Schedules skipped because these scans were queued can run again
+    wake_scheduler()
     return {"status": "success", "message": "All queued scans marked as cancelled"}
 
 @router.delete("/{scan_id}")
 async def cancel_scan(scan_id: str):
-    def sync_cancel():
-        conn = get_connection()
-        try:
-            # Check status
-            row = conn.execute("SELECT status FROM scans WHERE id = ?", [scan_id]).fetchone()
-            if not row:
-                raise HTTPException(status_code=404, detail="Scan not found")
-            
-            # User wants to mark as cancelled, never delete.
-            # Only allowed for queued or running scans.
-            if row[0] in ('running', 'queued'):
-                conn.execute(
-                    "UPDATE scans SET status = 'interrupted', finished_at = ?, error_message = 'Canceled by user' WHERE id = ?", 
-                    [datetime.now(timezone.utc), scan_id]
-                )
-                conn.commit()
-                return {"status": "success", "message": "Scan marked as cancelled"}
-            else:
-                raise HTTPException(status_code=400, detail="Finished scans cannot be modified")
-        finally:
-            conn.close()
-    return await asyncio.to_thread(sync_cancel)
+    def sync_cancel(conn):
+        # User wants to mark as cancelled, never delete.
+        # Only allowed for queued or running scans. Returns the status found (None if
+        # missing); raising here would roll back every write grouped with this op.
+        row = conn.execute("SELECT status FROM scans WHERE id = ?", [scan_id]).fetchone()
+        if row and row[0] in ('running', 'queued'):
+            conn.execute(
+                "UPDATE scans SET status = 'interrupted', finished_at = ?, error_message = 'Canceled by user' WHERE id = ?", 
+                [datetime.now(timezone.utc), scan_id]
+            )
+        return row[0] if row else None
+
+    status = await write_async(sync_cancel)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Scan not found")
+    if status not in ('running', 'queued'):
+        raise HTTPException(status_code=400, detail="Finished scans cannot be modified")
+    wake_scheduler()
+    return {"status": "success", "message": "Scan marked as cancelled"}
 
 @router.delete("/")
 async def clear_all_history():
-    def sync_delete():
-        conn = get_connection()
-        try:
-            conn.execute("DELETE FROM scan_results")
-            conn.execute("DELETE FROM scans")
-            conn.commit()
-        finally:
-            conn.close()
-    await asyncio.to_thread(sync_delete)
+    def sync_delete(conn):
+        conn.execute("DELETE FROM scan_results")
+        conn.execute("DELETE FROM scans")
+    await write_async(sync_delete)
     return {"status": "success", "message": "All scan history cleared"}
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, HTTPException
-from app.core.db import get_connection
+from app.core.db import get_read_connection, write_async
 from app.models.schedules import ScheduleCreate, ScheduleRead
+from app.services.worker import wake_scheduler
 from datetime import datetime
 import uuid, asyncio
 
@@ -8,40 +9,38 @@ router = APIRouter()
 
 @router.post("/", response_model=ScheduleRead)
 async def create_schedule(payload: ScheduleCreate):
-    def sync_create():
-        conn = get_connection()
-        try:
-            sched_id = str(uuid.uuid4())
-            conn.execute(
-                """
-                INSERT INTO scan_schedules 
-                (id, name, scan_type, target, interval_seconds, enabled)
-                VALUES (?, ?, ?, ?, ?, ?)
-                """,
-                [sched_id, payload.name, payload.scan_type, payload.target, payload.interval_seconds, payload.enabled],
-            )
-            conn.commit()
-            return sched_id
-        finally:
-            conn.close()
-    sched_id = await asyncio.to_thread(sync_create)
+    def sync_create(conn):
+        sched_id = str(uuid.uuid4())
+        conn.execute(
+            """
+            INSERT INTO scan_schedules 
+            (id, name, scan_type, target, interval_seconds, enabled, profile)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            [sched_id, payload.name, payload.scan_type, payload.target, payload.interval_seconds, payload.enabled, payload.profile],
+        )
+        return sched_id
+    sched_id = await write_async(sync_create)
+    wake_scheduler()
     return ScheduleRead(
         id=sched_id, name=payload.name, scan_type=payload.scan_type,
-        target=payload.target, interval_seconds=payload.interval_seconds, enabled=payload.enabled
+        target=payload.target, interval_seconds=payload.interval_seconds, enabled=payload.enabled,
+        profile=payload.profile
     )
 
 @router.get("/", response_model=list[ScheduleRead])
 async def list_schedules():
     def query():
-        conn = get_connection()
+        conn = get_read_connection()
         try:
             rows = conn.execute(
-                "SELECT id, name, scan_type, target, interval_seconds, enabled, last_run_at, next_run_at FROM scan_schedules"
+                "SELECT id, name, scan_type, target, interval_seconds, enabled, last_run_at, next_run_at, profile FROM scan_schedules"
             ).fetchall()
             return [
                 ScheduleRead(
                     id=r[0], name=r[1], scan_type=r[2], target=r[3], 
-                    interval_seconds=r[4], enabled=r[5], last_run_at=r[6], next_run_at=r[7]
+                    interval_seconds=r[4], enabled=r[5], last_run_at=r[6], next_run_at=r[7],
+                    profile=r[8] or "standard"
                 )
                 for r in rows
             ]
@@ -51,12 +50,8 @@ async def list_schedules():
 
 @router.delete("/{schedule_id}")
 async def delete_schedule(schedule_id: str):
-    def sync_delete():
-        conn = get_connection()
-        try:
-            conn.execute("DELETE FROM scan_schedules WHERE id = ?", [schedule_id])
-            conn.commit()
-        finally:
-            conn.close()
-    await asyncio.to_thread(sync_delete)
+    def sync_delete(conn):
+        conn.execute("DELETE FROM scan_schedules WHERE id = ?", [schedule_id])
+    await write_async(sync_delete)
+    wake_scheduler()
     return {"status": "deleted"}
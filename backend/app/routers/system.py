@@ -1,6 +1,7 @@
 from fastapi import APIRouter, UploadFile, File, HTTPException, BackgroundTasks
 from fastapi.responses import FileResponse
 from app.services.system import SystemService
+import asyncio
 import logging
 import os
 from pathlib import Path
@@ -22,7 +23,8 @@ async def download_backup(background_tasks: BackgroundTasks):
     Downloads the raw DuckDB database file.
     """
     try:
-        temp_db_path = SystemService.create_backup()
+        # create_backup waits on the writer thread; keep that off the event loop
+        temp_db_path = await asyncio.to_thread(SystemService.create_backup)
         background_tasks.add_task(cleanup_temp_file, temp_db_path)
         
         return FileResponse(
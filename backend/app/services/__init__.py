@@ -1,4 +1,4 @@
 from .scans import run_scan_job
-from .worker import scheduler_loop, scan_runner_loop
+from .worker import scheduler_loop, scan_runner_loop, retention_loop
 
-__all__ = ["run_scan_job", "scheduler_loop", "scan_runner_loop"]
+__all__ = ["run_scan_job", "scheduler_loop", "scan_runner_loop", "retention_loop"]
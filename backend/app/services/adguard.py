@@ -3,11 +3,61 @@ import requests
 import json
 import os
 from datetime import datetime, timezone, timedelta
-from app.core.db import get_connection, commit
-from app.core.dns_db import get_dns_connection, commit_dns
+from typing import Optional
+from app.core.config import get_settings
+from app.core.db import get_read_connection, json_batch, run_write
+from app.core.dns_db import get_dns_read_connection, run_dns_write
+from app.services.rollups import fold_dns_logs
 
 logger = logging.getLogger(__name__)
 
+# dns_logs keeps this many days; older query log entries are neither fetched nor stored
+DNS_LOG_RETENTION_DAYS = 7
+
+# dns_logs columns collected per sync; domain/category resolve to dns_domains on insert
+BATCH_COLUMNS = {
+    "timestamp": "TIMESTAMPTZ",
+    "device_id": "VARCHAR",
+    "domain": "VARCHAR",
+    "status": "VARCHAR",
+    "query_type": "VARCHAR",
+    "client_ip": "VARCHAR",
+    "response_time": "INTEGER",
+    "is_blocked": "BOOLEAN",
+    "category": "VARCHAR",
+}
+
+def _parse_ts(value: str) -> float:
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+def _ingest_batch(conn, batch: dict):
+    """
+    Writes one sync's worth of query log entries with two set-based statements:
+    upsert every domain in the batch, then insert all log rows joined to their domain ids.
+    """
+    rows = json_batch(BATCH_COLUMNS)
+    payload = json.dumps(batch)
+
+    # Latest sighting wins for last_seen / is_blocked, also when a resumed walk ingests
+    # entries older than ones already stored; category is only set on first insert
+    conn.execute(f"""
+        INSERT INTO dns_domains (domain, category, is_blocked, last_seen)
+        SELECT domain, arg_max(category, timestamp), arg_max(is_blocked, timestamp), MAX(timestamp)
+        FROM ({rows})
+        GROUP BY domain
+        ON CONFLICT (domain) DO UPDATE SET
+            is_blocked = CASE
+                WHEN dns_domains.last_seen IS NULL OR EXCLUDED.last_seen >= dns_domains.last_seen
+                THEN EXCLUDED.is_blocked ELSE dns_domains.is_blocked END,
+            last_seen = GREATEST(dns_domains.last_seen, EXCLUDED.last_seen)
+    """, [payload])
+    conn.execute(f"""
+        INSERT INTO dns_logs (timestamp, device_id, domain_id, status, query_type, client_ip, response_time, is_blocked)
+        SELECT r.timestamp, r.device_id, d.id, r.status, r.query_type, r.client_ip, r.response_time, r.is_blocked
+        FROM ({rows}) r
+        JOIN dns_domains d ON d.domain = r.domain
+    """, [payload])
+
 class AdguardClient:
     def __init__(self, base_url, username, password):
         self.base_url = base_url.rstrip('/')
@@ -27,179 +77,193 @@ class AdguardClient:
             logger.error(f"Adguard connection failed: {e}")
             raise e
 
-    def get_query_log(self):
-        """Fetch recent query logs"""
-        # Adguard API: /control/querylog
-        # We fetch the latest batch. We might need pagination if volume is huge, 
-        # but for now let's grab the default or a reasonable limit.
+    def get_query_log(self, older_than: Optional[str] = None, limit: int = 500):
+        """
+        Fetch one page of the query log, newest first.
+        Returns (entries, oldest) where `oldest` is the older_than cursor for the next page.
+        """
+        params = {"limit": limit}
+        if older_than:
+            params["older_than"] = older_than
         try:
-            # Fetch generic stats for overview
-            stats_resp = self.session.get(f"{self.base_url}/control/stats", timeout=10)
-            stats = stats_resp.json() if stats_resp.ok else {}
-
-            # Fetch detailed query log
-            # params: limit (default 50), older_than (cursor)
-            # We want to fetch everything since last sync ideally. 
-            # But the API uses 'older_than' (pagination backwards). 
-            # So we fetch the LATEST X entries and filter by time > last_sync.
-            resp = self.session.get(f"{self.base_url}/control/querylog?limit=1000", timeout=10)
+            resp = self.session.get(f"{self.base_url}/control/querylog", params=params, timeout=10)
             resp.raise_for_status()
-            return {"stats": stats, "logs": resp.json().get("data", [])}
+            body = resp.json()
+            return body.get("data") or [], body.get("oldest") or None
         except Exception as e:
             logger.error(f"Failed to fetch Adguard data: {e}")
             raise e
 
+    def fetch_new_logs(self, floor_ts: float, cursor: Optional[str] = None):
+        """
+        Walks the query log backwards with older_than, starting at `cursor` (or the newest
+        entry), until it reaches entries at or before floor_ts. At most
+        adguard_querylog_max_pages pages are fetched per call.
+        Returns (entries oldest first, cursor to resume from or None once caught up).
+        """
+        settings = get_settings()
+        page_size = settings.adguard_querylog_page_size
+        entries = []
+        for _ in range(settings.adguard_querylog_max_pages):
+            page, oldest = self.get_query_log(cursor, page_size)
+            entries.extend(page)
+            if len(page) < page_size or not oldest or _parse_ts(oldest) <= floor_ts:
+                cursor = None
+                break
+            cursor = oldest
+        entries.reverse()
+        return entries, cursor
+
     def sync(self):
         """Fetch data and update both DNS DB and Main DB"""
         logger.info("Starting Adguard Sync...")
         
         # 1. Get Configuration & Last Sync Time
-        conn_main = get_connection()
+        conn_main = get_read_connection()
         try:
             row = conn_main.execute("SELECT config FROM integrations WHERE name = 'adguard'").fetchone()
-            if not row:
-                logger.warning("Adguard integration not configured (no DB entry).")
-                return
-
-            config = json.loads(row[0])
-            last_sync_str = config.get("last_sync_ts") # explicit timestamp
-            last_sync_ts = 0
-            if last_sync_str:
-                try:
-                    last_sync_ts = datetime.fromisoformat(last_sync_str).timestamp()
-                except:
-                    pass
-            
-            # 2. Fetch Data
-            try:
-                data = self.get_query_log()
-                logs = data["logs"]
-                # Sort by time asc (API returns desc usually)
-                logs.reverse() 
-            except Exception as e:
-                return # Error logged in client
-            
-            # 3. Process Logs -> DNS DB
-            conn_dns = get_dns_connection()
-            new_last_sync_ts = last_sync_ts
-            processed_count = 0
-            
             # Pre-fetch devices for mapping (IP, Name, Display Name)
-            device_map = {} # identifier -> device_id
             dev_rows = conn_main.execute("SELECT id, ip, name, display_name FROM devices").fetchall()
-            for r in dev_rows:
-                did, ip, name, display_name = r
-                if ip: device_map[ip.lower()] = did
-                if name: device_map[name.lower()] = did
-                if display_name: device_map[display_name.lower()] = did
-            
-            # Cache for domain IDs to avoid DB hammered lookups
-            domain_cache = {} 
-            
-            processed_device_stats = {} # device_id -> {queries: 0, blocked: 0}
+        finally:
+            conn_main.close()
+        if not row:
+            logger.warning("Adguard integration not configured (no DB entry).")
+            return
 
+        config = json.loads(row[0])
+        last_sync_str = config.get("last_sync_ts") # explicit timestamp
+        last_sync_ts = 0
+        if last_sync_str:
             try:
-                for item in logs:
-                    # item format: { "time": "2023-...", "question": { "name": "..." }, "client": "1.2.3.4", "status": "FilteredBlackList", "elapsedMs": "..." }
-                    ts_str = item.get("time")
-                    # Parse timestamp (Adguard usually returns ISO 8601)
-                    # Python 3.11+ supports fromisoformat("2023-10-10T10:10:10.123Z") usually
-                    # If simplified parsing needed:
-                    try:
-                        ts = datetime.fromisoformat(ts_str.replace('Z', '+00:00'))
-                    except:
-                        continue
-                        
-                    if ts.timestamp() <= last_sync_ts:
-                        continue # Already processed
-                    
-                    if ts.timestamp() > new_last_sync_ts:
-                        new_last_sync_ts = ts.timestamp()
+                last_sync_ts = datetime.fromisoformat(last_sync_str).timestamp()
+            except:
+                pass
 
-                    # Extract Data
-                    domain = item.get("question", {}).get("name", "").lower()
-                    if not domain: continue
-                    
-                    client_ip = item.get("client")
-                    status = item.get("status", "OK") 
-                    reason = item.get("reason", "")
-                    query_type = item.get("question", {}).get("type", "A") # e.g. 'A', 'AAAA', 'PTR'
+        # An unfinished walk from a previous run: resume below `querylog_cursor`.
+        # last_sync_ts only advances (to `querylog_head`) once the walk reaches it.
+        resume_cursor = config.get("querylog_cursor")
+        head_ts = last_sync_ts
+        if resume_cursor and config.get("querylog_head"):
+            head_ts = datetime.fromisoformat(config["querylog_head"]).timestamp()
+        
+        # Never backfill past the retention window (the cleanup below would delete it again)
+        retention_floor = (datetime.now(timezone.utc) - timedelta(days=DNS_LOG_RETENTION_DAYS)).timestamp()
+        floor_ts = max(last_sync_ts, retention_floor)
+
+        # 2. Fetch Data (oldest first)
+        try:
+            logs, next_cursor = self.fetch_new_logs(floor_ts, resume_cursor)
+        except Exception as e:
+            return # Error logged in client
+        
+        # 3. Process Logs -> DNS DB
+        new_last_sync_ts = last_sync_ts
+        processed_count = 0
+        ingested = False
+        
+        device_map = {} # identifier -> device_id
+        for r in dev_rows:
+            did, ip, name, display_name = r
+            if ip: device_map[ip.lower()] = did
+            if name: device_map[name.lower()] = did
+            if display_name: device_map[display_name.lower()] = did
+        
+        # Columnar batch: one list per dns_logs column, written set-based below
+        batch = {col: [] for col in BATCH_COLUMNS}
+
+        try:
+            for item in logs:
+                # item format: { "time": "2023-...", "question": { "name": "..." }, "client": "1.2.3.4", "status": "FilteredBlackList", "elapsedMs": "..." }
+                ts_str = item.get("time")
+                # Parse timestamp (Adguard usually returns ISO 8601)
+                # Python 3.11+ supports fromisoformat("2023-10-10T10:10:10.123Z") usually
+                # If simplified parsing needed:
+                try:
+                    ts = datetime.fromisoformat(ts_str.replace('Z', '+00:00'))
+                except:
+                    continue
                     
-                    # Broaden blocked check:
-                    # 1. Standard statuses
-                    # 2. 'Filtered' status generic
-                    # 3. Presence of filterId/rule if status is ambiguous (AdGuard versions vary)
-                    is_blocked = (
-                        status in ["FilteredBlackList", "SafeBrowsing", "ParentalControl", "Blocked"] or
-                        (status.startswith("Filtered") and status != "FilteredSafeSearch") or
-                        (bool(item.get("filterId")) and "Filtered" in status)
+                if ts.timestamp() <= floor_ts:
+                    continue # Already processed, or past retention
+                
+                if ts.timestamp() > new_last_sync_ts:
+                    new_last_sync_ts = ts.timestamp()
+                if ts.timestamp() > head_ts:
+                    head_ts = ts.timestamp()
+
+                # Extract Data
+                domain = item.get("question", {}).get("name", "").lower()
+                if not domain: continue
+                
+                client_ip = item.get("client")
+                status = item.get("status", "OK") 
+                query_type = item.get("question", {}).get("type", "A") # e.g. 'A', 'AAAA', 'PTR'
+                
+                # Broaden blocked check:
+                # 1. Standard statuses
+                # 2. 'Filtered' status generic
+                # 3. Presence of filterId/rule if status is ambiguous (AdGuard versions vary)
+                is_blocked = (
+                    status in ["FilteredBlackList", "SafeBrowsing", "ParentalControl", "Blocked"] or
+                    (status.startswith("Filtered") and status != "FilteredSafeSearch") or
+                    (bool(item.get("filterId")) and "Filtered" in status)
+                )
+                # elapsedMs comes back as a decimal string, e.g. "0.563"
+                try:
+                    elapsed = round(float(item.get("elapsedMs", 0)))
+                except (TypeError, ValueError):
+                    elapsed = 0
+                
+                category = item.get("reason", "") # sometimes reason gives list name
+                
+                # Resolve Device ID
+                device_id = device_map.get(client_ip.lower() if client_ip else "")
+                if not device_id:
+                    logger.debug(f"DNS Sync: Could not map client '{client_ip}' to device ID. Map has {len(device_map)} devices.")
+                
+                batch["timestamp"].append(ts.isoformat())
+                batch["device_id"].append(device_id)
+                batch["domain"].append(domain)
+                batch["status"].append(status)
+                batch["query_type"].append(query_type)
+                batch["client_ip"].append(client_ip)
+                batch["response_time"].append(elapsed)
+                batch["is_blocked"].append(is_blocked)
+                batch["category"].append(category)
+
+            processed_count = len(batch["timestamp"])
+            if processed_count:
+                def ingest(conn):
+                    _ingest_batch(conn, batch)
+                    # Fold exactly the rows inserted above into the hourly rollups
+                    fold_dns_logs(
+                        conn,
+                        datetime.fromtimestamp(last_sync_ts, timezone.utc) if last_sync_ts else None,
+                        datetime.fromtimestamp(new_last_sync_ts, timezone.utc),
                     )
-                    elapsed = item.get("elapsedMs", 0)
-                    
-                    category = item.get("reason", "") # sometimes reason gives list name
-                    
-                    # Resolve Domain ID
-                    if domain not in domain_cache:
-                        # Upsert Domain
-                        # DuckDB doesn't have ON CONFLICT DO UPDATE for all cases easily in Python client sometimes, but INSERT OR IGNORE works or standard check.
-                        # We use a check-insert pattern or INSERT OR IGNORE
-                        
-                        # 1. Check exist
-                        d_row = conn_dns.execute("SELECT id FROM dns_domains WHERE domain = ?", [domain]).fetchone()
-                        if d_row:
-                            d_id = d_row[0]
-                            # Update status (blind update last_seen)
-                            conn_dns.execute("UPDATE dns_domains SET last_seen = ?, is_blocked = ? WHERE id = ?", [ts, is_blocked, d_id])
-                        else:
-                            # Insert
-                            conn_dns.execute("INSERT INTO dns_domains (domain, category, is_blocked, last_seen) VALUES (?, ?, ?, ?) RETURNING id", 
-                                           [domain, category, is_blocked, ts])
-                            d_id = conn_dns.fetchone()[0]
-                        domain_cache[domain] = d_id
-                    else:
-                        d_id = domain_cache[domain]
-                    
-                    # Resolve Device ID
-                    device_id = device_map.get(client_ip.lower() if client_ip else "")
-                    if not device_id:
-                        logger.debug(f"DNS Sync: Could not map client '{client_ip}' to device ID. Map has {len(device_map)} devices.")
-                    else:
-                        logger.debug(f"DNS Sync: Mapped '{client_ip}' to device '{device_id}'")
-                    
-                    # Insert Log
-                    conn_dns.execute("""
-                        INSERT INTO dns_logs (timestamp, device_id, domain_id, status, query_type, client_ip, response_time, is_blocked)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                    """, [ts, device_id, d_id, status, query_type, client_ip, elapsed, is_blocked])
-                    
-                    processed_count += 1
-                    
-                    # Aggregation stats
-                    if device_id:
-                        if device_id not in processed_device_stats:
-                            processed_device_stats[device_id] = {"queries": 0, "blocked": 0}
-                        processed_device_stats[device_id]["queries"] += 1
-                        if is_blocked:
-                            processed_device_stats[device_id]["blocked"] += 1
+                run_dns_write(ingest)
 
-                commit_dns()
-                logger.info(f"Adguard Sync: {processed_count} new entries.")
+            ingested = True
+            logger.info(f"Adguard Sync: {processed_count} new entries.")
+            if next_cursor:
+                logger.info(f"Adguard Sync: page budget reached, resuming below {next_cursor} next run.")
 
-            except Exception as e:
-                logger.error(f"Error during DNS DB operations: {e}")
-                pass # Don't crash, try to save what we can?
-
-            # 4. Update Main DB Stats (Devices)
-            # We want "24h stats". 
-            # Current approach: The 'processed_device_stats' is just the delta since last sync.
-            # Real 24h stats need a query on dns_logs.duckdb.
-            # Doing a big aggregate query on dns_logs every sync might be heavy?
-            # Let's do it efficiently: Query DNS DB for 24h stats GROUP BY device_id
+        except Exception as e:
+            # The batch was rolled back; the stored watermark/cursor stay put so the next sync retries it
+            logger.error(f"Error during DNS DB operations: {e}")
+
+        # 4. Update Main DB Stats (Devices)
+        # We want "24h stats". 
+        # Real 24h stats need a query on dns_logs.duckdb.
+        # Doing a big aggregate query on dns_logs every sync might be heavy?
+        # Let's do it efficiently: Query DNS DB for 24h stats GROUP BY device_id
+        
+        try:
+            msg = logger.info("Calculating 24h stats...")
+            one_day_ago = datetime.now(timezone.utc) - timedelta(days=1)
             
+            conn_dns = get_dns_read_connection()
             try:
-                msg = logger.info("Calculating 24h stats...")
-                one_day_ago = datetime.now(timezone.utc) - timedelta(days=1)
-                
                 stats_rows = conn_dns.execute("""
                     SELECT 
                         device_id, 
@@ -209,42 +273,49 @@ class AdguardClient:
                     FROM dns_logs 
                     WHERE timestamp > ? AND device_id IS NOT NULL
                     GROUP BY device_id
-                """, [one_day_ago]).fetchall()
-                
-                # Update devices table
-                for r in stats_rows:
-                    dev_id, total, blocked, last_act = r
-                    
-                    stats_json = json.dumps({
-                        "queries_24h": total,
-                        "blocked_24h": blocked,
-                        "last_activity": last_act.isoformat() if last_act else None
-                    })
-                    
-                    conn_main.execute("UPDATE devices SET dns_stats = ? WHERE id = ?", [stats_json, dev_id])
-                
-                # Update integration config
-                config["last_sync_ts"] = datetime.fromtimestamp(new_last_sync_ts).isoformat()
-                config["last_check"] = datetime.now().isoformat()
-                conn_main.execute("UPDATE integrations SET config = ? WHERE name = 'adguard'", [json.dumps(config)])
-                
-                commit(conn_main)
+                    """, [one_day_ago]).fetchall()
+            finally:
+                conn_dns.close()
+            
+            # Update devices table
+            stats_updates = []
+            for r in stats_rows:
+                dev_id, total, blocked, last_act = r
                 
-                # 5. Retention Cleanup (Keep 7 days by default)
-                # Ideally config driven, but 7 days is reasonable for deep logs.
-                try:
-                    cleanup_cutoff = datetime.now(timezone.utc) - timedelta(days=7)
-                    conn_dns.execute("DELETE FROM dns_logs WHERE timestamp < ?", [cleanup_cutoff])
-                    # Optional: compact if needed, but auto-checkpoint usually handles WAL
-                    commit_dns()
-                except Exception as e:
-                    logger.error(f"Error during retention cleanup: {e}")
+                stats_json = json.dumps({
+                    "queries_24h": total,
+                    "blocked_24h": blocked,
+                    "last_activity": last_act.isoformat() if last_act else None
+                })
                 
-            except Exception as e:
-                logger.error(f"Error updating main DB stats: {e}")
+                stats_updates.append([stats_json, dev_id])
+            
+            # Update integration config
+            if ingested:
+                if next_cursor:
+                    config["querylog_cursor"] = next_cursor
+                    config["querylog_head"] = datetime.fromtimestamp(head_ts).isoformat()
+                else:
+                    config["last_sync_ts"] = datetime.fromtimestamp(head_ts).isoformat()
+                    config.pop("querylog_cursor", None)
+                    config.pop("querylog_head", None)
+            config["last_check"] = datetime.now().isoformat()
 
-        finally:
-            conn_main.close()
-            # conn_dns closed? No, we use shared connection but we should probably leave it open or handle properly.
-            # The get_dns_connection uses shared, so we don't 'close' it per se, just release cursor? 
-            # The helper doesn't really close valid cursors but that's fine for duckdb.
+            def save_stats(conn):
+                if stats_updates:
+                    conn.executemany("UPDATE devices SET dns_stats = ? WHERE id = ?", stats_updates)
+                conn.execute("UPDATE integrations SET config = ? WHERE name = 'adguard'", [json.dumps(config)])
+            
+            run_write(save_stats)
+            
+            # 5. Retention Cleanup (DNS_LOG_RETENTION_DAYS)
+            try:
+                cleanup_cutoff = datetime.now(timezone.utc) - timedelta(days=DNS_LOG_RETENTION_DAYS)
+                def cleanup(conn):
+                    conn.execute("DELETE FROM dns_logs WHERE timestamp < ?", [cleanup_cutoff])
+                run_dns_write(cleanup)
+            except Exception as e:
+                logger.error(f"Error during retention cleanup: {e}")
+            
+        except Exception as e:
+            logger.error(f"Error updating main DB stats: {e}")
@@ -7,7 +7,7 @@ from datetime import datetime, timezone
 from uuid import uuid4
 from typing import Optional, List, Dict, Any
 
-from app.core.db import get_connection
+from app.core.db import get_connection, json_batch, write_async
 from app.services.mqtt import publish_device_online, publish_device_offline
 
 logger = logging.getLogger(__name__)
@@ -30,129 +30,211 @@ async def batch_upsert_devices(devices_data: List[Dict[str, Any]]) -> List[str]:
     if not devices_data:
         return []
 
-    def sync_batch_upsert():
-        conn = get_connection()
-        try:
-            now = datetime.now(timezone.utc)
-            upserted_ids = []
-            new_devices_to_enrich = [] # (id, mac)
-            online_notifications = [] # device_info dicts
-            
-            from app.services.classification import classify_device, get_vendor_locally
-
-            for data in devices_data:
-                ip = data["ip"]
-                mac = data.get("mac")
-                hostname = data.get("hostname")
-                protocol = data.get("protocol", "tcp").lower()
-                ports = data.get("ports", [])
-                
-                device_id = None
-                existing_device = None
-                
-                if mac:
-                    existing_device = conn.execute(
-                        "SELECT id, first_seen, last_seen, ip, ip_type, attributes, status FROM devices WHERE mac = ?", 
-                        [mac]
-                    ).fetchone()
-                
-                if not existing_device:
-                    existing_device = conn.execute(
-                        "SELECT id, first_seen, last_seen, ip, ip_type, attributes, status FROM devices WHERE ip = ?", 
-                        [ip]
-                    ).fetchone()
-
-                is_new = False
+    def sync_batch_upsert(conn):
+        now = datetime.now(timezone.utc)
+        upserted_ids = []
+        new_devices_to_enrich = {} # id -> mac
+        online_notifications = {} # id -> device_info dict
+
+        from app.services.classification import classify_device, get_vendor_locally
+
+        # 1. One lookup for every candidate device, by MAC or IP
+        macs = list({d["mac"] for d in devices_data if d.get("mac")})
+        ips = list({d["ip"] for d in devices_data})
+        values = json_batch({"value": "VARCHAR"})
+        rows = conn.execute(
+            f"""
+            SELECT id, ip, mac, name, display_name, device_type, icon, ip_type, vendor, first_seen, status
+            FROM devices
+            WHERE mac IN (SELECT value FROM ({values})) OR ip IN (SELECT value FROM ({values}))
+            """,
+            [json.dumps({"value": macs}), json.dumps({"value": ips})]
+        ).fetchall()
+
+        columns = ("id", "ip", "mac", "name", "display_name", "device_type", "icon", "ip_type", "vendor", "first_seen", "status")
+        devices = {} # id -> current row state (dict), updated as the batch is applied
+        by_mac, by_ip = {}, {}
+        for r in rows:
+            dev = dict(zip(columns, r))
+            devices[dev["id"]] = dev
+            if dev["mac"]: by_mac.setdefault(dev["mac"], dev)
+            by_ip.setdefault(dev["ip"], dev)
+
+        ports_by_device = {} # id -> {(port, protocol): service}
+        if devices:
+            port_rows = conn.execute(
+                f"SELECT device_id, port, protocol, service FROM device_ports WHERE device_id IN (SELECT value FROM ({values}))",
+                [json.dumps({"value": list(devices)})]
+            ).fetchall()
+            for device_id, port, proto, service in port_rows:
+                ports_by_device.setdefault(device_id, {})[(port, proto)] = service
+
+        # 2. Compute new/changed rows in Python
+        changed = {} # id -> dev (final state)
+        status_changes = []
+        port_upserts = {} # (id, port, protocol) -> service
+        port_deletes = [] # (id, port, protocol) no longer open
+        ports_verified = [] # ids whose port list was verified now
+
+        for data in devices_data:
+            ip = data["ip"]
+            mac = data.get("mac")
+            hostname = data.get("hostname")
+            ports = data.get("ports", [])
+
+            port_numbers = [p["port"] for p in ports]
+            guessed_type, guessed_icon = classify_device(hostname, None, port_numbers)
+
+            dev = (by_mac.get(mac) if mac else None) or by_ip.get(ip)
+            if dev:
+                old_status = dev["status"]
+                if dev["ip"] != ip and by_ip.get(dev["ip"]) is dev:
+                    del by_ip[dev["ip"]]
+                dev["ip"] = ip
+                dev["mac"] = mac or dev["mac"]
+                dev["name"] = dev["name"] or hostname
+                dev["device_type"] = dev["device_type"] or guessed_type
+                dev["icon"] = dev["icon"] or guessed_icon
+            else:
                 old_status = 'unknown'
-                
-                port_numbers = [p["port"] for p in ports]
-                guessed_type, guessed_icon = classify_device(hostname, None, port_numbers)
-
-                if existing_device:
-                    device_id, first_seen, last_seen, old_ip, old_ip_type, attributes_raw, old_status = existing_device
-                    conn.execute(
-                        """
-                        UPDATE devices
-                        SET last_seen = ?,
-                            ip = ?,
-                            mac = COALESCE(?, mac),
-                            name = COALESCE(name, ?),
-                            device_type = COALESCE(device_type, ?),
-                            icon = COALESCE(icon, ?),
-                            open_ports = ?,
-                            status = ?
-                        WHERE id = ?
-                        """,
-                        [now, ip, mac, hostname, guessed_type, guessed_icon, json.dumps(ports), 'online', device_id]
-                    )
-                else:
-                    is_new = True
-                    device_id = str(uuid4())
-                    conn.execute(
-                        """
-                        INSERT INTO devices (id, ip, mac, name, display_name, device_type, icon, ip_type, open_ports, first_seen, last_seen, attributes, status)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        """,
-                        [device_id, ip, mac, hostname, hostname or ip, guessed_type, guessed_icon, data.get("ip_type"), json.dumps(ports), now, now, "{}", 'online']
-                    )
-
-                # Record status change if needed
-                if old_status != 'online':
-                    conn.execute(
-                        "INSERT INTO device_status_history (id, device_id, status, changed_at) VALUES (?, ?, ?, ?)",
-                        [str(uuid4()), device_id, 'online', now]
-                    )
-
-                for p in ports:
-                    p_proto = p.get("protocol", "tcp").lower()
-                    conn.execute(
-                        """
-                        INSERT OR REPLACE INTO device_ports (device_id, port, protocol, service, last_seen)
-                        VALUES (?, ?, ?, ?, ?)
-                        """,
-                        [device_id, p["port"], p_proto, p["service"], now]
-                    )
-
-                all_ports_rows = conn.execute(
-                    "SELECT port, protocol, service FROM device_ports WHERE device_id = ? ORDER BY port",
-                    [device_id]
-                ).fetchall()
-                all_ports = [{"port": r[0], "protocol": r[1], "service": r[2]} for r in all_ports_rows]
+                dev = {
+                    "id": str(uuid4()), "ip": ip, "mac": mac, "name": hostname,
+                    "display_name": hostname or ip, "device_type": guessed_type, "icon": guessed_icon,
+                    "ip_type": data.get("ip_type"), "vendor": None, "first_seen": now, "status": None,
+                }
+                devices[dev["id"]] = dev
+            device_id = dev["id"]
+            by_ip[ip] = dev
+            if dev["mac"]: by_mac[dev["mac"]] = dev
 
-                conn.execute(
-                    "UPDATE devices SET open_ports = ?, last_seen = ?, status = 'online' WHERE id = ?",
-                    [json.dumps(all_ports), now, device_id]
-                )
+            # Record status change if needed
+            if old_status != 'online':
+                status_changes.append(device_id)
+            dev["status"] = 'online'
 
-                if mac:
-                    local_vendor = get_vendor_locally(mac)
-                    if local_vendor:
-                        conn.execute("UPDATE devices SET vendor = COALESCE(vendor, ?) WHERE id = ?", [local_vendor, device_id])
-                
-                upserted_ids.append(device_id)
-                if mac:
-                    new_devices_to_enrich.append((device_id, mac))
-                
-                # Always notify on discovery to ensure MQTT state (HA) stays fresh
-                dev_row = conn.execute("SELECT ip, mac, display_name, vendor, icon, device_type, ip_type, last_seen FROM devices WHERE id = ?", [device_id]).fetchone()
-                if dev_row:
-                    online_notifications.append({
-                        "ip": dev_row[0], "mac": dev_row[1], "hostname": dev_row[2], 
-                        "vendor": dev_row[3], "icon": dev_row[4], "device_type": dev_row[5],
-                        "ip_type": dev_row[6], "last_seen": dev_row[7]
-                    })
-
-            from app.core.db import commit
-            commit()
-            return upserted_ids, new_devices_to_enrich, online_notifications
-        finally:
-            conn.close()
+            known_ports = ports_by_device.setdefault(device_id, {})
+            for p in ports:
+                p_proto = p.get("protocol", "tcp").lower()
+                known_ports[(p["port"], p_proto)] = p.get("service")
+                port_upserts[(device_id, p["port"], p_proto)] = p.get("service")
+
+            # "probed_ports": the TCP ports that were actually checked this time, so
+            # known ports among them that did not answer are closed now
+            probed = data.get("probed_ports")
+            if probed is not None:
+                open_now = {(p["port"], p.get("protocol", "tcp").lower()) for p in ports}
+                probed = set(probed)
+                for key in list(known_ports):
+                    if key[1] == "tcp" and key[0] in probed and key not in open_now:
+                        del known_ports[key]
+                        port_upserts.pop((device_id, *key), None)
+                        port_deletes.append((device_id, *key))
+                ports_verified.append(device_id)
+
+            if mac and not dev["vendor"]:
+                dev["vendor"] = get_vendor_locally(mac)
+
+            changed[device_id] = dev
+            upserted_ids.append(device_id)
+            if mac:
+                new_devices_to_enrich[device_id] = mac
+
+            # Always notify on discovery to ensure MQTT state (HA) stays fresh
+            online_notifications[device_id] = dev
+
+        # 3. Apply with bulk statements: one UPSERT per table
+        device_cols = {
+            "id": "VARCHAR", "ip": "VARCHAR", "mac": "VARCHAR", "name": "VARCHAR", "display_name": "VARCHAR",
+            "device_type": "VARCHAR", "icon": "VARCHAR", "ip_type": "VARCHAR", "vendor": "VARCHAR",
+            "open_ports": "VARCHAR", "first_seen": "TIMESTAMPTZ",
+        }
+        device_batch = {c: [] for c in device_cols}
+        for device_id, dev in changed.items():
+            all_ports = [
+                {"port": port, "protocol": proto, "service": service}
+                for (port, proto), service in sorted(ports_by_device.get(device_id, {}).items())
+            ]
+            for c in device_cols:
+                device_batch[c].append(dev.get(c))
+            device_batch["open_ports"][-1] = json.dumps(all_ports)
+            device_batch["first_seen"][-1] = (dev["first_seen"] or now).isoformat()
+
+        conn.execute(
+            f"""
+            INSERT INTO devices (id, ip, mac, name, display_name, device_type, icon, ip_type, vendor, open_ports, first_seen, last_seen, attributes, status)
+            SELECT id, ip, mac, name, display_name, device_type, icon, ip_type, vendor, open_ports, first_seen, ?, '{{}}', 'online'
+            FROM ({json_batch(device_cols)})
+            ON CONFLICT (id) DO UPDATE SET
+                ip = EXCLUDED.ip,
+                mac = EXCLUDED.mac,
+                name = EXCLUDED.name,
+                device_type = EXCLUDED.device_type,
+                icon = EXCLUDED.icon,
+                vendor = EXCLUDED.vendor,
+                open_ports = EXCLUDED.open_ports,
+                last_seen = EXCLUDED.last_seen,
+                status = EXCLUDED.status
+            """,
+            [now, json.dumps(device_batch)]
+        )
+        if status_changes:
+            conn.execute(
+                f"""
+                INSERT INTO device_status_history (id, device_id, status, changed_at)
+                SELECT uuid()::VARCHAR, value, 'online', ? FROM ({values})
+                """,
+                [now, json.dumps({"value": status_changes})]
+            )
+        if port_upserts:
+            port_cols = {"device_id": "VARCHAR", "port": "INTEGER", "protocol": "VARCHAR", "service": "VARCHAR"}
+            keys = list(port_upserts)
+            conn.execute(
+                f"""
+                INSERT OR REPLACE INTO device_ports (device_id, port, protocol, service, last_seen)
+                SELECT device_id, port, protocol, service, ? FROM ({json_batch(port_cols)})
+                """,
+                [now, json.dumps({
+                    "device_id": [k[0] for k in keys],
+                    "port": [k[1] for k in keys],
+                    "protocol": [k[2] for k in keys],
+                    "service": list(port_upserts.values()),
+                })]
+            )
+
+        if port_deletes:
+            port_cols = {"device_id": "VARCHAR", "port": "INTEGER", "protocol": "VARCHAR"}
+            conn.execute(
+                f"""
+                DELETE FROM device_ports USING ({json_batch(port_cols)}) closed
+                WHERE device_ports.device_id = closed.device_id AND device_ports.port = closed.port
+                  AND device_ports.protocol = closed.protocol
+                """,
+                [json.dumps({
+                    "device_id": [k[0] for k in port_deletes],
+                    "port": [k[1] for k in port_deletes],
+                    "protocol": [k[2] for k in port_deletes],
+                })]
+            )
+        if ports_verified:
+            # The upsert above already moved each device to the IP it was verified at
+            conn.execute(
+                f"UPDATE devices SET ports_verified_at = ?, ports_verified_ip = ip WHERE id IN (SELECT value FROM ({values}))",
+                [now, json.dumps({"value": ports_verified})]
+            )
 
-    upserted_ids, to_enrich, to_notify = await asyncio.to_thread(sync_batch_upsert)
+        notifications = [{
+            "ip": dev["ip"], "mac": dev["mac"], "hostname": dev["display_name"],
+            "vendor": dev["vendor"], "icon": dev["icon"], "device_type": dev["device_type"],
+            "ip_type": dev["ip_type"], "last_seen": now
+        } for dev in online_notifications.values()]
 
-    # Trigger MQTT notifications
+        return upserted_ids, list(new_devices_to_enrich.items()), notifications
+
+    upserted_ids, to_enrich, to_notify = await write_async(sync_batch_upsert)
+
+    # Trigger MQTT notifications (queued for the publisher task)
     for dev_info in to_notify:
-        await asyncio.to_thread(publish_device_online, dev_info)
+        publish_device_online(dev_info)
 
     # Background enrichment for each found device (async)
     for d_id, mac in to_enrich:
@@ -165,18 +247,12 @@ async def record_status_change(conn, device_id: str, status: str, timestamp: dat
     # This remains for internal use if a connection is already open
     # But let's make it robust in case it's called independently
     if not conn:
-        def sync_record():
-            c = get_connection()
-            try:
-                c.execute(
-                    "INSERT INTO device_status_history (id, device_id, status, changed_at) VALUES (?, ?, ?, ?)",
-                    [str(uuid4()), device_id, status, timestamp]
-                )
-                from app.core.db import commit
-                commit()
-            finally:
-                c.close()
-        await asyncio.to_thread(sync_record)
+        def sync_record(c):
+            c.execute(
+                "INSERT INTO device_status_history (id, device_id, status, changed_at) VALUES (?, ?, ?, ?)",
+                [str(uuid4()), device_id, status, timestamp]
+            )
+        await write_async(sync_record)
     else:
         # We assume the caller is in a thread or knows what they are doing
         conn.execute(
@@ -239,43 +315,37 @@ async def enrich_device(device_id: str, mac: str):
             logger.warning(f"API Enrichment failed for {mac}: {e}")
 
     if vendor:
-        def sync_update():
-            conn = get_connection()
-            try:
-                row = conn.execute("SELECT display_name, device_type, icon, attributes FROM devices WHERE id = ?", [device_id]).fetchone()
-                if row:
-                    display_name, current_type, current_icon, old_attrs_json = row
-                    new_type, new_icon = current_type, current_icon
-                    if not current_type or current_type == "unknown":
-                        new_type, new_icon = classify_device(None, vendor)
-                    
-                    new_display = display_name
-                    if not display_name or re.match(r"^\d+\.\d+\.\d+\.\d+$", display_name):
-                         new_display = vendor
-
-                    try:
-                        attrs = json.loads(old_attrs_json) if old_attrs_json else {}
-                    except:
-                        attrs = {}
-                    attrs["vendor"] = vendor
-
-                    conn.execute(
-                        """
-                        UPDATE devices 
-                        SET vendor = COALESCE(vendor, ?),
-                            device_type = CASE WHEN device_type = 'unknown' OR device_type IS NULL THEN ? ELSE device_type END,
-                            icon = CASE WHEN icon = 'help-circle' OR icon IS NULL THEN ? ELSE icon END,
-                            display_name = ?,
-                            attributes = ?
-                        WHERE id = ?
-                        """,
-                        [vendor, new_type, new_icon, new_display, json.dumps(attrs), device_id]
-                    )
-                    from app.core.db import commit
-                    commit()
-            finally:
-                conn.close()
-        await asyncio.to_thread(sync_update)
+        def sync_update(conn):
+            row = conn.execute("SELECT display_name, device_type, icon, attributes FROM devices WHERE id = ?", [device_id]).fetchone()
+            if row:
+                display_name, current_type, current_icon, old_attrs_json = row
+                new_type, new_icon = current_type, current_icon
+                if not current_type or current_type == "unknown":
+                    new_type, new_icon = classify_device(None, vendor)
+
+                new_display = display_name
+                if not display_name or re.match(r"^\d+\.\d+\.\d+\.\d+$", display_name):
+                     new_display = vendor
+
+                try:
+                    attrs = json.loads(old_attrs_json) if old_attrs_json else {}
+                except:
+                    attrs = {}
+                attrs["vendor"] = vendor
+
+                conn.execute(
+                    """
+                    UPDATE devices 
+                    SET vendor = COALESCE(vendor, ?),
+                        device_type = CASE WHEN device_type = 'unknown' OR device_type IS NULL THEN ? ELSE device_type END,
+                        icon = CASE WHEN icon = 'help-circle' OR icon IS NULL THEN ? ELSE icon END,
+                        display_name = ?,
+                        attributes = ?
+                    WHERE id = ?
+                    """,
+                    [vendor, new_type, new_icon, new_display, json.dumps(attrs), device_id]
+                )
+        await write_async(sync_update)
         
         # Trigger MQTT update after enrichment
         def sync_notify():
@@ -294,32 +364,26 @@ async def enrich_device(device_id: str, mac: str):
         await asyncio.to_thread(sync_notify)
 
 async def update_device_fields(device_id: str, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
-    def sync_update():
-        conn = get_connection()
-        try:
-            row = conn.execute("SELECT id, ip, mac, name, display_name, device_type, vendor, icon, status, ip_type, first_seen, last_seen, is_trusted FROM devices WHERE id = ?", [device_id]).fetchone()
-            if not row: return None
-            
-            valid_cols = {'display_name', 'device_type', 'icon', 'attributes', 'ip_type', 'is_trusted', 'parent_id'}
-            updates = []
-            params = []
-            for k, v in fields.items():
-                if k in valid_cols and v is not None:
-                    updates.append(f"{k} = ?")
-                    params.append(v)
-            
-            if updates:
-                params.append(device_id)
-                conn.execute(f"UPDATE devices SET {', '.join(updates)} WHERE id = ?", params)
-                from app.core.db import commit
-                commit()
-            
-            updated = conn.execute("SELECT id, ip, mac, name, display_name, device_type, vendor, icon, status, ip_type, first_seen, last_seen, is_trusted FROM devices WHERE id = ?", [device_id]).fetchone()
-            return updated
-        finally:
-            conn.close()
+    def sync_update(conn):
+        row = conn.execute("SELECT id, ip, mac, name, display_name, device_type, vendor, icon, status, ip_type, first_seen, last_seen, is_trusted FROM devices WHERE id = ?", [device_id]).fetchone()
+        if not row: return None
+
+        valid_cols = {'display_name', 'device_type', 'icon', 'attributes', 'ip_type', 'is_trusted', 'parent_id'}
+        updates = []
+        params = []
+        for k, v in fields.items():
+            if k in valid_cols and v is not None:
+                updates.append(f"{k} = ?")
+                params.append(v)
+
+        if updates:
+            params.append(device_id)
+            conn.execute(f"UPDATE devices SET {', '.join(updates)} WHERE id = ?", params)
+
+        updated = conn.execute("SELECT id, ip, mac, name, display_name, device_type, vendor, icon, status, ip_type, first_seen, last_seen, is_trusted FROM devices WHERE id = ?", [device_id]).fetchone()
+        return updated
 
-    updated = await asyncio.to_thread(sync_update)
+    updated = await write_async(sync_update)
     if not updated: return None
     
     if updated:
@@ -330,7 +394,7 @@ async def update_device_fields(device_id: str, fields: Dict[str, Any]) -> Option
             "is_trusted": updated[12]
         }
         # Trigger MQTT update on manual edit
-        await asyncio.to_thread(publish_device_online, {
+        publish_device_online({
             "ip": dev_info["ip"], "mac": dev_info["mac"], "hostname": dev_info["display_name"],
             "vendor": dev_info["vendor"], "icon": dev_info["icon"], "device_type": dev_info["device_type"],
             "ip_type": dev_info["ip_type"], "last_seen": dev_info["last_seen"]
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import os
+import re
+import socket
+import struct
+import subprocess
+import sys
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+
+def _checksum(data: bytes) -> int:
+    if len(data) % 2:
+        data += b"\0"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+def _echo_request(ident: int, seq: int) -> bytes:
+    payload = b"hnms-sweep"
+    header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, ident, seq)
+    csum = _checksum(header + payload)
+    return struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, csum, ident, seq) + payload
+
+def _open_socket() -> Optional[Tuple[socket.socket, bool]]:
+    """
+    Opens an ICMP socket: an unprivileged datagram socket where the kernel allows it
+    (Linux net.ipv4.ping_group_range), else a raw socket (root/CAP_NET_RAW).
+    Returns (socket, is_raw), or None if neither is permitted.
+    """
+    for sock_type, is_raw in ((socket.SOCK_DGRAM, False), (socket.SOCK_RAW, True)):
+        try:
+            sock = socket.socket(socket.AF_INET, sock_type, socket.IPPROTO_ICMP)
+            sock.setblocking(False)
+            return sock, is_raw
+        except (PermissionError, OSError):
+            continue
+    return None
+
+async def icmp_sweep(ips: Iterable[str], timeout: float = 1.0, budget=None) -> Optional[Dict[str, float]]:
+    """
+    Sends one ICMP echo request to every IP (consumed lazily) from a single socket
+    and collects replies. Returns {ip: rtt_seconds} for hosts that answered, or None
+    if ICMP sockets are not available (caller should fall back to `ping`).
+    """
+    opened = _open_socket()
+    if opened is None:
+        return None
+    sock, is_raw = opened
+    loop = asyncio.get_running_loop()
+    # Datagram sockets get their id rewritten by the kernel (and only see their own
+    # replies); raw sockets see every echo reply on the host, so match on our id.
+    ident = os.getpid() & 0xFFFF
+    sent: Dict[str, float] = {}
+    replies: Dict[str, float] = {}
+
+    def on_readable():
+        while True:
+            try:
+                data, addr = sock.recvfrom(1024)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            received = time.monotonic()
+            # Raw sockets (and datagram sockets on macOS) deliver the IP header too;
+            # an IPv4 header starts with version nibble 4, an ICMP echo reply with type 0
+            if data and data[0] >> 4 == 4:
+                data = data[(data[0] & 0x0F) * 4:]
+            if len(data) < 8:
+                continue
+            icmp_type, _, _, reply_id, _ = struct.unpack("!BBHHH", data[:8])
+            if icmp_type != ICMP_ECHO_REPLY or (is_raw and reply_id != ident):
+                continue
+            ip = addr[0]
+            if ip in sent and ip not in replies:
+                replies[ip] = received - sent[ip]
+
+    try:
+        loop.add_reader(sock.fileno(), on_readable)
+    except NotImplementedError:
+        # Event loop cannot watch sockets (e.g. the Proactor loop on Windows)
+        logger.debug("ICMP socket opened but the event loop cannot watch it")
+        sock.close()
+        return None
+    try:
+        for seq, ip in enumerate(ips):
+            packet = _echo_request(ident, seq & 0xFFFF)
+            if budget is not None:
+                async with budget.slot(ip):
+                    await _send(loop, sock, packet, ip)
+            else:
+                await _send(loop, sock, packet, ip)
+            sent.setdefault(ip, time.monotonic())
+
+        # Wait for stragglers until every host answered or the last one timed out
+        deadline = time.monotonic() + timeout
+        while len(replies) < len(sent) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+    finally:
+        loop.remove_reader(sock.fileno())
+        sock.close()
+
+    logger.info(f"ICMP sweep: {len(replies)}/{len(sent)} hosts answered")
+    return replies
+
+async def _send(loop, sock: socket.socket, packet: bytes, ip: str):
+    while True:
+        try:
+            sock.sendto(packet, (ip, 0))
+            return
+        except (BlockingIOError, InterruptedError):
+            # Send buffer full; give the kernel a moment
+            await asyncio.sleep(0.001)
+        except OSError as e:
+            # e.g. network unreachable for this address; skip it
+            logger.debug(f"ICMP send to {ip} failed: {e}")
+            return
+
+_MAC_RE = re.compile(r"(([0-9a-fA-F]{1,2}[:-]){5}[0-9a-fA-F]{1,2})")
+_IP_RE = re.compile(r"(\d{1,3}(?:\.\d{1,3}){3})")
+
+def read_neighbor_table() -> Dict[str, str]:
+    """
+    Returns {ip: mac} from the kernel neighbor (ARP) table in one read:
+    /proc/net/arp on Linux, a single `arp -a` elsewhere.
+    """
+    table: Dict[str, str] = {}
+    if sys.platform.startswith("linux") and os.path.exists("/proc/net/arp"):
+        try:
+            with open("/proc/net/arp") as f:
+                next(f, None)  # header
+                for line in f:
+                    parts = line.split()
+                    # IP address, HW type, Flags, HW address, Mask, Device
+                    if len(parts) >= 4 and parts[2] != "0x0" and parts[3] != "00:00:00:00:00:00":
+                        table[parts[0]] = parts[3].lower()
+            return table
+        except OSError as e:
+            logger.debug(f"Could not read /proc/net/arp: {e}")
+
+    try:
+        output = subprocess.check_output(["arp", "-a"], stderr=subprocess.STDOUT, timeout=5).decode(errors="ignore")
+    except Exception:
+        return table
+    for line in output.splitlines():
+        ip, mac = _IP_RE.search(line), _MAC_RE.search(line)
+        if ip and mac:
+            # Normalize "a-b-c..." (Windows) and unpadded "a:b:c" (BSD/macOS) forms
+            octets = re.split(r"[:-]", mac.group(1))
+            table[ip.group(1)] = ":".join(o.zfill(2) for o in octets).lower()
+    return table
@@ -1,11 +1,15 @@
 import paho.mqtt.client as mqtt
+import asyncio
+import hashlib
 import json
 import logging
+import os
 import time
 import threading
-from typing import Any, Optional
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
 from app.core.config import get_settings
-from app.core.db import get_connection
+from app.core.db import get_connection, submit_write_nowait
 
 logger = logging.getLogger(__name__)
 # Add a dedicated file handler for MQTT debugging if not already present
@@ -35,6 +39,13 @@ class MQTTManager:
         self.is_reachable = False
         self._client = None
         self._lock = threading.Lock()
+        # Retained topics: topic -> (digest of last published payload, published at)
+        self._published: Dict[str, Tuple[str, float]] = {}
+        self._published_lock = threading.Lock()
+        # Cached MQTT config; refreshed by reload_config() when mqtt_* keys change
+        self._config: Optional[dict] = None
+        self._config_lock = threading.Lock()
+        self._client_params: Optional[tuple] = None
         self._load_status()
         self._connect_persistent()
 
@@ -62,20 +73,22 @@ class MQTTManager:
             conn.close()
 
     def _save_status(self, status: str, error: str = None):
-        """Saves status to the database and updates internal state."""
+        """Updates internal state and persists it to the database when it changed."""
+        self.is_reachable = (status == "online")
+        if status == self.last_status and (error or None) == (self.last_error or None):
+            return
         self.last_status = status
         self.last_error = error
-        self.is_reachable = (status == "online")
         
-        conn = get_connection()
-        try:
+        def write_status(conn):
             conn.execute("INSERT OR REPLACE INTO config (key, value, updated_at) VALUES ('mqtt_status', ?, now())", [status])
             conn.execute("INSERT OR REPLACE INTO config (key, value, updated_at) VALUES ('mqtt_error', ?, now())", [error or ""])
-            conn.commit()
+
+        # Fire-and-forget: callers may be on the event loop or paho's network thread
+        try:
+            submit_write_nowait(write_status)
         except Exception as e:
             logger.error(f"Failed to save MQTT status: {e}")
-        finally:
-            conn.close()
 
     def _connect_persistent(self):
         """Connects the persistent client."""
@@ -94,6 +107,7 @@ class MQTTManager:
             logger.info(f"Initializing persistent MQTT client with unique ID: {client_id}")
             
             self._client = get_mqtt_client(client_id)
+            self._client_params = self._connection_params(config)
             
             if config['username']:
                 self._client.username_pw_set(config['username'], config['password'])
@@ -101,7 +115,10 @@ class MQTTManager:
             def on_connect(client, userdata, flags, rc):
                 if rc == 0:
                     self.is_reachable = True
+                    # The broker may have lost retained state; republish everything once
+                    self.reset_published()
                     self._save_status("online")
+                    replay_retained()
                     logger.info("MQTT Persistent Client connected successfully.")
                 else:
                     self.is_reachable = False
@@ -117,19 +134,60 @@ class MQTTManager:
                 else:
                     logger.info("MQTT Persistent Client disconnected intentionally.")
 
+            def on_connect_fail(client, userdata):
+                self.is_reachable = False
+                self._save_status("offline", f"Could not reach broker at {config['broker']}:{config['port']}")
+
             self._client.on_connect = on_connect
             self._client.on_disconnect = on_disconnect
+            self._client.on_connect_fail = on_connect_fail
             
             try:
-                # Set keepalive to 60s. loop_start() runs the background thread for auto-reconnect.
-                self._client.connect(config['broker'], config['port'], keepalive=60)
+                # Set keepalive to 60s. loop_start() runs the background thread, which does the
+                # (re)connecting, so an unreachable broker never blocks the caller.
+                self._client.connect_async(config['broker'], config['port'], keepalive=60)
                 self._client.loop_start()
             except Exception as e:
                 logger.error(f"Failed to start MQTT persistent client: {e}")
                 self.is_reachable = False
                 self._save_status("offline", str(e))
 
-    def get_config(self):
+    def get_config(self) -> dict:
+        """Returns the MQTT config, reading the config table only on first use."""
+        with self._config_lock:
+            if self._config is None:
+                self._config = self._read_config()
+            return dict(self._config)
+
+    def reload_config(self):
+        """
+        Re-reads the MQTT config after mqtt_* keys were updated. The persistent
+        client is only replaced when broker, port or credentials changed.
+        """
+        config = self._read_config()
+        with self._config_lock:
+            self._config = config
+
+        with self._lock:
+            client = self._client
+            if client is None or self._client_params == self._connection_params(config):
+                return
+            logger.info("MQTT connection settings changed, reconnecting persistent client...")
+            self._client = None
+            self._client_params = None
+            self.is_reachable = False
+        try:
+            client.loop_stop()
+            client.disconnect()
+        except Exception as e:
+            logger.warning(f"Error while closing old MQTT client: {e}")
+        self._connect_persistent()
+
+    @staticmethod
+    def _connection_params(config: dict) -> tuple:
+        return (config['broker'], config['port'], config['username'], config['password'])
+
+    def _read_config(self) -> dict:
         settings = get_settings()
         conn = get_connection()
         try:
@@ -219,6 +277,8 @@ class MQTTManager:
             logger.debug("MQTT health check: Persistent client is connected.")
             self.is_reachable = True
             self._save_status("online")
+            # Drain anything queued while the connection state was unknown
+            _notify()
         elif self._client:
             # Client exists, but disconnected. Paho's background loop is handling it.
             # We don't want to call _connect_persistent or test_connection here,
@@ -233,28 +293,195 @@ class MQTTManager:
             logger.info("MQTT health check: No persistent client found. Initializing...")
             self._connect_persistent()
 
-    def publish(self, topic: str, payload: Any, retain: bool = False):
+    def reset_published(self):
+        """Forgets retained payload digests so the next publish of every topic goes out."""
+        with self._published_lock:
+            self._published.clear()
+
+    def _digest(self, payload: Any, volatile_keys: Iterable[str]) -> str:
+        if isinstance(payload, dict) and volatile_keys:
+            payload = {k: v for k, v in payload.items() if k not in volatile_keys}
+        msg = payload if isinstance(payload, str) else json.dumps(payload, sort_keys=True, default=str)
+        return hashlib.sha1(msg.encode()).hexdigest()
+
+    def publish(self, topic: str, payload: Any, retain: bool = False, volatile_keys: Iterable[str] = ()) -> bool:
+        """
+        Publishes payload to topic. Retained publishes are skipped when the payload
+        (ignoring volatile_keys) matches what was last published to the topic, unless
+        mqtt_republish_interval_seconds has passed or the client reconnected since.
+        Returns False if the broker is unreachable and the message was not sent.
+        """
+        digest = None
+        if retain:
+            digest = self._digest(payload, volatile_keys)
+            with self._published_lock:
+                last = self._published.get(topic)
+            if last and last[0] == digest and time.time() - last[1] < get_settings().mqtt_republish_interval_seconds:
+                logger.debug(f"Skipping unchanged retained publish to {topic}")
+                return True
+
         if not self._client or not self._client.is_connected():
             self._connect_persistent()
             
         if not self.is_reachable:
             logger.debug(f"Skipping MQTT publish to {topic} because broker is offline/unreachable")
-            return
+            return False
             
         try:
             msg = payload if isinstance(payload, str) else json.dumps(payload)
             logger.info(f"Publishing to {topic} (retain={retain})...")
             # Quality of Service 1 ensures delivery, but we don't wait_for_publish
             # to avoid blocking the caller's thread indefinitely
-            self._client.publish(topic, msg, retain=retain, qos=1)
+            info = self._client.publish(topic, msg, retain=retain, qos=1)
+            if info.rc == mqtt.MQTT_ERR_NO_CONN:
+                logger.debug(f"MQTT client not connected, publish to {topic} not sent")
+                return False
             logger.debug(f"Queued publish to {topic}")
+            if digest:
+                with self._published_lock:
+                    self._published[topic] = (digest, time.time())
         except Exception as e:
             logger.error(f"Failed to publish to {topic}: {e}")
             # Don't mark offline immediately if it's just one publish failure,
             # but if it's a connection issue, _client.is_connected() will catch it next time.
+        return True
+
+async def init_mqtt():
+    """Creates the MQTT manager off the event loop (config/status reads, client start)."""
+    await asyncio.to_thread(MQTTManager.get_instance)
+
+def check_mqtt_health():
+    """Runs the periodic health check if the manager exists; never creates it or blocks."""
+    manager = MQTTManager._instance
+    if manager is not None:
+        manager.check_health()
+
+# Outgoing messages are queued here and sent by mqtt_publisher_loop on the event loop.
+# The queue holds one pending message per topic (a newer message replaces an older one)
+# and keeps messages while the broker is unreachable. The last retained payload of every
+# topic is remembered so it can be re-sent after a reconnect.
+_queue: "OrderedDict[str, tuple]" = OrderedDict()
+_retained: Dict[str, tuple] = {}
+_queue_lock = threading.Lock()
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_wakeup: Optional[asyncio.Event] = None
+
+def _notify():
+    """Wakes the publisher task; safe to call from any thread."""
+    if _loop is not None and _wakeup is not None:
+        try:
+            _loop.call_soon_threadsafe(_wakeup.set)
+        except RuntimeError:
+            # Event loop already closed (shutdown)
+            pass
+
+def _enqueue(topic: str, message: tuple, replace: bool = True):
+    settings = get_settings()
+    if topic in _queue:
+        if replace:
+            _queue[topic] = message
+        return
+    if len(_queue) >= settings.mqtt_queue_max:
+        dropped, _ = _queue.popitem(last=False)
+        logger.warning(f"MQTT queue full, dropping pending message for {dropped}")
+    _queue[topic] = message
+
+def publish_mqtt(topic: str, payload: Any, retain: bool = False, volatile_keys: Iterable[str] = ()):
+    """Queues a message for the publisher task. Safe to call from any thread."""
+    message = (payload, retain, tuple(volatile_keys))
+    with _queue_lock:
+        _enqueue(topic, message)
+        if retain:
+            _retained[topic] = message
+    _notify()
+
+def replay_retained():
+    """Re-queues the last retained payload of every topic, e.g. after a broker reconnect."""
+    with _queue_lock:
+        for topic, message in _retained.items():
+            _enqueue(topic, message, replace=False)
+    _notify()
+
+def _take_batch(size: int) -> list:
+    with _queue_lock:
+        batch = []
+        while _queue and len(batch) < size:
+            batch.append(_queue.popitem(last=False))
+        return batch
+
+def _requeue(batch: list):
+    """Puts unsent messages back at the front, unless a newer message for the topic arrived."""
+    with _queue_lock:
+        for topic, message in reversed(batch):
+            if topic not in _queue:
+                _queue[topic] = message
+                _queue.move_to_end(topic, last=False)
 
-def publish_mqtt(topic: str, payload: Any, retain: bool = False):
-    MQTTManager.get_instance().publish(topic, payload, retain=retain)
+def save_mqtt_queue():
+    """Writes pending messages to mqtt_queue_path (if configured) so they survive a restart."""
+    path = get_settings().mqtt_queue_path
+    if not path:
+        return
+    with _queue_lock:
+        pending = [[t, m[0], m[1], list(m[2])] for t, m in _queue.items()]
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(pending, f)
+        logger.info(f"Saved {len(pending)} pending MQTT messages to {path}")
+    except Exception as e:
+        logger.error(f"Failed to save MQTT queue: {e}")
+
+def _load_mqtt_queue():
+    path = get_settings().mqtt_queue_path
+    if not path or not os.path.exists(path):
+        return
+    try:
+        with open(path) as f:
+            pending = json.load(f)
+        os.remove(path)
+    except Exception as e:
+        logger.error(f"Failed to load MQTT queue: {e}")
+        return
+    with _queue_lock:
+        for topic, payload, retain, volatile_keys in pending:
+            # Anything queued since startup is newer than the saved copy
+            message = (payload, retain, tuple(volatile_keys))
+            _enqueue(topic, message, replace=False)
+            if retain:
+                _retained.setdefault(topic, message)
+    logger.info(f"Loaded {len(pending)} pending MQTT messages from {path}")
+
+async def mqtt_publisher_loop():
+    """Drains the MQTT queue in batches while the broker is reachable."""
+    global _loop, _wakeup
+    _loop = asyncio.get_running_loop()
+    _wakeup = asyncio.Event()
+    settings = get_settings()
+    await asyncio.to_thread(_load_mqtt_queue)
+    manager = await asyncio.to_thread(MQTTManager.get_instance)
+    _wakeup.set()
+
+    while True:
+        await _wakeup.wait()
+        _wakeup.clear()
+        try:
+            # While the broker is down messages stay queued; on_connect wakes us up again
+            while manager._client is not None and manager.is_reachable:
+                batch = _take_batch(settings.mqtt_publish_batch_size)
+                if not batch:
+                    break
+                for i, (topic, (payload, retain, volatile_keys)) in enumerate(batch):
+                    if not manager.publish(topic, payload, retain=retain, volatile_keys=volatile_keys):
+                        _requeue(batch[i:])
+                        break
+                else:
+                    # Let other tasks run between batches
+                    await asyncio.sleep(0)
+                    continue
+                break
+        except Exception as e:
+            logger.error(f"Error in mqtt_publisher_loop: {e}")
 
 def publish_ha_discovery(device_info: dict):
     config = MQTTManager.get_instance().get_config()
@@ -319,7 +546,8 @@ def publish_device_status(device_info: dict, status: str):
         "last_seen": last_seen_str,
         "scanner": "HNMS"
     }
-    publish_mqtt(attr_topic, ha_attributes, retain=True)
+    # last_seen moves on every scan; on its own it should not trigger a republish
+    publish_mqtt(attr_topic, ha_attributes, retain=True, volatile_keys=("last_seen",))
     
     if status == "online":
         publish_ha_discovery(device_info)
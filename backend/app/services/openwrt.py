@@ -5,7 +5,8 @@ import os
 import re
 from base64 import b64encode
 from datetime import datetime, timezone
-from app.core.db import get_connection
+from app.core.db import run_write
+from app.services.rollups import fold_traffic_rows
 
 logger = logging.getLogger(__name__)
 
@@ -209,9 +210,9 @@ class OpenWRTClient:
             traffic_deltas = traffic_data["deltas"]
             traffic_totals = traffic_data["totals"]
             
-            conn = get_connection()
-            try:
+            def apply_sync(conn):
                 updated_count = 0
+                hist_ids = []
                 
                 # 1. Build a map of current DHCP leases
                 dhcp_map = {} # mac -> lease
@@ -246,7 +247,7 @@ class OpenWRTClient:
                         existing_icon = row[3]
                         try:
                             attrs = json.loads(row[4]) if row[4] else {}
-                        except:
+                        except (TypeError, ValueError):
                             attrs = {}
                         existing_ip = row[5]
                         existing_ip_type = row[6]
@@ -291,38 +292,38 @@ class OpenWRTClient:
                     if t_total["down"] > 0 or t_total["up"] > 0:
                         import uuid
                         hist_id = str(uuid.uuid4())
-                        try:
-                            conn.execute("""
-                                INSERT INTO device_traffic_history 
-                                (id, device_id, rx_bytes, tx_bytes, down_rate, up_rate) 
-                                VALUES (?, ?, ?, ?, ?, ?)
-                            """, [hist_id, target_id, t_total["down"], t_total["up"], t_delta["down"], t_delta["up"]])
-                        except Exception as e:
-                             logger.error(f"Failed to insert traffic history for {mac}: {e}")
+                        # No per-row try/except: a failed statement aborts the shared write
+                        # transaction, so errors must reach the writer to be replayed
+                        conn.execute("""
+                            INSERT INTO device_traffic_history 
+                            (id, device_id, rx_bytes, tx_bytes, down_rate, up_rate) 
+                            VALUES (?, ?, ?, ?, ?, ?)
+                        """, [hist_id, target_id, t_total["down"], t_total["up"], t_delta["down"], t_delta["up"]])
+                        hist_ids.append(hist_id)
 
                     # Update Device Table
                     if row:
                         # Update existing - ONLY ip_type and attributes
-                        try:
-                             conn.execute("""
-                                UPDATE devices SET
-                                    ip_type = ?,
-                                    attributes = ?
-                                WHERE id = ?
-                            """, [ip_type, json.dumps(attrs), target_id])
-                             updated_count += 1
-                        except Exception as e:
-                            logger.error(f"Failed to update device {mac}: {e}")
+                        conn.execute("""
+                            UPDATE devices SET
+                                ip_type = ?,
+                                attributes = ?
+                            WHERE id = ?
+                        """, [ip_type, json.dumps(attrs), target_id])
+                        updated_count += 1
                     # else:
                         # User requested to IGNORE unknown devices. 
                         # Only the network scanner creates devices.
                         # pass
+
+                # Keep the hourly analytics rollup in step with the raw history
+                fold_traffic_rows(conn, hist_ids)
                 
-                conn.commit()
-                logger.info(f"OpenWRT Sync complete: {updated_count} devices processed.")
-                
-            finally:
-                conn.close()
+                return updated_count
+
+            # One grouped transaction on the writer thread instead of per-row commits
+            updated_count = run_write(apply_sync)
+            logger.info(f"OpenWRT Sync complete: {updated_count} devices processed.")
                 
         except Exception as e:
             logger.error(f"OpenWRT Sync Failed: {e}", exc_info=True)
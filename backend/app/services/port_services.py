@@ -0,0 +1,92 @@
+import json
+import logging
+from types import MappingProxyType
+from typing import Dict, Mapping
+from app.core.db import get_read_connection
+
+logger = logging.getLogger(__name__)
+
+# Names for well-known home-lab ports that /etc/services lacks or names unhelpfully
+COMMON_SERVICES = {
+    6053: "ESPHome API",
+    8123: "Home Assistant",
+    1883: "MQTT",
+    8883: "MQTT (SSL)",
+    5432: "PostgreSQL",
+    3306: "MySQL",
+    6379: "Redis",
+    8006: "Proxmox VE",
+    5000: "Synology DSM",
+    5001: "Synology DSM (SSL)",
+    32400: "Plex Media Server",
+    8096: "Jellyfin",
+    1400: "Sonos",
+    8291: "Winbox (MikroTik)",
+    10001: "Ubiquiti Discovery",
+    8080: "HTTP Proxy/Admin",
+    8443: "HTTPS Proxy/Admin",
+    554: "RTSP (Camera)",
+    8000: "HTTP Alt/Camera",
+    3000: "AdGuard/Grafana",
+    9000: "Portainer",
+    9443: "Portainer (SSL)",
+    53: "DNS",
+    22: "SSH",
+    23: "Telnet",
+    21: "FTP",
+    445: "SMB/CIFS",
+    139: "NetBIOS",
+}
+
+# TCP port -> service name. Replaced as a whole by load_service_registry, never mutated,
+# so lookups need no lock. Until the first load only COMMON_SERVICES is known.
+_registry: Mapping[int, str] = MappingProxyType(dict(COMMON_SERVICES))
+
+def _system_services(path: str = "/etc/services") -> Dict[int, str]:
+    services: Dict[int, str] = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                parts = line.split("#", 1)[0].split()
+                if len(parts) < 2 or not parts[1].endswith("/tcp"):
+                    continue
+                try:
+                    port = int(parts[1].split("/", 1)[0])
+                except ValueError:
+                    continue
+                services.setdefault(port, parts[0])
+    except OSError:
+        pass
+    return services
+
+def load_service_registry() -> int:
+    """
+    Rebuilds the registry; later sources win:
+    classification rule names (for their ports) < /etc/services < COMMON_SERVICES < service_overrides.
+    Returns the number of known ports.
+    """
+    global _registry
+    registry = _system_services()
+    conn = get_read_connection()
+    try:
+        rule_rows = conn.execute("SELECT name, ports FROM classification_rules ORDER BY priority DESC").fetchall()
+        override_rows = conn.execute("SELECT port, service FROM service_overrides").fetchall()
+    finally:
+        conn.close()
+
+    # Rule names only label ports nothing else knows; lower priority values win, as in classification
+    rule_names: Dict[int, str] = {}
+    for name, ports in rule_rows:
+        for port in json.loads(ports or "[]"):
+            rule_names[port] = name
+    for port, name in rule_names.items():
+        registry.setdefault(port, name)
+
+    registry.update(COMMON_SERVICES)
+    registry.update({port: service for port, service in override_rows})
+    _registry = MappingProxyType(registry)
+    logger.info(f"Service registry loaded: {len(registry)} ports ({len(override_rows)} overrides)")
+    return len(registry)
+
+def get_service_name(port: int) -> str:
+    return _registry.get(port, "unknown")
@@ -0,0 +1,274 @@
+import asyncio
+import json
+import logging
+import socket
+import struct
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from app.core.config import get_settings
+from app.core.db import get_read_connection, write_async, json_batch
+from app.services.icmp import icmp_sweep, read_neighbor_table
+
+logger = logging.getLogger(__name__)
+
+# Presence monitor: follows the kernel neighbor (ARP) table and flips devices.status
+# between scans. Netlink neighbor events (Linux) trigger an immediate check; the table
+# is also polled every presence_poll_seconds (the only trigger on other platforms).
+RTMGRP_NEIGH = 0x4
+COALESCE_SECONDS = 0.5
+
+# Netlink neighbor dump (linux/rtnetlink.h, linux/neighbour.h)
+RTM_NEWNEIGH = 28
+RTM_GETNEIGH = 30
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NDA_DST = 1
+NDA_LLADDR = 2
+NUD_INCOMPLETE = 0x01
+NUD_REACHABLE = 0x02
+NUD_STALE = 0x04
+NUD_FAILED = 0x20
+NLMSG_HEADER = struct.Struct("=IHHII")
+NDMSG = struct.Struct("=BxxxiHBB")
+
+def _open_netlink() -> Optional[socket.socket]:
+    """Subscribes to RTM_NEWNEIGH/RTM_DELNEIGH; None where netlink is unavailable."""
+    try:
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+        sock.bind((0, RTMGRP_NEIGH))
+        sock.setblocking(False)
+        return sock
+    except (AttributeError, OSError) as e:
+        logger.info(f"Presence monitor: netlink unavailable ({e}), polling the neighbor table only")
+        return None
+
+def _dump_neighbors() -> Optional[Dict[str, Tuple[str, int]]]:
+    """Returns {ip: (mac, NUD state)} for resolved IPv4 neighbors via RTM_GETNEIGH; None without netlink."""
+    try:
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+    except (AttributeError, OSError):
+        return None
+    table: Dict[str, Tuple[str, int]] = {}
+    try:
+        sock.settimeout(2.0)
+        sock.send(NLMSG_HEADER.pack(NLMSG_HEADER.size + NDMSG.size, RTM_GETNEIGH, NLM_F_REQUEST | NLM_F_DUMP, 1, 0)
+                  + NDMSG.pack(socket.AF_INET, 0, 0, 0, 0))
+        while True:
+            data = sock.recv(65536)
+            offset = 0
+            while offset + NLMSG_HEADER.size <= len(data):
+                length, msg_type, _, _, _ = NLMSG_HEADER.unpack_from(data, offset)
+                if length < NLMSG_HEADER.size or msg_type == NLMSG_DONE:
+                    return table
+                if msg_type == NLMSG_ERROR:
+                    return None
+                if msg_type == RTM_NEWNEIGH:
+                    _, _, state, _, _ = NDMSG.unpack_from(data, offset + NLMSG_HEADER.size)
+                    ip = mac = None
+                    attr = offset + NLMSG_HEADER.size + NDMSG.size
+                    while attr + 4 <= offset + length:
+                        attr_len, attr_type = struct.unpack_from("=HH", data, attr)
+                        if attr_len < 4:
+                            break
+                        value = data[attr + 4:attr + attr_len]
+                        if attr_type == NDA_DST and len(value) == 4:
+                            ip = socket.inet_ntoa(value)
+                        elif attr_type == NDA_LLADDR and len(value) == 6:
+                            mac = ":".join(f"{b:02x}" for b in value)
+                        attr += (attr_len + 3) & ~3
+                    if ip and mac and mac != "00:00:00:00:00:00" and not state & (NUD_INCOMPLETE | NUD_FAILED):
+                        table[ip] = (mac, state)
+                offset += (length + 3) & ~3
+    except OSError as e:
+        logger.debug(f"Netlink neighbor dump failed: {e}")
+        return None
+    finally:
+        sock.close()
+
+def _read_neighbors() -> Dict[str, Tuple[str, int]]:
+    """
+    {ip: (mac, NUD state)}. Without netlink the state is unknown, so every entry is
+    reported as NUD_STALE: listed, but not proof that the host is still there.
+    """
+    table = _dump_neighbors()
+    if table is None:
+        table = {ip: (mac, NUD_STALE) for ip, mac in read_neighbor_table().items()}
+    return table
+
+def _load_devices() -> List[dict]:
+    conn = get_read_connection()
+    try:
+        rows = conn.execute(
+            "SELECT id, ip, mac, display_name, vendor, icon, device_type, ip_type, status FROM devices"
+        ).fetchall()
+    finally:
+        conn.close()
+    cols = ["id", "ip", "mac", "hostname", "vendor", "icon", "device_type", "ip_type", "status"]
+    return [dict(zip(cols, r)) for r in rows]
+
+def _by_mac(table: Dict[str, Tuple[str, int]]) -> Dict[str, int]:
+    states: Dict[str, int] = {}
+    for mac, state in table.values():
+        states[mac] = states.get(mac, 0) | state
+    return states
+
+def _state(device: dict, table: Dict[str, Tuple[str, int]], by_mac: Dict[str, int]) -> Optional[int]:
+    """NUD state(s) of the device's neighbor entry, matched by MAC (else IP); None if not listed."""
+    mac = (device["mac"] or "").lower()
+    if mac:
+        return by_mac.get(mac)
+    entry = table.get(device["ip"])
+    return entry[1] if entry else None
+
+def _reachable(device: dict, table: Dict[str, Tuple[str, int]], by_mac: Dict[str, int]) -> bool:
+    return bool((_state(device, table, by_mac) or 0) & NUD_REACHABLE)
+
+def _apply(conn, online: List[str], offline: List[str], touch: List[str], now: datetime):
+    for status, ids in (("online", online), ("offline", offline)):
+        if not ids:
+            continue
+        conn.execute(
+            f"UPDATE devices SET status = ? WHERE id IN (SELECT id FROM ({json_batch({'id': 'VARCHAR'})}))",
+            [status, json.dumps({"id": ids})]
+        )
+        conn.execute(
+            f"""
+            INSERT INTO device_status_history (id, device_id, status, changed_at)
+            SELECT uuid()::VARCHAR, id, ?, ? FROM ({json_batch({'id': 'VARCHAR'})})
+            """,
+            [status, now, json.dumps({"id": ids})]
+        )
+    seen = online + touch
+    if seen:
+        conn.execute(
+            f"UPDATE devices SET last_seen = ? WHERE id IN (SELECT id FROM ({json_batch({'id': 'VARCHAR'})}))",
+            [now, json.dumps({"id": seen})]
+        )
+
+async def check_presence(
+    absent_since: Dict[str, float], last_proof: Dict[str, float],
+    last_probe: Dict[str, float], touched: Dict[str, float],
+):
+    """
+    One reconciliation pass of devices.status against the neighbor table.
+    Only a REACHABLE entry or a reply to a unicast probe proves a device is there:
+    STALE entries linger (below gc_thresh1, indefinitely) for departed hosts too, so
+    listed-but-unconfirmed devices are probed first. Hysteresis: proof marks a device
+    online right away, but an online device is only marked offline once it has gone
+    presence_offline_after_seconds without proof. A device is probed at most once per
+    presence_poll_seconds.
+    """
+    settings = get_settings()
+    table = await asyncio.to_thread(_read_neighbors)
+    devices = await asyncio.to_thread(_load_devices)
+    by_mac = _by_mac(table)
+    mono = time.monotonic()
+
+    def recently(times: Dict[str, float], d: dict) -> bool:
+        return mono - times.get(d["id"], float("-inf")) < settings.presence_poll_seconds
+
+    def recently_proven(d: dict) -> bool:
+        return recently(last_proof, d)
+
+    # Probes cause neighbor events (FAILED/INCOMPLETE for a departed host), which trigger
+    # passes; rate-limit by the last probe too, or a missing host is probed in a loop
+    unproven = [
+        d for d in devices
+        if d["ip"] and not _reachable(d, table, by_mac) and not recently_proven(d) and not recently(last_probe, d)
+        and (d["status"] == "online" or _state(d, table, by_mac) is not None)
+    ]
+    answered: Dict[str, float] = {}
+    if unproven:
+        # The probe also makes the kernel re-confirm a STALE entry (DELAY -> PROBE), so a
+        # host that drops ICMP but answers ARP shows up REACHABLE on a following pass
+        from app.services.scan_budget import get_scan_budget
+        answered = await icmp_sweep([d["ip"] for d in unproven], timeout=1.0, budget=get_scan_budget()) or {}
+        for d in unproven:
+            last_probe[d["id"]] = mono
+        table = await asyncio.to_thread(_read_neighbors)
+        by_mac = _by_mac(table)
+
+    online, offline, touch = [], [], []
+    for d in devices:
+        if d["ip"] in answered or _reachable(d, table, by_mac):
+            last_proof[d["id"]] = mono
+        elif not recently_proven(d):
+            if d["status"] == "online":
+                since = absent_since.setdefault(d["id"], mono)
+                if mono - since >= settings.presence_offline_after_seconds:
+                    offline.append(d)
+            continue
+        absent_since.pop(d["id"], None)
+        if d["status"] != "online":
+            online.append(d)
+        elif mono - touched.get(d["id"], 0) >= settings.presence_touch_seconds:
+            # Proven present: keep last_seen fresh so the next scan does not mark it offline
+            touch.append(d)
+
+    if not (online or offline or touch):
+        return
+
+    now = datetime.now(timezone.utc)
+    await write_async(_apply, [d["id"] for d in online], [d["id"] for d in offline], [d["id"] for d in touch], now)
+    for d in online + touch:
+        touched[d["id"]] = mono
+    for d in offline:
+        absent_since.pop(d["id"], None)
+        touched.pop(d["id"], None)
+
+    if online or offline:
+        logger.info(f"Presence monitor: {len(online)} devices online, {len(offline)} offline")
+    from app.services.mqtt import publish_device_online, publish_device_offline
+    for d in online:
+        publish_device_online({**d, "status": "online", "last_seen": now})
+    for d in offline:
+        publish_device_offline({**d, "status": "offline", "timestamp": now.isoformat()})
+
+async def presence_monitor_loop():
+    """Runs check_presence on neighbor events (netlink) and every presence_poll_seconds."""
+    settings = get_settings()
+    if not settings.presence_monitor_enabled:
+        return
+
+    loop = asyncio.get_running_loop()
+    changed = asyncio.Event()
+    sock = _open_netlink()
+    if sock is not None:
+        def on_readable():
+            while True:
+                try:
+                    if not sock.recv(65536):
+                        break
+                except (BlockingIOError, InterruptedError):
+                    break
+                except OSError:
+                    # ENOBUFS: events were dropped; the check re-reads the whole table anyway
+                    break
+            changed.set()
+        loop.add_reader(sock.fileno(), on_readable)
+    logger.info("Presence monitor started.")
+
+    absent_since: Dict[str, float] = {}
+    last_proof: Dict[str, float] = {}
+    last_probe: Dict[str, float] = {}
+    touched: Dict[str, float] = {}
+    try:
+        while True:
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=settings.presence_poll_seconds)
+                # Neighbor events come in bursts; handle them in one pass
+                await asyncio.sleep(COALESCE_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            changed.clear()
+            try:
+                await check_presence(absent_since, last_proof, last_probe, touched)
+            except Exception as e:
+                logger.error(f"Error in presence_monitor_loop: {e}")
+    finally:
+        if sock is not None:
+            loop.remove_reader(sock.fileno())
+            sock.close()
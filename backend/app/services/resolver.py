@@ -0,0 +1,237 @@
+import asyncio
+import ipaddress
+import logging
+import random
+import socket
+import struct
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from app.core.config import get_settings
+from app.core.db import get_read_connection, write_async
+
+logger = logging.getLogger(__name__)
+
+# Hostname resolution for discovered hosts, all batched over one UDP socket per step:
+#   1. PTR queries to the configured (or /etc/resolv.conf) DNS server
+#   2. for hosts without a PTR record: a reverse mDNS query (unicast to host:5353)
+#      and a NetBIOS node status query (host:137), sent together
+# Results, including misses, are cached with a TTL in the hostname_cache table.
+
+# ip -> (hostname or None, expires at epoch seconds)
+_cache: Dict[str, Tuple[Optional[str], float]] = {}
+_cache_loaded = False
+_cache_lock = asyncio.Lock()
+
+NBSTAT_NAME = b"\x20" + b"".join(bytes((0x41 + (c >> 4), 0x41 + (c & 0x0F))) for c in b"*" + b"\0" * 15) + b"\x00"
+
+def _nameserver() -> Optional[str]:
+    configured = get_settings().reverse_dns_server
+    if configured:
+        return configured
+    try:
+        with open("/etc/resolv.conf") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0] == "nameserver":
+                    try:
+                        if ipaddress.ip_address(parts[1]).version == 4:
+                            return parts[1]
+                    except ValueError:
+                        continue
+    except OSError:
+        pass
+    return None
+
+def _ptr_query(txid: int, ip: str) -> bytes:
+    from scapy.all import DNS, DNSQR
+    return bytes(DNS(id=txid, rd=1, qd=DNSQR(qname=ipaddress.ip_address(ip).reverse_pointer, qtype="PTR")))
+
+def _parse_ptr(data: bytes) -> Optional[str]:
+    from scapy.all import DNS, DNSRR
+    dns = DNS(data)
+    for rr in dns.an or []:
+        if isinstance(rr, DNSRR) and rr.type == 12:
+            name = rr.rdata.decode(errors="ignore") if isinstance(rr.rdata, bytes) else str(rr.rdata)
+            name = name.rstrip(".")
+            if name:
+                return name[:-len(".local")] if name.endswith(".local") else name
+    return None
+
+def _nbstat_query(txid: int, ip: str) -> bytes:
+    return struct.pack("!HHHHHH", txid, 0, 1, 0, 0, 0) + NBSTAT_NAME + struct.pack("!HH", 0x21, 1)
+
+def _parse_nbstat(data: bytes) -> Optional[str]:
+    # header (12) + encoded name (34) + type, class, ttl, rdlength (10), then the name table
+    offset = 12 + len(NBSTAT_NAME) + 10
+    if len(data) <= offset:
+        return None
+    count = data[offset]
+    offset += 1
+    for i in range(count):
+        entry = data[offset + i * 18: offset + (i + 1) * 18]
+        if len(entry) < 18:
+            break
+        suffix, flags = entry[15], struct.unpack("!H", entry[16:18])[0]
+        # Workstation service name, unique (not a group name)
+        if suffix == 0x00 and not flags & 0x8000:
+            name = entry[:15].decode(errors="ignore").strip()
+            if name:
+                return name
+    return None
+
+async def _exchange(
+    requests: List[Tuple[str, Tuple[str, int], Callable[[int, str], bytes]]],
+    parse: Callable[[bytes], Optional[str]],
+    timeout: float,
+    budget=None,
+) -> Dict[str, Optional[str]]:
+    """
+    Sends every request (key, address, build(txid, key)) from one UDP socket and
+    collects parsed replies, matched on transaction id and source address, until all
+    are answered or timeout passes after the last send.
+    """
+    if not requests:
+        return {}
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    base = random.randrange(0x10000)
+    # (source ip, txid) -> key
+    pending: Dict[Tuple[str, int], str] = {}
+    results: Dict[str, Optional[str]] = {}
+
+    def on_readable():
+        while True:
+            try:
+                data, addr = sock.recvfrom(4096)
+            except (BlockingIOError, InterruptedError, OSError):
+                return
+            if len(data) < 12:
+                continue
+            key = pending.pop((addr[0], struct.unpack("!H", data[:2])[0]), None)
+            if key is None:
+                continue
+            try:
+                results[key] = parse(data)
+            except Exception as e:
+                logger.debug(f"Could not parse reply for {key}: {e}")
+                results[key] = None
+
+    loop.add_reader(sock.fileno(), on_readable)
+    try:
+        for i, (key, addr, build) in enumerate(requests):
+            txid = (base + i) & 0xFFFF
+            pending[(addr[0], txid)] = key
+            try:
+                if budget is not None:
+                    async with budget.slot(addr[0]):
+                        sock.sendto(build(txid, key), addr)
+                else:
+                    sock.sendto(build(txid, key), addr)
+            except OSError as e:
+                logger.debug(f"Resolver query to {addr[0]} failed: {e}")
+                pending.pop((addr[0], txid), None)
+        deadline = time.monotonic() + timeout
+        while pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+    finally:
+        loop.remove_reader(sock.fileno())
+        sock.close()
+    return results
+
+def _load_cache() -> Dict[str, Tuple[Optional[str], float]]:
+    conn = get_read_connection()
+    try:
+        rows = conn.execute(
+            "SELECT ip, hostname, expires_at FROM hostname_cache WHERE expires_at > ?",
+            [datetime.now(timezone.utc).replace(tzinfo=None)]
+        ).fetchall()
+    finally:
+        conn.close()
+    return {ip: (hostname, expires.replace(tzinfo=timezone.utc).timestamp()) for ip, hostname, expires in rows}
+
+def _save_cache(conn, entries: Dict[str, Tuple[Optional[str], str, float]]):
+    conn.executemany(
+        "INSERT OR REPLACE INTO hostname_cache (ip, hostname, source, expires_at) VALUES (?, ?, ?, ?)",
+        [
+            [ip, hostname, source, datetime.fromtimestamp(expires, timezone.utc).replace(tzinfo=None)]
+            for ip, (hostname, source, expires) in entries.items()
+        ]
+    )
+    # Expired rows are dead weight; drop them while we are writing anyway
+    conn.execute("DELETE FROM hostname_cache WHERE expires_at <= ?", [datetime.now(timezone.utc).replace(tzinfo=None)])
+
+async def _gethostbyaddr(ips: List[str]) -> Dict[str, Optional[str]]:
+    """Fallback when no DNS server address is known (e.g. Windows): the system resolver."""
+    def sync_resolve(ip):
+        try:
+            return socket.gethostbyaddr(ip)[0]
+        except Exception:
+            return None
+    names = await asyncio.gather(*(asyncio.to_thread(sync_resolve, ip) for ip in ips))
+    return dict(zip(ips, names))
+
+async def resolve_hostnames(ips: Iterable[str]) -> Dict[str, Optional[str]]:
+    """Returns {ip: hostname or None}, from the cache where it has an unexpired entry."""
+    global _cache, _cache_loaded
+    settings = get_settings()
+    async with _cache_lock:
+        if not _cache_loaded:
+            try:
+                _cache = await asyncio.to_thread(_load_cache)
+            except Exception as e:
+                logger.warning(f"Could not load hostname cache: {e}")
+            _cache_loaded = True
+
+    now = time.time()
+    names: Dict[str, Optional[str]] = {}
+    misses = []
+    for ip in dict.fromkeys(ips):
+        cached = _cache.get(ip)
+        if cached and cached[1] > now:
+            names[ip] = cached[0]
+        else:
+            misses.append(ip)
+    if not misses:
+        return names
+
+    timeout = settings.reverse_dns_timeout
+    sources: Dict[str, str] = {}
+    server = _nameserver()
+    if server:
+        found = await _exchange([(ip, (server, 53), lambda txid, ip: _ptr_query(txid, ip)) for ip in misses], _parse_ptr, timeout)
+    else:
+        found = await _gethostbyaddr(misses)
+    for ip, name in found.items():
+        if name:
+            sources[ip] = "ptr"
+
+    remaining = [ip for ip in misses if not found.get(ip)]
+    if remaining:
+        from app.services.scan_budget import get_scan_budget
+        budget = get_scan_budget()
+        mdns, netbios = await asyncio.gather(
+            _exchange([(ip, (ip, 5353), lambda txid, ip: _ptr_query(txid, ip)) for ip in remaining], _parse_ptr, timeout, budget),
+            _exchange([(ip, (ip, 137), _nbstat_query) for ip in remaining], _parse_nbstat, timeout, budget),
+        )
+        for ip in remaining:
+            if mdns.get(ip):
+                found[ip], sources[ip] = mdns[ip], "mdns"
+            elif netbios.get(ip):
+                found[ip], sources[ip] = netbios[ip], "netbios"
+
+    entries = {}
+    for ip in misses:
+        name = found.get(ip)
+        ttl = settings.hostname_cache_ttl_seconds if name else settings.hostname_cache_negative_ttl_seconds
+        names[ip] = name
+        _cache[ip] = (name, now + ttl)
+        entries[ip] = (name, sources.get(ip, "none"), now + ttl)
+    try:
+        await write_async(_save_cache, entries)
+    except Exception as e:
+        logger.warning(f"Could not persist hostname cache: {e}")
+
+    logger.info(f"Resolved {len(sources)}/{len(misses)} hostnames ({len(names) - len(misses)} cached)")
+    return names
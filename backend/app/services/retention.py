@@ -0,0 +1,98 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+from app.core.config import get_settings
+from app.core.db import get_read_connection, run_write
+
+logger = logging.getLogger(__name__)
+
+# Tiers: raw device_traffic_history -> 5 minute rollups -> dropped. Hourly rollups
+# (device_traffic_1h, kept forever) are folded in on ingest (app.services.rollups), so
+# they already hold every hour. All tiers are read back through the device_traffic_all view.
+# Work is split into day-sized chunks so a backfill of an old database never
+# holds the writer for long.
+CHUNK = timedelta(days=1)
+
+TIERS = [
+    # (source table, source time column, destination table or None to drop, bucket, bucket width)
+    ("device_traffic_history", "timestamp", "device_traffic_5m", "5 minutes", timedelta(minutes=5)),
+    # Dropped at whole hours: device_traffic_all relies on it to tell which hours
+    # only device_traffic_1h still covers
+    ("device_traffic_5m", "bucket", None, None, timedelta(hours=1)),
+]
+
+def _floor(ts: datetime, width: timedelta) -> datetime:
+    seconds = int(width.total_seconds())
+    epoch = datetime(2000, 1, 1)
+    return epoch + timedelta(seconds=(int((ts - epoch).total_seconds()) // seconds) * seconds)
+
+def _rollup_chunk(conn, src: str, ts_col: str, dst: Optional[str], bucket: Optional[str], start: datetime, end: datetime) -> int:
+    """Folds rows of src in [start, end) into dst buckets (if any) and deletes them from src."""
+    if dst is not None:
+        _fold(conn, src, ts_col, dst, bucket, start, end)
+    deleted = conn.execute(f"DELETE FROM {src} WHERE {ts_col} >= ? AND {ts_col} < ?", [start, end]).fetchone()
+    return deleted[0] if deleted else 0
+
+def _fold(conn, src: str, ts_col: str, dst: str, bucket: str, start: datetime, end: datetime) -> None:
+    samples = "COUNT(*)" if src == "device_traffic_history" else "SUM(samples)"
+    conn.execute(f"""
+        INSERT INTO {dst} (device_id, bucket, rx_bytes, tx_bytes, down_rate, up_rate, samples)
+        SELECT
+            device_id,
+            time_bucket(INTERVAL '{bucket}', {ts_col}) AS b,
+            arg_max(rx_bytes, {ts_col}),
+            arg_max(tx_bytes, {ts_col}),
+            SUM(down_rate),
+            SUM(up_rate),
+            {samples}
+        FROM {src}
+        WHERE {ts_col} >= ? AND {ts_col} < ?
+        GROUP BY device_id, b
+        ON CONFLICT (device_id, bucket) DO UPDATE SET
+            rx_bytes = EXCLUDED.rx_bytes,
+            tx_bytes = EXCLUDED.tx_bytes,
+            down_rate = {dst}.down_rate + EXCLUDED.down_rate,
+            up_rate = {dst}.up_rate + EXCLUDED.up_rate,
+            samples = {dst}.samples + EXCLUDED.samples
+    """, [start, end])
+
+def _oldest(src: str, ts_col: str, cutoff: datetime) -> Optional[datetime]:
+    conn = get_read_connection()
+    try:
+        row = conn.execute(f"SELECT MIN({ts_col}) FROM {src} WHERE {ts_col} < ?", [cutoff]).fetchone()
+        return row[0] if row else None
+    finally:
+        conn.close()
+
+def compact_traffic_history(now: Optional[datetime] = None) -> dict:
+    """
+    Applies the retention policy from Settings:
+    raw rows older than traffic_raw_retention_hours become 5 minute buckets,
+    5 minute buckets older than traffic_5m_retention_days are dropped (device_traffic_1h
+    already holds their hours).
+    Safe to run repeatedly; the first run backfills an existing database.
+    """
+    settings = get_settings()
+    # Traffic timestamps are stored as naive local time (CURRENT_TIMESTAMP)
+    now = now or datetime.now()
+    keep = [
+        timedelta(hours=settings.traffic_raw_retention_hours),
+        timedelta(days=settings.traffic_5m_retention_days),
+    ]
+
+    stats = {}
+    for (src, ts_col, dst, bucket, width), retention in zip(TIERS, keep):
+        # Only fold whole buckets so a bucket is never split across two runs
+        cutoff = _floor(now - retention, width)
+        oldest = _oldest(src, ts_col, cutoff)
+        moved = 0
+        if oldest is not None:
+            start = _floor(oldest, width)
+            while start < cutoff:
+                end = min(start + CHUNK, cutoff)
+                moved += run_write(_rollup_chunk, src, ts_col, dst, bucket, start, end)
+                start = end
+        stats[src] = moved
+        if moved:
+            logger.info(f"Traffic retention: {'folded' if dst else 'dropped'} {moved} rows from {src}{f' into {dst}' if dst else ''}")
+    return stats
@@ -0,0 +1,138 @@
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+# Hourly rollups behind the analytics endpoints.
+#   device_traffic_1h (main DB): (device_id, bucket) -> bytes down/up; also the last
+#     retention tier (app.services.retention), so it covers every hour
+#   dns_hourly (DNS DB): (hour, device_id, client_ip, domain_id) -> queries/blocked
+#   dns_query_types_hourly (DNS DB): (hour, query_type) -> queries
+# Rollups are folded in by the ingest path (OpenWRT / AdGuard sync) in the same
+# write as the raw rows. Range queries read whole hours from the rollups and
+# only touch raw rows for the partial hours at either end of the window.
+
+HOUR = timedelta(hours=1)
+
+def fold_traffic_rows(conn, ids: List[str]) -> None:
+    """Adds the given device_traffic_history rows to device_traffic_1h."""
+    if not ids:
+        return
+    conn.execute("""
+        INSERT INTO device_traffic_1h (device_id, bucket, rx_bytes, tx_bytes, down_rate, up_rate, samples, last_seen)
+        SELECT device_id, date_trunc('hour', timestamp), arg_max(rx_bytes, timestamp), arg_max(tx_bytes, timestamp),
+               SUM(down_rate), SUM(up_rate), COUNT(*), MAX(timestamp)
+        FROM device_traffic_history
+        WHERE id IN (SELECT unnest(?))
+        GROUP BY ALL
+        ON CONFLICT (device_id, bucket) DO UPDATE SET
+            rx_bytes = CASE WHEN EXCLUDED.last_seen >= device_traffic_1h.last_seen THEN EXCLUDED.rx_bytes ELSE device_traffic_1h.rx_bytes END,
+            tx_bytes = CASE WHEN EXCLUDED.last_seen >= device_traffic_1h.last_seen THEN EXCLUDED.tx_bytes ELSE device_traffic_1h.tx_bytes END,
+            down_rate = device_traffic_1h.down_rate + EXCLUDED.down_rate,
+            up_rate = device_traffic_1h.up_rate + EXCLUDED.up_rate,
+            samples = device_traffic_1h.samples + EXCLUDED.samples,
+            last_seen = greatest(device_traffic_1h.last_seen, EXCLUDED.last_seen)
+    """, [ids])
+
+def fold_dns_logs(conn, after: Optional[datetime] = None, until: Optional[datetime] = None) -> None:
+    """Adds dns_logs rows with after < timestamp <= until (open ends when None) to the DNS rollups."""
+    where, params = [], []
+    if after is not None:
+        where.append("timestamp > ?")
+        params.append(after)
+    if until is not None:
+        where.append("timestamp <= ?")
+        params.append(until)
+    where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+
+    conn.execute(f"""
+        INSERT INTO dns_hourly (hour, device_id, client_ip, domain_id, queries, blocked, response_ms)
+        SELECT
+            date_trunc('hour', timestamp),
+            COALESCE(device_id, ''),
+            COALESCE(client_ip, ''),
+            domain_id,
+            COUNT(*),
+            COUNT(CASE WHEN is_blocked = TRUE THEN 1 END),
+            COALESCE(SUM(response_time), 0)
+        FROM dns_logs
+        {where_sql}
+        GROUP BY ALL
+        ON CONFLICT (hour, device_id, client_ip, domain_id) DO UPDATE SET
+            queries = dns_hourly.queries + EXCLUDED.queries,
+            blocked = dns_hourly.blocked + EXCLUDED.blocked,
+            response_ms = dns_hourly.response_ms + EXCLUDED.response_ms
+    """, params)
+    conn.execute(f"""
+        INSERT INTO dns_query_types_hourly (hour, query_type, queries)
+        SELECT date_trunc('hour', timestamp), query_type, COUNT(*)
+        FROM dns_logs
+        {where_sql} {'AND' if where_sql else 'WHERE'} query_type IS NOT NULL
+        GROUP BY ALL
+        ON CONFLICT (hour, query_type) DO UPDATE SET
+            queries = dns_query_types_hourly.queries + EXCLUDED.queries
+    """, params)
+
+def _split(start: datetime, end: datetime) -> Optional[Tuple[datetime, datetime]]:
+    """Returns the whole hours [first, last) inside [start, end], or None if there are none."""
+    first = start.replace(minute=0, second=0, microsecond=0)
+    if first < start:
+        first += HOUR
+    last = end.replace(minute=0, second=0, microsecond=0)
+    if first >= last:
+        return None
+    return first, last
+
+def traffic_source(start: datetime, end: datetime) -> Tuple[str, list]:
+    """
+    SQL subquery with columns (device_id, timestamp, down_rate, up_rate, last_seen)
+    covering [start, end], for use as `FROM (...) h`.
+    """
+    raw = "SELECT device_id, timestamp, down_rate, up_rate, timestamp AS last_seen FROM device_traffic_all"
+    hours = _split(start, end)
+    if hours is None:
+        return f"{raw} WHERE timestamp >= ? AND timestamp <= ?", [start, end]
+    first, last = hours
+    sql = f"""
+        SELECT device_id, bucket AS timestamp, down_rate, up_rate, last_seen
+        FROM device_traffic_1h WHERE bucket >= ? AND bucket < ?
+        UNION ALL
+        {raw} WHERE (timestamp >= ? AND timestamp < ?) OR (timestamp >= ? AND timestamp <= ?)
+    """
+    return sql, [first, last, start, first, last, end]
+
+def dns_source(start: datetime, end: datetime) -> Tuple[str, list]:
+    """
+    SQL subquery with columns (timestamp, device_id, client_ip, domain_id, queries, blocked, response_ms)
+    covering [start, end], for use as `FROM (...) l`.
+    """
+    raw = """
+        SELECT timestamp, device_id, client_ip, domain_id, 1 AS queries,
+               CASE WHEN is_blocked = TRUE THEN 1 ELSE 0 END AS blocked,
+               COALESCE(response_time, 0) AS response_ms
+        FROM dns_logs
+    """
+    hours = _split(start, end)
+    if hours is None:
+        return f"{raw} WHERE timestamp >= ? AND timestamp <= ?", [start, end]
+    first, last = hours
+    sql = f"""
+        SELECT hour AS timestamp, NULLIF(device_id, '') AS device_id, NULLIF(client_ip, '') AS client_ip,
+               domain_id, queries, blocked, response_ms
+        FROM dns_hourly WHERE hour >= ? AND hour < ?
+        UNION ALL
+        {raw} WHERE (timestamp >= ? AND timestamp < ?) OR (timestamp >= ? AND timestamp <= ?)
+    """
+    return sql, [first, last, start, first, last, end]
+
+def dns_query_type_source(start: datetime, end: datetime) -> Tuple[str, list]:
+    """SQL subquery with columns (query_type, queries) covering [start, end]."""
+    raw = "SELECT query_type, 1 AS queries FROM dns_logs"
+    hours = _split(start, end)
+    if hours is None:
+        return f"{raw} WHERE timestamp >= ? AND timestamp <= ?", [start, end]
+    first, last = hours
+    sql = f"""
+        SELECT query_type, queries FROM dns_query_types_hourly WHERE hour >= ? AND hour < ?
+        UNION ALL
+        {raw} WHERE (timestamp >= ? AND timestamp < ?) OR (timestamp >= ? AND timestamp <= ?)
+    """
+    return sql, [first, last, start, first, last, end]
@@ -0,0 +1,79 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+from app.core.config import get_settings
+
+class _RateLimiter:
+    """Token bucket: allows `rate` acquisitions per second with a burst of one second."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class ScanBudget:
+    """
+    Process-wide limits for network probes (ping sweeps, port connects), shared by
+    every running scan job and deep scan:
+      - max sockets/probes in flight at once
+      - max new probes per second
+      - max probes in flight against a single host
+    """
+
+    def __init__(self, max_inflight: int, max_pps: float, per_host: int):
+        self.max_inflight = max_inflight
+        self.per_host = per_host
+        self._inflight = asyncio.Semaphore(max_inflight)
+        self._rate = _RateLimiter(max_pps)
+        # host -> [semaphore, number of waiters/holders]; dropped when unused
+        self._hosts: Dict[str, List] = {}
+
+    async def spend(self):
+        """Takes one probe from the rate limit without holding a slot (e.g. an ARP broadcast)."""
+        await self._rate.acquire()
+
+    @asynccontextmanager
+    async def slot(self, host: str):
+        """Holds one probe slot against host for the duration of the block."""
+        entry = self._hosts.get(host)
+        if entry is None:
+            entry = self._hosts[host] = [asyncio.Semaphore(self.per_host), 0]
+        entry[1] += 1
+        try:
+            # Per-host first, so a busy host does not tie up global slots while waiting
+            async with entry[0]:
+                async with self._inflight:
+                    await self._rate.acquire()
+                    yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._hosts.pop(host, None)
+
+_budget: Optional[ScanBudget] = None
+
+def get_scan_budget() -> ScanBudget:
+    global _budget
+    if _budget is None:
+        settings = get_settings()
+        _budget = ScanBudget(
+            max(1, settings.scan_max_inflight),
+            settings.scan_max_pps,
+            max(1, settings.scan_per_host_inflight),
+        )
+    return _budget
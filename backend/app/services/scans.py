@@ -6,10 +6,17 @@ import sys
 import subprocess
 import re
 import ipaddress
-from datetime import datetime, timezone
-from typing import List, Dict, Any, Optional
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional
 from scapy.all import ARP, Ether, srp, conf
-from app.core.db import get_connection
+from app.core.config import get_settings
+from app.core.db import get_read_connection, json_batch, submit_write_nowait, write_async
+from app.services.icmp import icmp_sweep, read_neighbor_table
+from app.services.port_services import get_service_name
+from app.services.resolver import resolve_hostnames
+from app.services.scan_budget import get_scan_budget
 
 if sys.platform == "win32":
     try:
@@ -19,17 +26,80 @@ if sys.platform == "win32":
 
 logger = logging.getLogger(__name__)
 
-async def resolve_hostname(ip: str) -> Optional[str]:
+# Hosts port-scanned for enrichment at once, shared by all concurrently running scan jobs
+_host_slots = asyncio.Semaphore(4)
+
+# Scan profiles: which ports to probe, the connect timeout ceiling/floor (seconds) and
+# how often a port that timed out (filtered/no answer) is retried. Within those bounds the
+# timeout follows the host's measured round-trip time.
+SCAN_PROFILES: Dict[str, Dict[str, Any]] = {
+    "quick": {"ports": "lookup", "timeout": 0.5, "min_timeout": 0.15, "retries": 0},
+    "standard": {"ports": "lookup", "timeout": 1.0, "min_timeout": 0.25, "retries": 1},
+    "full": {"ports": "full", "timeout": 1.5, "min_timeout": 0.3, "retries": 1},
+}
+DEFAULT_SCAN_PROFILE = "standard"
+RTT_TIMEOUT_FACTOR = 10
+
+# Deep scans: scan id -> {"phase", "done", "total", "open"}, updated per probed port
+_live_progress: Dict[str, Dict[str, Any]] = {}
+PROGRESS_FLUSH_SECONDS = 1.0
+
+# Smoothed round-trip time per IP (seconds), fed by ARP replies, pings and TCP connects
+_rtt: Dict[str, float] = {}
+_RTT_MAX_HOSTS = 4096
+
+def get_scan_profile(name: Optional[str]) -> Dict[str, Any]:
+    return SCAN_PROFILES.get(name or DEFAULT_SCAN_PROFILE, SCAN_PROFILES[DEFAULT_SCAN_PROFILE])
+
+def record_rtt(ip: str, seconds: float):
+    """Adds an RTT sample for ip (exponentially weighted, like TCP's SRTT)."""
+    if seconds is None or seconds <= 0:
+        return
+    prev = _rtt.get(ip)
+    if prev is None and len(_rtt) >= _RTT_MAX_HOSTS:
+        _rtt.clear()
+    _rtt[ip] = seconds if prev is None else prev * 0.875 + seconds * 0.125
+
+def port_timeout(ip: str, profile: Dict[str, Any]) -> float:
+    """Connect timeout for ip: a multiple of its RTT, clamped to the profile's bounds."""
+    srtt = _rtt.get(ip)
+    if srtt is None:
+        return profile["timeout"]
+    return min(profile["timeout"], max(profile["min_timeout"], srtt * RTT_TIMEOUT_FACTOR))
+
+def _chunks(networks: list, prefix: int):
+    """Yields the networks split into subnets no larger than /prefix (lazily)."""
+    for net in networks:
+        if net.prefixlen >= prefix:
+            yield net
+        else:
+            yield from net.subnets(new_prefix=prefix)
+
+def _chunk_count(net, prefix: int) -> int:
+    return 1 if net.prefixlen >= prefix else 2 ** (prefix - net.prefixlen)
+
+def _target_networks(target: str) -> list:
+    networks = []
+    for part in target.split():
+        try:
+            networks.append(ipaddress.ip_network(part, strict=False))
+        except ValueError:
+            continue
+    return networks
+
+def _known_hostnames(macs: List[str]) -> Dict[str, str]:
+    """{mac: name} for devices that already have a hostname, so they skip resolution."""
+    if not macs:
+        return {}
+    conn = get_read_connection()
     try:
-        import socket
-        def sync_resolve():
-            try:
-                return socket.gethostbyaddr(ip)[0]
-            except:
-                return None
-        return await asyncio.to_thread(sync_resolve)
-    except:
-        return None
+        rows = conn.execute(
+            f"SELECT mac, name FROM devices WHERE name IS NOT NULL AND name != '' AND mac IN (SELECT mac FROM ({json_batch({'mac': 'VARCHAR'})}))",
+            [json.dumps({"mac": macs})]
+        ).fetchall()
+    finally:
+        conn.close()
+    return {mac: name for mac, name in rows}
 
 def get_lookup_ports() -> List[int]:
     """Fetches all unique ports defined in classification rules for lookup."""
@@ -44,196 +114,361 @@ def get_lookup_ports() -> List[int]:
     ports.update(basics)
     return sorted(list(ports))
 
-async def scan_ports(ip: str, ports: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+def get_profile_ports(profile: Optional[str] = None) -> List[int]:
+    """Ports a scan with this profile probes: the rule lookup ports, plus 1-1024 for 'full'."""
     # Dynamic port lookup - only scan ports defined in rules for classification
+    ports = get_lookup_ports()
+    if get_scan_profile(profile)["ports"] == "full":
+        ports = sorted(set(ports) | set(range(1, 1025)))
+    return ports
+
+def _port_cache(devices: List[Dict[str, Any]], profile: Optional[str]) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Returns {ip: known open ports} for discovered hosts whose port list can be reused:
+    verified within port_cache_ttl_hours at the same IP (and MAC), minus a random
+    port_cache_sample_rate share that is re-probed anyway. 'full' scans never use it.
+    """
+    settings = get_settings()
+    if settings.port_cache_ttl_hours <= 0 or get_scan_profile(profile)["ports"] == "full" or not devices:
+        return {}
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=settings.port_cache_ttl_hours)
+    macs = [d["mac"] for d in devices if d.get("mac") and d["mac"] != "unknown"]
+    ips = [d["ip"] for d in devices]
+    values = json_batch({"value": "VARCHAR"})
+    conn = get_read_connection()
+    try:
+        rows = conn.execute(
+            f"""
+            SELECT id, mac, ports_verified_ip FROM devices
+            WHERE ports_verified_at >= ?
+              AND (mac IN (SELECT value FROM ({values})) OR ip IN (SELECT value FROM ({values})))
+            """,
+            [cutoff, json.dumps({"value": macs}), json.dumps({"value": ips})]
+        ).fetchall()
+        by_mac = {mac: (d_id, v_ip) for d_id, mac, v_ip in rows if mac}
+        by_ip = {v_ip: (d_id, mac) for d_id, mac, v_ip in rows}
+
+        fresh = {} # ip -> device id
+        for d in devices:
+            ip, mac = d["ip"], d.get("mac")
+            if mac and mac != "unknown":
+                hit = by_mac.get(mac)
+                if not hit or hit[1] != ip:
+                    continue
+            else:
+                hit = by_ip.get(ip)
+                if not hit:
+                    continue
+            if random.random() >= settings.port_cache_sample_rate:
+                fresh[ip] = hit[0]
+        if not fresh:
+            return {}
+
+        port_rows = conn.execute(
+            f"SELECT device_id, port, protocol, service FROM device_ports WHERE device_id IN (SELECT value FROM ({values})) ORDER BY port",
+            [json.dumps({"value": list(set(fresh.values()))})]
+        ).fetchall()
+    finally:
+        conn.close()
+    ports_by_device: Dict[str, List[Dict[str, Any]]] = {}
+    for device_id, port, proto, service in port_rows:
+        ports_by_device.setdefault(device_id, []).append({"port": port, "protocol": proto, "service": service})
+    return {ip: ports_by_device.get(device_id, []) for ip, device_id in fresh.items()}
+
+async def scan_ports(
+    ip: str, ports: Optional[List[int]] = None, profile: Optional[str] = None,
+    on_result: Optional[Callable[[int, Optional[Dict[str, Any]]], None]] = None,
+) -> List[Dict[str, Any]]:
+    """Probes the ports on ip; on_result(port, open port or None) is called as each one finishes."""
+    prof = get_scan_profile(profile)
     if ports is None:
-        ports = await asyncio.to_thread(get_lookup_ports)
-        
-    # Use native asyncio for better performance
-    semaphore = asyncio.Semaphore(50) # Allow more concurrency
+        ports = await asyncio.to_thread(get_profile_ports, profile)
 
-    async def check_port(p):
-        async with semaphore:
-            try:
-                # 1 second timeout
-                fut = asyncio.open_connection(ip, p)
-                reader, writer = await asyncio.wait_for(fut, timeout=1.0)
+    # Use native asyncio for better performance; concurrency is bounded by the shared scan budget
+    budget = get_scan_budget()
+
+    async def connect(p):
+        for attempt in range(prof["retries"] + 1):
+            async with budget.slot(ip):
+                started = time.monotonic()
+                try:
+                    fut = asyncio.open_connection(ip, p)
+                    reader, writer = await asyncio.wait_for(fut, timeout=port_timeout(ip, prof))
+                except asyncio.TimeoutError:
+                    # Filtered or slow to answer: retry with a (possibly updated) timeout
+                    if attempt < prof["retries"]:
+                        continue
+                    raise
+                except ConnectionRefusedError:
+                    # The RST still measures the round trip
+                    record_rtt(ip, time.monotonic() - started)
+                    raise
+                record_rtt(ip, time.monotonic() - started)
                 writer.close()
                 await writer.wait_closed()
-                
-                # Resolve service name 
-                COMMON_SERVICES = {
-                    6053: "ESPHome API",
-                    8123: "Home Assistant",
-                    1883: "MQTT",
-                    8883: "MQTT (SSL)",
-                    5432: "PostgreSQL",
-                    3306: "MySQL",
-                    6379: "Redis",
-                    8006: "Proxmox VE",
-                    5000: "Synology DSM",
-                    5001: "Synology DSM (SSL)",
-                    32400: "Plex Media Server",
-                    8096: "Jellyfin",
-                    1400: "Sonos",
-                    8291: "Winbox (MikroTik)",
-                    10001: "Ubiquiti Discovery",
-                    8080: "HTTP Proxy/Admin",
-                    8443: "HTTPS Proxy/Admin",
-                    554: "RTSP (Camera)",
-                    8000: "HTTP Alt/Camera",
-                    3000: "AdGuard/Grafana",
-                    9000: "Portainer",
-                    9443: "Portainer (SSL)",
-                    53: "DNS",
-                    22: "SSH",
-                    23: "Telnet",
-                    21: "FTP",
-                    445: "SMB/CIFS",
-                    139: "NetBIOS",
-                }
-
-                def get_service():
-                    if p in COMMON_SERVICES:
-                        return COMMON_SERVICES[p]
-                    import socket
-                    try: return socket.getservbyport(p)
-                    except: return "unknown"
-                
-                service = await asyncio.to_thread(get_service)
-                return {"port": p, "protocol": "tcp", "service": service}
-            except (asyncio.TimeoutError, ConnectionRefusedError, OSError):
-                return None
-            except Exception:
-                return None
+                return
+
+    async def probe(p):
+        try:
+            await connect(p)
+            return {"port": p, "protocol": "tcp", "service": get_service_name(p)}
+        except (asyncio.TimeoutError, ConnectionRefusedError, OSError):
+            return None
+        except Exception:
+            return None
+
+    async def check_port(p):
+        result = await probe(p)
+        if on_result:
+            on_result(p, result)
+        return result
 
     results = await asyncio.gather(*(check_port(p) for p in ports))
     return [r for r in results if r]
 
-async def scan_device(device_id: str, ip: str) -> List[Dict[str, Any]]:
-    """Deep scan for a specific device."""
-    top_ports = list(range(1, 1025))
-    found = await scan_ports(ip, top_ports)
-    
-    def update_db():
-        conn = get_connection()
-        try:
-            conn.execute("UPDATE devices SET open_ports = ?, last_seen = ? WHERE id = ?", [json.dumps(found), datetime.now(timezone.utc), device_id])
-            conn.execute("DELETE FROM device_ports WHERE device_id = ?", [device_id])
-            for p in found:
+def get_live_progress(scan_id: str) -> Optional[Dict[str, Any]]:
+    """Per-port progress of a deep scan running in this process (None otherwise)."""
+    return _live_progress.get(scan_id)
+
+async def run_deep_scan_job(scan_id: str, device_id: str, ip: str, profile: Optional[str] = "full"):
+    """
+    Deep port scan of one device as a scans job (scan_type 'deep'). Open ports are
+    written to device_ports as they are found; progress goes to _live_progress per
+    port and to scans.progress every PROGRESS_FLUSH_SECONDS. Cancelling the scan
+    (status no longer 'running') stops the probing at the next flush.
+    """
+    try:
+        logger.info(f"Starting deep scan {scan_id} of {ip}")
+        if not device_id:
+            raise ValueError("Deep scan needs options.device_id")
+        ports = await asyncio.to_thread(get_profile_ports, profile)
+        progress = {"phase": "ports", "done": 0, "total": len(ports), "open": []}
+        _live_progress[scan_id] = progress
+        found: List[Dict[str, Any]] = []
+
+        def save_port(conn, port_info: Dict[str, Any]):
+            conn.execute(
+                "INSERT OR REPLACE INTO device_ports (device_id, port, protocol, service, last_seen) VALUES (?, ?, ?, ?, ?)",
+                [device_id, port_info["port"], port_info["protocol"], port_info["service"], datetime.now(timezone.utc)]
+            )
+
+        def on_result(port: int, port_info: Optional[Dict[str, Any]]):
+            progress["done"] += 1
+            if port_info:
+                found.append(port_info)
+                progress["open"].append(port)
+                # Queued without waiting; the writer commits it with the next batch
+                submit_write_nowait(save_port, port_info)
+
+        def flush(conn, snapshot: str) -> bool:
+            row = conn.execute(
+                "UPDATE scans SET progress = ? WHERE id = ? AND status = 'running' RETURNING id",
+                [snapshot, scan_id]
+            ).fetchone()
+            return row is not None
+
+        probing = asyncio.create_task(scan_ports(ip, ports=ports, profile=profile, on_result=on_result))
+        cancelled = False
+        while not probing.done():
+            await asyncio.wait({probing}, timeout=PROGRESS_FLUSH_SECONDS)
+            if not probing.done() and not await write_async(flush, json.dumps(progress)):
+                logger.info(f"Deep scan {scan_id} was cancelled")
+                probing.cancel()
+                cancelled = True
+        if not cancelled:
+            probing.result()
+
+        found.sort(key=lambda p: p["port"])
+
+        def finish(conn):
+            now = datetime.now(timezone.utc)
+            # Also catches a cancel that landed after the last flush
+            if not flush(conn, json.dumps(progress)) or cancelled:
+                return False
+            # save_port writes may still sit behind this op in the queue; upsert them here too
+            if found:
                 conn.execute(
-                    "INSERT INTO device_ports (device_id, port, protocol, service, last_seen) VALUES (?, ?, ?, ?, ?)",
-                    [device_id, p["port"], p["protocol"], p["service"], datetime.now(timezone.utc)]
+                    f"""
+                    INSERT OR REPLACE INTO device_ports (device_id, port, protocol, service, last_seen)
+                    SELECT ?, port, protocol, service, ? FROM ({json_batch({'port': 'INTEGER', 'protocol': 'VARCHAR', 'service': 'VARCHAR'})})
+                    """,
+                    [device_id, now, json.dumps({
+                        "port": [p["port"] for p in found],
+                        "protocol": [p["protocol"] for p in found],
+                        "service": [p["service"] for p in found],
+                    })]
                 )
-            conn.commit()
-        finally:
-            conn.close()
-    
-    await asyncio.to_thread(update_db)
-    return found
-
-async def run_scan_job(scan_id: str, target: str, scan_type: str = "arp", options: Optional[Dict[str, Any]] = None):
+            # Only the TCP ports this scan probed are known to be closed; ports found by
+            # other means (UDP, earlier scans outside the profile) are kept
+            conn.execute(
+                f"""
+                DELETE FROM device_ports WHERE device_id = ? AND protocol = 'tcp'
+                  AND port IN (SELECT value FROM ({json_batch({'value': 'INTEGER'})}))
+                  AND port NOT IN (SELECT value FROM ({json_batch({'value': 'INTEGER'})}))
+                """,
+                [device_id, json.dumps({"value": list(ports)}), json.dumps({"value": [p["port"] for p in found]})]
+            )
+            merged = [
+                {"port": port, "protocol": protocol, "service": service}
+                for port, protocol, service in conn.execute(
+                    "SELECT port, protocol, service FROM device_ports WHERE device_id = ? ORDER BY port, protocol", [device_id]
+                ).fetchall()
+            ]
+            device = conn.execute(
+                "UPDATE devices SET open_ports = ?, last_seen = ?, ports_verified_at = ?, ports_verified_ip = ? WHERE id = ? RETURNING mac, name",
+                [json.dumps(merged), now, now, ip, device_id]
+            ).fetchone()
+            conn.execute(
+                "INSERT INTO scan_results (id, scan_id, ip, mac, hostname, open_ports, first_seen, last_seen) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [str(uuid.uuid4()), scan_id, ip, device[0] if device else None, device[1] if device else None, json.dumps(found), now, now]
+            )
+            conn.execute("UPDATE scans SET status = 'done', finished_at = ? WHERE id = ?", [now, scan_id])
+            return True
+
+        if await write_async(finish):
+            logger.info(f"Deep scan {scan_id} of {ip} finished: {len(found)}/{len(ports)} ports open")
+    except Exception as e:
+        logger.error(f"Deep scan {scan_id} failed: {e}")
+        def fail_scan(conn):
+            conn.execute("UPDATE scans SET status = 'error', finished_at = ?, error_message = ? WHERE id = ?", [datetime.now(timezone.utc), str(e), scan_id])
+        await write_async(fail_scan)
+        raise e
+    finally:
+        _live_progress.pop(scan_id, None)
+
+async def run_scan_job(scan_id: str, target: str, scan_type: str = "arp", options: Optional[Dict[str, Any]] = None, profile: Optional[str] = None):
     try:
         job_start = datetime.now(timezone.utc)
         logger.info(f"Starting scan job {scan_id} for target {target}")
         
         # 1. Ensure scan status is running with a start time
-        def start_scan():
-            conn = get_connection()
-            try:
-                conn.execute("UPDATE scans SET status = 'running', started_at = ?, error_message = NULL WHERE id = ?", [job_start, scan_id])
-                conn.commit()
-            finally:
-                conn.close()
-        await asyncio.to_thread(start_scan)
+        def start_scan(conn):
+            conn.execute("UPDATE scans SET status = 'running', started_at = ?, error_message = NULL WHERE id = ?", [job_start, scan_id])
+        await write_async(start_scan)
 
         # 2. Perform Network Discovery
-        def network_discovery():
-            try:
-                logger.info(f"Triggering Scapy ARP discovery for {target}...")
-                ans, unans = srp(Ether(dst="ff:ff:ff:ff:ff:ff")/ARP(pdst=target), timeout=2, retry=1, verbose=False)
-                results = [{"ip": rcve.psrc, "mac": rcve.hwsrc} for sent, rcve in ans]
-                logger.info(f"Scapy discovery found {len(results)} raw responses.")
-                return results
-            except Exception as e:
-                err_str = str(e).lower()
-                if "winpcap" in err_str or "pcap" in err_str:
-                    logger.warning("Scapy Layer 2 discovery restricted: Npcap/WinPcap not found. Switching to Layer 3 Ping Fallback.")
-                else:
-                    logger.error(f"Scapy scan failed: {e}")
-                return []
+        # Targets are walked chunk by chunk (default /24) from generators, so a /16 never
+        # materializes its 65k addresses; progress is written to scans.progress per chunk.
+        settings = get_settings()
+        networks = [n for n in _target_networks(target) if n.version == 4]
+        chunk_prefix = settings.discovery_chunk_prefix
+        total_chunks = sum(_chunk_count(n, chunk_prefix) for n in networks)
+
+        def set_progress(conn, phase: str, done: int):
+            conn.execute(
+                "UPDATE scans SET progress = ? WHERE id = ?",
+                [json.dumps({"phase": phase, "done": done, "total": total_chunks}), scan_id]
+            )
+
+        def arp_chunk(chunk, loop) -> List[Dict[str, str]]:
+            budget = get_scan_budget()
 
-        async def ping_discovery_fallback(target_str: str) -> List[Dict[str, str]]:
-            """Parallel ping sweep for targets when ARP fails/is restricted."""
+            def requests(ips):
+                # Consumed by scapy's sender thread: every broadcast takes a token from the
+                # shared scan budget, so concurrent jobs together stay within scan_max_pps
+                for ip in ips:
+                    asyncio.run_coroutine_threadsafe(budget.spend(), loop).result()
+                    yield Ether(dst="ff:ff:ff:ff:ff:ff")/ARP(pdst=ip)
+
+            results = []
+            pending = [str(ip) for ip in chunk]
+            # One retry for unanswered hosts, done here (not srp's retry) so it is paced too
+            for _ in range(2):
+                ans, unans = srp(requests(pending), timeout=2, verbose=False)
+                for sent, rcve in ans:
+                    results.append({"ip": rcve.psrc, "mac": rcve.hwsrc})
+                    sent_time = getattr(sent, "sent_time", None)
+                    if sent_time:
+                        record_rtt(rcve.psrc, rcve.time - sent_time)
+                pending = [p[ARP].pdst for p in unans]
+                if not pending:
+                    break
+            return results
+
+        async def network_discovery() -> List[Dict[str, str]]:
+            logger.info(f"Triggering Scapy ARP discovery for {target} ({total_chunks} chunks)...")
+            results = []
+            loop = asyncio.get_running_loop()
+            for done, chunk in enumerate(_chunks(networks, chunk_prefix), 1):
+                try:
+                    results.extend(await asyncio.to_thread(arp_chunk, chunk, loop))
+                except Exception as e:
+                    err_str = str(e).lower()
+                    if "winpcap" in err_str or "pcap" in err_str:
+                        logger.warning("Scapy Layer 2 discovery restricted: Npcap/WinPcap not found. Switching to Layer 3 Ping Fallback.")
+                    else:
+                        logger.error(f"Scapy scan failed: {e}")
+                    # The same failure would repeat for every chunk
+                    break
+                await write_async(set_progress, "arp", done)
+            logger.info(f"Scapy discovery found {len(results)} raw responses.")
+            return results
+
+        async def ping_discovery_fallback(skip: set) -> List[Dict[str, str]]:
+            """ICMP sweep of the target hosts ARP did not already find (e.g. routed subnets)."""
             try:
-                # Handle possible multiple targets
-                subnets = target_str.split()
-                all_ips = []
-                for s in subnets:
-                    try:
-                        net = ipaddress.ip_network(s, strict=False)
-                        all_ips.extend(list(net.hosts()))
-                    except:
-                        continue
-                
-                if not all_ips: return []
-
-                logger.info(f"Falling back to Ping Sweep for {len(all_ips)} IPs...")
-                
-                semaphore = asyncio.Semaphore(100) # Faster sweep
-                async def check_ip(ip_obj):
-                    async with semaphore:
-                        ip_str = str(ip_obj)
-                        
-                        def sync_ping():
-                            try:
-                                # Use synchronous subprocess in a thread to avoid event loop issues on Windows
-                                cmd = ["ping", "-n", "1", "-w", "500", ip_str] if sys.platform == "win32" else ["ping", "-c", "1", "-W", "1", ip_str]
-                                # We only care about return code
-                                result = subprocess.run(cmd, capture_output=True, timeout=2)
-                                if result.returncode == 0:
-                                    # Success - try to get MAC from system ARP cache
-                                    mac = get_mac_from_cache(ip_str)
-                                    return mac if mac else "unknown"
-                                return None
-                            except:
-                                return None
-
-                        res = await asyncio.to_thread(sync_ping)
-                        if res is None:
-                            return None # Device didn't respond to ping
-                            
-                        return {"ip": ip_str, "mac": res}
-
-                results = await asyncio.gather(*(check_ip(ip) for ip in all_ips))
-                # Filter out None and deduplicate by IP
-                found_map = {}
-                for r in results:
-                    if r and r["ip"] not in found_map:
-                        found_map[r["ip"]] = r
-                
-                found = list(found_map.values())
+                if not networks: return []
+
+                # Streamed: addresses are generated as the sweep sends, never materialized
+                def hosts():
+                    for done, chunk in enumerate(_chunks(networks, chunk_prefix), 1):
+                        for ip_obj in chunk.hosts():
+                            ip_str = str(ip_obj)
+                            if ip_str not in skip:
+                                yield ip_str
+                        # Runs inside the sweep's send loop, so queue the write without waiting
+                        submit_write_nowait(set_progress, "icmp", done)
+
+                budget = get_scan_budget()
+                logger.info(f"Running ICMP sweep for {target} ({len(skip)} hosts already found by ARP)...")
+                replies = await icmp_sweep(hosts(), timeout=1.0, budget=budget)
+                if replies is None:
+                    logger.info("ICMP sockets unavailable; falling back to ping subprocesses.")
+                    replies = await ping_subprocess_sweep(hosts(), budget)
+
+                for ip_str, rtt in replies.items():
+                    record_rtt(ip_str, rtt)
+
+                # One read of the kernel neighbor table resolves MACs for all responders
+                neighbors = await asyncio.to_thread(read_neighbor_table) if replies else {}
+                found = [{"ip": ip_str, "mac": neighbors.get(ip_str, "unknown")} for ip_str in replies]
                 logger.info(f"Ping Sweep found {len(found)} responsive devices.")
                 return found
             except Exception as e:
                 logger.error(f"Ping sweep failed: {e}", exc_info=True)
                 return []
 
-        def get_mac_from_cache(ip: str) -> Optional[str]:
-            """Retrieves MAC from system ARP table if available."""
-            try:
-                cmd = ["arp", "-a", ip]
-                output = subprocess.check_output(cmd, stderr=subprocess.STDOUT, timeout=2).decode()
-                # Match MAC pattern
-                match = re.search(r"(([0-9a-fA-F]{2}[:-]){5}([0-9a-fA-F]{2}))", output)
-                if match:
-                    return match.group(1).replace('-', ':').lower()
-            except:
-                pass
-            return None
+        async def ping_subprocess_sweep(ips, budget) -> Dict[str, Optional[float]]:
+            """Per-host `ping` processes, for platforms without ICMP socket access."""
+            async def check_ip(ip_str):
+                def sync_ping():
+                    try:
+                        # Use synchronous subprocess in a thread to avoid event loop issues on Windows
+                        cmd = ["ping", "-n", "1", "-w", "500", ip_str] if sys.platform == "win32" else ["ping", "-c", "1", "-W", "1", ip_str]
+                        result = subprocess.run(cmd, capture_output=True, timeout=2)
+                        if result.returncode != 0:
+                            return False, None
+                        rtt = re.search(r"time[=<]([\d.]+)\s*ms", result.stdout.decode(errors="ignore"))
+                        return True, (float(rtt.group(1)) / 1000 if rtt else None)
+                    except:
+                        return False, None
+
+                async with budget.slot(ip_str):
+                    alive, rtt = await asyncio.to_thread(sync_ping)
+                return ip_str, alive, rtt
 
-        arp_results = await asyncio.to_thread(network_discovery)
-        ping_results = await ping_discovery_fallback(target)
+            # Bounded pool of workers pulling from the shared address generator
+            replies = {}
+            async def worker():
+                for ip_str in ips:
+                    ip_str, alive, rtt = await check_ip(ip_str)
+                    if alive:
+                        replies[ip_str] = rtt
+            await asyncio.gather(*(worker() for _ in range(min(budget.max_inflight, 32))))
+            return replies
+
+        arp_results = await network_discovery()
+        ping_results = await ping_discovery_fallback({d["ip"] for d in arp_results})
         
         # Merge results - ARP is highest priority for MACs
         found_map = {d["ip"]: d for d in arp_results}
@@ -250,71 +485,103 @@ async def run_scan_job(scan_id: str, target: str, scan_type: str = "arp", option
         unique_devices = list(found_map.values())
         logger.info(f"Discovery phase complete. Scapy: {len(arp_results)}, Ping: {len(ping_results)}. Unique: {len(unique_devices)}")
 
-        # 3. Parallelize device enrichment
-        semaphore = asyncio.Semaphore(4)
+        # 3. Parallelize device enrichment. Hostnames are resolved in one batch (alongside
+        # the port scans) for devices whose MAC does not already have a name.
+        known = await asyncio.to_thread(
+            _known_hostnames, [d["mac"] for d in unique_devices if d.get("mac") and d["mac"] != "unknown"]
+        )
+        names_task = asyncio.create_task(
+            resolve_hostnames([d["ip"] for d in unique_devices if d.get("mac") not in known])
+        )
+
+        # Hosts with a recently verified port list skip the port scan
+        cached_ports = await asyncio.to_thread(_port_cache, unique_devices, profile)
+        probe_ports = await asyncio.to_thread(get_profile_ports, profile)
+        if unique_devices:
+            logger.info(f"Port cache: {len(cached_ports)}/{len(unique_devices)} hosts reuse their verified ports")
+
         async def process_single_device(device):
-            async with semaphore:
-                ip, mac = device["ip"], device["mac"]
-                hostname = await resolve_hostname(ip)
+            ip, mac = device["ip"], device["mac"]
+            if ip in cached_ports:
+                return {"ip": ip, "mac": mac, "ports_list": cached_ports[ip], "cached": True, "result_id": str(uuid.uuid4())}
+            async with _host_slots:
                 # Perform specialized Port Lookup for classification
-                ports_list = await scan_ports(ip)
-                return {"ip": ip, "mac": mac, "hostname": hostname, "ports_list": ports_list, "result_id": str(uuid.uuid4())}
+                ports_list = await scan_ports(ip, ports=probe_ports, profile=profile)
+                return {"ip": ip, "mac": mac, "ports_list": ports_list, "cached": False, "result_id": str(uuid.uuid4())}
 
         processed_results = []
         if unique_devices:
             processed_results = await asyncio.gather(*(process_single_device(d) for d in unique_devices))
+        try:
+            names = await names_task
+        except Exception as e:
+            logger.warning(f"Hostname resolution failed: {e}")
+            names = {}
+        for res in processed_results:
+            res["hostname"] = known.get(res["mac"]) or names.get(res["ip"])
 
         # 4. Save Results
-        def save_and_update():
-            conn = get_connection()
-            try:
-                save_now = datetime.now(timezone.utc)
-                for res in processed_results:
-                    ip, mac, hostname, ports_list, result_id = res["ip"], res["mac"], res["hostname"], res["ports_list"], res["result_id"]
-                    
-                    conn.execute(
-                        "INSERT INTO scan_results (id, scan_id, ip, mac, hostname, open_ports, first_seen, last_seen) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                        [result_id, scan_id, ip, mac, hostname, json.dumps(ports_list), save_now, save_now]
-                    )
-                conn.commit()
-            finally:
-                conn.close()
+        def save_and_update(conn):
+            save_now = datetime.now(timezone.utc)
+            conn.executemany(
+                "INSERT INTO scan_results (id, scan_id, ip, mac, hostname, open_ports, first_seen, last_seen) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    [res["result_id"], scan_id, res["ip"], res["mac"], res["hostname"], json.dumps(res["ports_list"]), save_now, save_now]
+                    for res in processed_results
+                ]
+            )
         
         if processed_results:
-            await asyncio.to_thread(save_and_update)
+            await write_async(save_and_update)
             from app.services.devices import batch_upsert_devices
-            batch_data = [{"ip": r["ip"], "mac": r["mac"], "hostname": r["hostname"], "ports": r["ports_list"]} for r in processed_results]
+            # Cached port lists are already stored; only freshly probed hosts update (and verify) them
+            batch_data = [
+                {"ip": r["ip"], "mac": r["mac"], "hostname": r["hostname"], "ports": []}
+                if r["cached"] else
+                {"ip": r["ip"], "mac": r["mac"], "hostname": r["hostname"], "ports": r["ports_list"], "probed_ports": probe_ports}
+                for r in processed_results
+            ]
             await batch_upsert_devices(batch_data)
 
-        # 5. Handle Offline state
-        def finalize_scan():
-            conn = get_connection()
+        # 5. Handle Offline state (only for devices inside the scanned networks, since
+        # other scans may be running concurrently for other targets)
+        networks = _target_networks(target)
+        def in_target(ip: str) -> bool:
+            if not networks:
+                return True
             try:
-                final_now = datetime.now(timezone.utc)
-                offline_devices = conn.execute(
-                    "SELECT id, ip, mac, display_name, vendor, icon FROM devices WHERE status = 'online' AND last_seen < ?",
-                    [job_start]
-                ).fetchall()
-                
-                for d_id, d_ip, d_mac, d_name, d_vendor, d_icon in offline_devices:
-                    conn.execute("UPDATE devices SET status = 'offline' WHERE id = ?", [d_id])
-                    conn.execute(
-                        "INSERT INTO device_status_history (id, device_id, status, changed_at) VALUES (?, ?, ?, ?)",
-                        [str(uuid.uuid4()), d_id, 'offline', final_now]
-                    )
-
-                conn.execute("UPDATE scans SET status = 'done', finished_at = ? WHERE id = ?", [final_now, scan_id])
-                conn.commit()
-                return offline_devices
-            finally:
-                conn.close()
-
-        offline_list = await asyncio.to_thread(finalize_scan)
+                addr = ipaddress.ip_address(ip)
+            except ValueError:
+                return False
+            return any(addr in net for net in networks)
+
+        def finalize_scan(conn):
+            final_now = datetime.now(timezone.utc)
+            offline_devices = conn.execute(
+                "SELECT id, ip, mac, display_name, vendor, icon FROM devices WHERE status = 'online' AND last_seen < ?",
+                [job_start]
+            ).fetchall()
+            offline_devices = [d for d in offline_devices if in_target(d[1])]
+            
+            if offline_devices:
+                conn.execute(
+                    f"UPDATE devices SET status = 'offline' WHERE id IN (SELECT id FROM ({json_batch({'id': 'VARCHAR'})}))",
+                    [json.dumps({"id": [d[0] for d in offline_devices]})]
+                )
+                conn.executemany(
+                    "INSERT INTO device_status_history (id, device_id, status, changed_at) VALUES (?, ?, ?, ?)",
+                    [[str(uuid.uuid4()), d[0], 'offline', final_now] for d in offline_devices]
+                )
+
+            conn.execute("UPDATE scans SET status = 'done', finished_at = ? WHERE id = ?", [final_now, scan_id])
+            return offline_devices
+
+        offline_list = await write_async(finalize_scan)
         
         # Publish MQTT
         from app.services.devices import publish_device_offline
         for d_id, d_ip, d_mac, d_name, d_vendor, d_icon in offline_list:
-             await asyncio.to_thread(publish_device_offline, {
+             publish_device_offline({
                 "id": d_id, "ip": d_ip, "mac": d_mac, "hostname": d_name, "vendor": d_vendor,
                 "icon": d_icon, "status": "offline", "timestamp": datetime.now(timezone.utc).isoformat()
             })
@@ -323,12 +590,7 @@ async def run_scan_job(scan_id: str, target: str, scan_type: str = "arp", option
 
     except Exception as e:
         logger.error(f"Scan job {scan_id} failed: {e}")
-        def fail_scan():
-            conn = get_connection()
-            try:
-                conn.execute("UPDATE scans SET status = 'error', finished_at = ?, error_message = ? WHERE id = ?", [datetime.now(timezone.utc), str(e), scan_id])
-                conn.commit()
-            finally:
-                conn.close()
-        await asyncio.to_thread(fail_scan)
+        def fail_scan(conn):
+            conn.execute("UPDATE scans SET status = 'error', finished_at = ?, error_message = ? WHERE id = ?", [datetime.now(timezone.utc), str(e), scan_id])
+        await write_async(fail_scan)
         raise e
@@ -0,0 +1,139 @@
+import asyncio
+import ipaddress
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional
+from app.core.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Passive discovery: a Scapy sniffer thread records who is talking on the LAN (ARP,
+# DHCP requests, mDNS, SSDP) and passive_discovery_loop hands those sightings to
+# batch_upsert_devices in debounced batches.
+BPF_FILTER = "arp or (udp and (port 67 or port 68 or port 5353 or port 1900))"
+
+# mac (or ip when the MAC is unknown) -> {"ip", "mac", "hostname"}
+_pending: Dict[str, Dict[str, Any]] = {}
+_pending_lock = threading.Lock()
+
+def _usable_ip(ip: Optional[str]) -> bool:
+    if not ip:
+        return False
+    try:
+        addr = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return addr.version == 4 and not (addr.is_unspecified or addr.is_multicast or addr.is_loopback or addr.is_link_local)
+
+def _record(ip: Optional[str], mac: Optional[str], hostname: Optional[str] = None):
+    if not _usable_ip(ip):
+        return
+    mac = mac.lower() if mac else None
+    if mac in ("ff:ff:ff:ff:ff:ff", "00:00:00:00:00:00"):
+        mac = None
+    key = mac or ip
+    with _pending_lock:
+        entry = _pending.get(key)
+        if entry is None:
+            _pending[key] = {"ip": ip, "mac": mac, "hostname": hostname}
+        else:
+            entry["ip"] = ip
+            entry["hostname"] = hostname or entry["hostname"]
+
+def _dhcp_option(options, name):
+    for opt in options or []:
+        if isinstance(opt, tuple) and opt and opt[0] == name:
+            return opt[1]
+    return None
+
+def _decode(value) -> Optional[str]:
+    if isinstance(value, bytes):
+        value = value.decode(errors="ignore")
+    if not isinstance(value, str):
+        return None
+    return value.strip().rstrip(".") or None
+
+def _on_packet(pkt):
+    """Runs on the sniffer thread; must stay cheap."""
+    from scapy.all import ARP, BOOTP, DHCP, DNS, DNSRR, IP, Ether
+    try:
+        if pkt.haslayer(ARP):
+            arp = pkt[ARP]
+            # Requests and replies both prove the sender is present (0.0.0.0 probes are skipped)
+            _record(arp.psrc, arp.hwsrc)
+            return
+
+        if not pkt.haslayer(IP):
+            return
+        src_mac = pkt[Ether].src if pkt.haslayer(Ether) else None
+
+        if pkt.haslayer(DHCP) and pkt.haslayer(BOOTP) and pkt[BOOTP].op == 1:
+            bootp = pkt[BOOTP]
+            options = pkt[DHCP].options
+            ip = _dhcp_option(options, "requested_addr") or bootp.ciaddr
+            mac = ":".join(f"{b:02x}" for b in bytes(bootp.chaddr)[:6])
+            _record(ip, mac, _decode(_dhcp_option(options, "hostname")))
+            return
+
+        ip = pkt[IP].src
+        hostname = None
+        if pkt.haslayer(DNS) and pkt[IP].dst == "224.0.0.251":
+            dns = pkt[DNS]
+            # mDNS announcements: "name.local" A records pointing at the sender
+            for rr in dns.an or []:
+                if isinstance(rr, DNSRR) and rr.type == 1 and rr.rdata == ip:
+                    name = _decode(rr.rrname)
+                    if name:
+                        hostname = name[:-len(".local")] if name.endswith(".local") else name
+                        break
+        _record(ip, src_mac, hostname)
+    except Exception as e:
+        logger.debug(f"Passive discovery: could not parse packet: {e}")
+
+def _take_pending() -> Dict[str, Dict[str, Any]]:
+    global _pending
+    with _pending_lock:
+        batch, _pending = _pending, {}
+    return batch
+
+async def passive_discovery_loop():
+    """Runs the sniffer (if passive_discovery_enabled) and flushes sightings periodically."""
+    settings = get_settings()
+    if not settings.passive_discovery_enabled:
+        return
+
+    from scapy.all import AsyncSniffer
+    from app.services.devices import batch_upsert_devices
+
+    try:
+        sniffer = AsyncSniffer(
+            iface=settings.passive_discovery_iface or None,
+            filter=BPF_FILTER, prn=_on_packet, store=False,
+        )
+        sniffer.start()
+    except Exception as e:
+        logger.warning(f"Passive discovery disabled: could not start sniffer: {e}")
+        return
+    logger.info("Passive discovery sniffer started.")
+
+    # key -> (ip, hostname, last flushed at): a device that keeps chattering from the
+    # same address is only re-upserted every passive_discovery_refresh_seconds
+    flushed: Dict[str, tuple] = {}
+    while True:
+        await asyncio.sleep(settings.passive_discovery_flush_seconds)
+        try:
+            now = time.monotonic()
+            batch = []
+            for key, sighting in _take_pending().items():
+                last = flushed.get(key)
+                if (last and last[0] == sighting["ip"] and (last[1] or not sighting["hostname"])
+                        and now - last[2] < settings.passive_discovery_refresh_seconds):
+                    continue
+                flushed[key] = (sighting["ip"], sighting["hostname"] or (last[1] if last else None), now)
+                batch.append({**sighting, "ports": []})
+            if batch:
+                logger.info(f"Passive discovery: upserting {len(batch)} sighted devices")
+                await batch_upsert_devices(batch)
+        except Exception as e:
+            logger.error(f"Error in passive_discovery_loop: {e}")
@@ -19,10 +19,10 @@ class SystemService:
     def create_backup() -> Path:
         """
         DuckDB raw backup by briefly closing the connection and copying.
-        Safe against background tasks via get_db_lock().
+        Safe against background tasks via get_db_lock() and the writer queue.
         """
         import tempfile
-        from app.core.db import close_shared_connection, get_db_lock
+        from app.core.db import close_shared_connection, get_db_lock, run_exclusive
         
         settings = get_settings()
         db_path = Path(settings.db_path)
@@ -30,31 +30,36 @@ class SystemService:
         if not db_path.exists():
             raise FileNotFoundError(f"Database file not found at {db_path}")
 
-        with get_db_lock():
-            # 1. Checkpoint to flush WAL
-            conn = get_connection()
-            try:
-                conn.execute("CHECKPOINT")
-            finally:
-                conn.close()
+        def sync_backup():
+            with get_db_lock():
+                # 1. Checkpoint to flush WAL
+                conn = get_connection()
+                try:
+                    conn.execute("CHECKPOINT")
+                finally:
+                    conn.close()
+
+                # 2. Close shared connection to release file lock
+                logger.info("Closing database connection for backup...")
+                close_shared_connection()
 
-            # 2. Close shared connection to release file lock
-            logger.info("Closing database connection for backup...")
-            close_shared_connection()
+                # 3. Create a temporary file path
+                fd, temp_path = tempfile.mkstemp(suffix=".duckdb")
+                os.close(fd)
+
+                try:
+                    # 4. Copy the file
+                    logger.info(f"Copying database to {temp_path}...")
+                    shutil.copy2(db_path, temp_path)
+                except Exception as e:
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+                    logger.error(f"Backup copy failed: {e}")
+                    raise e
+                return temp_path
 
-            # 3. Create a temporary file path
-            fd, temp_path = tempfile.mkstemp(suffix=".duckdb")
-            os.close(fd)
-            
-            try:
-                # 4. Copy the file
-                logger.info(f"Copying database to {temp_path}...")
-                shutil.copy2(db_path, temp_path)
-            except Exception as e:
-                if os.path.exists(temp_path):
-                    os.remove(temp_path)
-                logger.error(f"Backup copy failed: {e}")
-                raise e
+        # Runs on the writer thread so no grouped write is in flight during the copy
+        temp_path = run_exclusive(sync_backup)
         
         return Path(temp_path)
 
@@ -64,7 +69,7 @@ class SystemService:
         Restore the database by replacing the current file.
         Holds get_db_lock() to prevent any other database access.
         """
-        from app.core.db import get_db_lock
+        from app.core.db import get_db_lock, run_exclusive
         settings = get_settings()
         db_path = Path(settings.db_path)
         backup_db_path = db_path.with_suffix(".duckdb.bak")
@@ -108,4 +113,4 @@ class SystemService:
                     if backup_db_path.exists():
                         backup_db_path.unlink()
 
-        return await asyncio.to_thread(sync_restore)
+        return await asyncio.to_thread(run_exclusive, sync_restore)
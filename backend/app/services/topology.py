@@ -1,6 +1,6 @@
 import logging
 from typing import Dict, Any, List
-from app.core.db import get_connection
+from app.core.db import get_read_connection
 
 logger = logging.getLogger(__name__)
 
@@ -10,7 +10,7 @@ class TopologyService:
         Generates a graph representation of the network.
         Currently implements a simple Star Topology (Gateway -> Devices).
         """
-        conn = get_connection()
+        conn = get_read_connection()
         try:
             # Fetch all active devices
             rows = conn.execute(
@@ -1,51 +1,125 @@
 import asyncio
 import logging
-from typing import Optional
+from typing import Dict, Optional
 from datetime import datetime, timedelta, timezone
 import json
-from app.core.db import get_connection
-from app.services.scans import run_scan_job
+from app.core.db import get_connection, write_async
+from app.core.config import get_settings
+from app.services.scans import run_deep_scan_job, run_scan_job
 
 logger = logging.getLogger(__name__)
+# Retry delay after the scheduler itself failed
 POLL_INTERVAL_SECONDS = 5
+# Longest the scheduler sleeps without a due job; bounds the MQTT health check interval
+MAX_IDLE_SECONDS = 60
+# Longest the scan runner sleeps without a wakeup (safety net only)
+SCAN_RUNNER_IDLE_SECONDS = 60
+
+# scans.priority: higher runs first. Interactive scans (API) may also use one slot
+# beyond max_concurrent_scans so they never wait behind a long periodic sweep.
+SCAN_PRIORITY_SCHEDULED = 0
+SCAN_PRIORITY_INTERACTIVE = 10
+
+# Both loops sleep until their next due time and are woken early by these events.
+# wake_scheduler() / wake_scan_runner() may be called from any thread.
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_scheduler_wakeup = asyncio.Event()
+_scan_wakeup = asyncio.Event()
+# Integration syncs currently running (so a slow sync is not started twice)
+_running_syncs = set()
+# Scans currently running in this process: scan_id -> priority
+_active_scans: Dict[str, int] = {}
+
+def _wake(event: asyncio.Event):
+    if _loop is None:
+        return
+    try:
+        _loop.call_soon_threadsafe(event.set)
+    except RuntimeError:
+        # Event loop already closed (shutdown)
+        pass
+
+def wake_scheduler():
+    """Makes the scheduler re-read schedules and config, e.g. after they were edited."""
+    _wake(_scheduler_wakeup)
+
+def wake_scan_runner():
+    """Makes the scan runner pick up newly queued scans immediately."""
+    _wake(_scan_wakeup)
+
+async def _sleep_until_woken(event: asyncio.Event, timeout: float) -> bool:
+    """Sleeps up to timeout seconds; returns True if the event woke us."""
+    try:
+        await asyncio.wait_for(event.wait(), timeout=max(timeout, 0))
+        return True
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        event.clear()
 
 async def scheduler_loop():
-    from app.services.mqtt import MQTTManager
+    from app.services.mqtt import check_mqtt_health
+    global _loop
+    _loop = asyncio.get_running_loop()
+    next_due = None
     while True:
+        now = datetime.now(timezone.utc)
         try:
-            # 1. Handle background schedules
-            await handle_schedules()
+            # 1. Handle background schedules (only when something is due or changed)
+            if next_due is None or now >= next_due:
+                next_due = await handle_schedules()
+                now = datetime.now(timezone.utc)
             
-            # 2. Check MQTT Health
-            MQTTManager.get_instance().check_health()
+            # 2. Check MQTT Health (manager is created at startup by init_mqtt)
+            check_mqtt_health()
             
         except Exception as e:
             logger.error(f"Error in scheduler_loop: {e}")
-        await asyncio.sleep(POLL_INTERVAL_SECONDS)
+            next_due = now + timedelta(seconds=POLL_INTERVAL_SECONDS)
+
+        timeout = MAX_IDLE_SECONDS
+        if next_due is not None:
+            timeout = min(timeout, (next_due - now).total_seconds())
+        if await _sleep_until_woken(_scheduler_wakeup, timeout):
+            next_due = None
 
 async def scan_runner_loop():
-    last_cleanup = datetime.min.replace(tzinfo=timezone.utc)
+    global _loop
+    _loop = asyncio.get_running_loop()
     while True:
+        started = 0
         try:
-            now = datetime.now(timezone.utc)
-            # Only cleanup stale scans every 60 seconds
-            run_cleanup = (now - last_cleanup).total_seconds() > 60
-            
-            job = await handle_queued_scans(cleanup=run_cleanup)
-            if run_cleanup:
-                last_cleanup = now
-                
+            # Scans left running by a previous process are marked interrupted once at
+            # startup (cleanup_stale_scans); a long scan running here is never timed out
+            started = await handle_queued_scans()
         except Exception as e:
             logger.error(f"Error in scan_runner_loop: {e}")
             
-        # Sleep 2s to reduce idle CPU (responsiveness is still good enough)
-        await asyncio.sleep(2)
+        if started:
+            # Slots may remain (e.g. the interactive one); check again right away
+            continue
+        # Idle until a scan is enqueued or a running scan finishes
+        await _sleep_until_woken(_scan_wakeup, SCAN_RUNNER_IDLE_SECONDS)
+
+async def retention_loop():
+    """Periodically folds old traffic history into the rollup tiers."""
+    from app.core.config import get_settings
+    from app.services.retention import compact_traffic_history
+    interval = get_settings().traffic_compaction_interval_seconds
+    while True:
+        try:
+            await asyncio.to_thread(compact_traffic_history)
+        except Exception as e:
+            logger.error(f"Error in retention_loop: {e}")
+        await asyncio.sleep(interval)
 
-async def handle_schedules():
+async def handle_schedules() -> Optional[datetime]:
+    """Starts every due job and returns when the next one is due (None if nothing is scheduled)."""
     def sync_check():
         conn = get_connection()
         try:
             now = datetime.now(timezone.utc)
+            due_times = []
             # 1. Fetch Config for Global Discovery
             config_rows = conn.execute("SELECT key, value FROM config WHERE key IN ('scan_subnets', 'scan_interval', 'last_discovery_run_at')").fetchall()
             config = {r[0]: r[1] for r in config_rows}
@@ -71,19 +145,27 @@ async def handle_schedules():
                     logger.info(f"Global discovery interval reached ({diff}s since last run, interval: {scan_interval}s). Triggering.")
                     trigger_global = True
                 else:
-                    wait_time = (last_run + timedelta(seconds=scan_interval) - now).total_seconds()
-                    # logger.debug(f"Global discovery interval not reached. Waiting {wait_time:.1f}s more.")
-                    pass
+                    due_times.append(last_run + timedelta(seconds=scan_interval))
+                if trigger_global:
+                    due_times.append(now + timedelta(seconds=scan_interval))
 
             # 2. Handle specific schedules
             rows = conn.execute(
                 """
-                SELECT id, scan_type, target, interval_seconds
+                SELECT id, scan_type, target, interval_seconds, COALESCE(profile, 'standard')
                 FROM scan_schedules
                 WHERE enabled = TRUE AND (next_run_at IS NULL OR next_run_at <= ?)
                 """,
                 [now],
             ).fetchall()
+            # Time until the next schedule that is not due yet (computed in the DB's own timestamp terms)
+            sched_wait = conn.execute(
+                "SELECT MIN(next_run_at) - CAST(? AS TIMESTAMP) FROM scan_schedules WHERE enabled = TRUE AND next_run_at > ?",
+                [now, now],
+            ).fetchone()[0]
+            if sched_wait is not None:
+                due_times.append(now + sched_wait)
+            due_times.extend(now + timedelta(seconds=r[3]) for r in rows)
             
             # 3. Handle OpenWRT Integration
             trigger_openwrt = False
@@ -95,7 +177,7 @@ async def handle_schedules():
                     if ow_row:
                         ow_config = json.loads(ow_row[0])
                         # Config: url, username, password, interval (mins), last_sync (iso)
-                        if ow_config.get("url") and ow_config.get("username"):
+                        if ow_config.get("url") and ow_config.get("username") and "openwrt" not in _running_syncs:
                             interval_mins = int(ow_config.get("interval", 15))
                             last_sync_str = ow_config.get("last_sync")
                             
@@ -106,6 +188,8 @@ async def handle_schedules():
                                 last_sync = datetime.fromisoformat(last_sync_str)
                                 if now >= last_sync + timedelta(minutes=interval_mins):
                                     should_run = True
+                                else:
+                                    due_times.append(last_sync + timedelta(minutes=interval_mins))
                             
                             if should_run:
                                 trigger_openwrt = True
@@ -123,7 +207,7 @@ async def handle_schedules():
                     if ag_row:
                         ag_config = json.loads(ag_row[0])
                         # Config: url, username, password, interval (mins), last_sync (iso)
-                        if ag_config.get("url") and ag_config.get("username"):
+                        if ag_config.get("url") and ag_config.get("username") and "adguard" not in _running_syncs:
                             interval_mins = int(ag_config.get("interval", 15))
                             last_sync_str = ag_config.get("last_sync")
                             
@@ -132,8 +216,12 @@ async def handle_schedules():
                                 should_run = True
                             else:
                                 last_sync = datetime.fromisoformat(last_sync_str)
-                                if now >= last_sync + timedelta(minutes=interval_mins):
+                                # Previous sync hit its page budget; drain the backlog every minute
+                                wait_mins = 1 if ag_config.get("querylog_cursor") else interval_mins
+                                if now >= last_sync + timedelta(minutes=wait_mins):
                                     should_run = True
+                                else:
+                                    due_times.append(last_sync + timedelta(minutes=wait_mins))
                             
                             if should_run:
                                 trigger_adguard = True
@@ -141,12 +229,15 @@ async def handle_schedules():
             except Exception as e:
                 logger.error(f"Error checking AdGuard schedule: {e}")
 
-            return trigger_global, scan_subnets_raw, rows, now, trigger_openwrt, openwrt_conf, trigger_adguard, adguard_conf
+            next_due = min(due_times) if due_times else None
+            return trigger_global, scan_subnets_raw, rows, now, trigger_openwrt, openwrt_conf, trigger_adguard, adguard_conf, next_due
         finally:
             conn.close()
 
-    trigger_global, scan_subnets_raw, schedule_rows, now, trigger_openwrt, openwrt_conf, trigger_adguard, adguard_conf = await asyncio.to_thread(sync_check)
+    trigger_global, scan_subnets_raw, schedule_rows, now, trigger_openwrt, openwrt_conf, trigger_adguard, adguard_conf, next_due = await asyncio.to_thread(sync_check)
 
+    # A due scan whose target is still queued or running is not enqueued again; it stays
+    # due, and the scheduler is woken when that scan ends (_run_job, scan cancel routes)
     if trigger_global:
         target = None
         try:
@@ -159,28 +250,18 @@ async def handle_schedules():
         if target:
             enqueued = await enqueue_scan(target, "arp")
             if enqueued:
-                def update_last_run():
-                    conn = get_connection()
-                    try:
-                        # Use isoformat(timespec='seconds') for cleaner storage
-                        conn.execute("INSERT OR REPLACE INTO config (key, value, updated_at) VALUES ('last_discovery_run_at', ?, ?)", [now.isoformat(), now])
-                        from app.core.db import commit
-                        commit()
-                    finally: conn.close()
-                await asyncio.to_thread(update_last_run)
+                def update_last_run(conn):
+                    # Use isoformat(timespec='seconds') for cleaner storage
+                    conn.execute("INSERT OR REPLACE INTO config (key, value, updated_at) VALUES ('last_discovery_run_at', ?, ?)", [now.isoformat(), now])
+                await write_async(update_last_run)
 
-    for sched_id, scan_type, target, interval in schedule_rows:
-        enqueued = await enqueue_scan(target, scan_type)
+    for sched_id, scan_type, target, interval, profile in schedule_rows:
+        enqueued = await enqueue_scan(target, scan_type, profile=profile)
         if enqueued:
-            def update_sched():
-                conn = get_connection()
-                try:
-                    next_run_at = now + timedelta(seconds=interval)
-                    conn.execute("UPDATE scan_schedules SET last_run_at = ?, next_run_at = ? WHERE id = ?", [now, next_run_at, sched_id])
-                    from app.core.db import commit
-                    commit()
-                finally: conn.close()
-            await asyncio.to_thread(update_sched)
+            def update_sched(conn):
+                next_run_at = now + timedelta(seconds=interval)
+                conn.execute("UPDATE scan_schedules SET last_run_at = ?, next_run_at = ? WHERE id = ?", [now, next_run_at, sched_id])
+            await write_async(update_sched)
 
     if trigger_openwrt:
         from app.services.openwrt import OpenWRTClient
@@ -191,23 +272,22 @@ async def handle_schedules():
                 await asyncio.to_thread(client.sync)
                 
                 # Update last_sync
-                def update_ts():
-                    conn = get_connection()
-                    try:
-                        # fetch again to merge
-                        row = conn.execute("SELECT config FROM integrations WHERE name = 'openwrt'").fetchone()
-                        if row:
-                            c = json.loads(row[0])
-                            c["last_sync"] = datetime.now(timezone.utc).isoformat()
-                            conn.execute("UPDATE integrations SET config = ? WHERE name = 'openwrt'", [json.dumps(c)])
-                            from app.core.db import commit
-                            commit()
-                    finally: conn.close()
-                await asyncio.to_thread(update_ts)
+                def update_ts(conn):
+                    # fetch again to merge
+                    row = conn.execute("SELECT config FROM integrations WHERE name = 'openwrt'").fetchone()
+                    if row:
+                        c = json.loads(row[0])
+                        c["last_sync"] = datetime.now(timezone.utc).isoformat()
+                        conn.execute("UPDATE integrations SET config = ? WHERE name = 'openwrt'", [json.dumps(c)])
+                await write_async(update_ts)
                 logger.info("OpenWRT sync completed.")
             except Exception as e:
                 logger.error(f"OpenWRT sync failed: {e}")
+            finally:
+                _running_syncs.discard("openwrt")
+                wake_scheduler()
         
+        _running_syncs.add("openwrt")
         asyncio.create_task(run_openwrt_sync())
 
     if trigger_adguard:
@@ -219,86 +299,107 @@ async def handle_schedules():
                 await asyncio.to_thread(client.sync)
                 
                 # Update last_sync
-                def update_ag_ts():
-                    conn = get_connection()
-                    try:
-                        # fetch again to merge
-                        row = conn.execute("SELECT config FROM integrations WHERE name = 'adguard'").fetchone()
-                        if row:
-                            c = json.loads(row[0])
-                            c["last_sync"] = datetime.now(timezone.utc).isoformat()
-                            conn.execute("UPDATE integrations SET config = ? WHERE name = 'adguard'", [json.dumps(c)])
-                            from app.core.db import commit
-                            commit()
-                    finally: conn.close()
-                await asyncio.to_thread(update_ag_ts)
+                def update_ag_ts(conn):
+                    # fetch again to merge
+                    row = conn.execute("SELECT config FROM integrations WHERE name = 'adguard'").fetchone()
+                    if row:
+                        c = json.loads(row[0])
+                        c["last_sync"] = datetime.now(timezone.utc).isoformat()
+                        conn.execute("UPDATE integrations SET config = ? WHERE name = 'adguard'", [json.dumps(c)])
+                await write_async(update_ag_ts)
                 logger.info("AdGuard sync completed.")
             except Exception as e:
                 logger.error(f"AdGuard sync failed: {e}")
+            finally:
+                _running_syncs.discard("adguard")
+                wake_scheduler()
         
+        _running_syncs.add("adguard")
         asyncio.create_task(run_adguard_sync())
 
-async def enqueue_scan(target: str, scan_type: str) -> Optional[str]:
+    return next_due
+
+async def enqueue_scan(
+    target: str, scan_type: str, priority: int = SCAN_PRIORITY_SCHEDULED,
+    profile: str = "standard", options: Optional[dict] = None,
+) -> Optional[str]:
     from uuid import uuid4
-    def sync_enqueue():
-        conn = get_connection()
-        try:
-            t = target.strip()
-            now = datetime.now(timezone.utc)
-            
-            # Check for exactly same scan (target + type) already queued or running
-            active = conn.execute(
-                "SELECT id FROM scans WHERE status IN ('queued', 'running') AND target = ? AND scan_type = ?", 
-                [t, scan_type]
-            ).fetchone()
-            
-            if active:
-                logger.info(f"Scan for {t} ({scan_type}) already in progress. Skipping.")
-                return None
+    def sync_enqueue(conn):
+        t = target.strip()
+        now = datetime.now(timezone.utc)
+        
+        # Check for exactly same scan (target + type) already queued or running.
+        # Runs on the writer thread, so check-then-insert cannot race.
+        active = conn.execute(
+            "SELECT id FROM scans WHERE status IN ('queued', 'running') AND target = ? AND scan_type = ?", 
+            [t, scan_type]
+        ).fetchone()
+        
+        if active:
+            logger.info(f"Scan for {t} ({scan_type}) already in progress. Skipping.")
+            return None
 
-            scan_id = str(uuid4())
-            conn.execute("INSERT INTO scans (id, target, scan_type, status, created_at) VALUES (?, ?, ?, 'queued', ?)", [scan_id, t, scan_type, now])
-            from app.core.db import commit
-            commit()
-            return scan_id
-        finally:
-            conn.close()
-    return await asyncio.to_thread(sync_enqueue)
+        scan_id = str(uuid4())
+        conn.execute(
+            "INSERT INTO scans (id, target, scan_type, options, status, created_at, priority, profile) VALUES (?, ?, ?, ?, 'queued', ?, ?, ?)",
+            [scan_id, t, scan_type, json.dumps(options) if options else None, now, priority, profile]
+        )
+        return scan_id
+    scan_id = await write_async(sync_enqueue)
+    if scan_id:
+        wake_scan_runner()
+    return scan_id
 
-async def handle_queued_scans(cleanup=False):
-    def get_job():
-        conn = get_connection()
+async def handle_queued_scans() -> int:
+    """Starts queued scans while slots are free. Returns the number of scans started."""
+    slots = max(1, get_settings().max_concurrent_scans)
+    limit, min_priority = slots - len(_active_scans), None
+    if limit <= 0:
+        # All regular slots busy: only an interactive scan may take the extra slot
+        if any(p >= SCAN_PRIORITY_INTERACTIVE for p in _active_scans.values()):
+            limit = 0
+        else:
+            limit, min_priority = 1, SCAN_PRIORITY_INTERACTIVE
+    if limit <= 0:
+        return 0
+
+    def get_jobs(conn):
+        now = datetime.now(timezone.utc)
+        
+        rows = conn.execute(
+            """
+            SELECT id, target, scan_type, COALESCE(priority, 0), options, profile FROM scans
+            WHERE status = 'queued' AND COALESCE(priority, 0) >= ?
+            ORDER BY COALESCE(priority, 0) DESC, created_at ASC LIMIT ?
+            """,
+            [min_priority if min_priority is not None else -2**31, limit]
+        ).fetchall()
+        
+        for row in rows:
+            conn.execute("UPDATE scans SET status='running', started_at=? WHERE id=?", [now, row[0]])
+        return rows
+
+    jobs = await write_async(get_jobs)
+    for scan_id, target, scan_type, priority, options, profile in jobs:
+        _active_scans[scan_id] = priority
         try:
-            now = datetime.now(timezone.utc)
-            
-            if cleanup:
-                # Re-clean stale scans (interrupted)
-                stale_cutoff = now - timedelta(minutes=20)
-                conn.execute(
-                    "UPDATE scans SET status='error', finished_at=?, error_message='Job timed out or interrupted' WHERE status='running' AND started_at < ?", 
-                    [now, stale_cutoff]
-                )
-            
-            # One scan at a time for stability on Pi
-            row = conn.execute(
-                "SELECT id, target, scan_type FROM scans WHERE status = 'queued' ORDER BY created_at ASC LIMIT 1"
-            ).fetchone()
-            
-            if row:
-                conn.execute("UPDATE scans SET status='running', started_at=? WHERE id=?", [now, row[0]])
-            
-            from app.core.db import commit
-            commit()
-            return row
-        finally:
-            conn.close()
+            options = json.loads(options) if options else None
+        except ValueError:
+            options = None
+        asyncio.create_task(_run_job(scan_id, target, scan_type, options, profile))
+    return len(jobs)
 
-    job = await asyncio.to_thread(get_job)
-    if not job: return
-    
-    scan_id, target, scan_type = job
+async def _run_job(scan_id: str, target: str, scan_type: str, options: Optional[dict], profile: Optional[str]):
     try:
-        await run_scan_job(scan_id, target, scan_type)
+        if scan_type == "deep":
+            await run_deep_scan_job(scan_id, (options or {}).get("device_id"), target, profile=profile)
+        else:
+            await run_scan_job(scan_id, target, scan_type, options, profile=profile)
         # Note: run_scan_job now marks itself as 'done' or 'error' 
     except Exception as e:
         logger.error(f"Unexpected top-level worker error for {scan_id}: {e}")
+    finally:
+        _active_scans.pop(scan_id, None)
+        wake_scan_runner()
+        # A schedule skipped while this scan was active may be due now
+        wake_scheduler()